@@ -1,8 +1,16 @@
+from collections import OrderedDict
+import json
 import logging
+import time
 
-from django.db import models
+from celery.task import task
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.db import models, transaction
+from django.utils import timezone
 from polymorphic.models import PolymorphicModel
 
+from cabot.cabotapp import defs, monitor
 from cabot.cabotapp.utils import create_failing_service_mock
 
 logger = logging.getLogger(__name__)
@@ -25,6 +33,23 @@ class AlertPlugin(PolymorphicModel):
         """
         return True
 
+    def send_alerts(self, alerts, duty_officers):
+        """
+        Send alerts for several services that alerted within ALERT_COALESCE_SECONDS to the same duty officers.
+        Override this to send them as one notification (raising if it fails); the default calls send_alert() for
+        each service.
+        :param alerts: list of (service, users to notify)
+        :return: the alerts that couldn't be sent, which go to the fallback officers
+        """
+        failed = []
+        for service, users in alerts:
+            try:
+                self.send_alert(service, users, duty_officers)
+            except Exception:
+                logger.exception('Could not send {} alert for service {}'.format(self.name, service.pk))
+                failed.append((service, users))
+        return failed
+
     def send_test_alert(self, user):
         """
         Send a test alert when the user requests it (to make sure config is valid).
@@ -63,18 +88,110 @@ class AlertPluginUserData(PolymorphicModel):
         return True
 
 
+class PendingAlert(models.Model):
+    """
+    A service's alert waiting to be sent through a plugin to some duty officers, so alerts to the same people within
+    ALERT_COALESCE_SECONDS are sent together (see send_alerts_async()).
+    """
+    alert = models.ForeignKey(AlertPlugin, on_delete=models.CASCADE)
+    service = models.ForeignKey('Service', on_delete=models.CASCADE)
+    # json [duty officer ids, fallback officer ids]
+    recipients = models.TextField()
+    created_at = models.DateTimeField(default=timezone.now)
+    # the service's status when it alerted, which plugins see rather than its status when the alert is sent
+    overall_status = models.TextField(default=defs.PASSING_STATUS)
+    old_overall_status = models.TextField(default=defs.PASSING_STATUS)
+    # json list of the ids of the checks that were failing
+    failing_check_ids = models.TextField(default='[]')
+
+    def alerting_service(self):
+        # type: () -> Service
+        """The service, with the status it had when it alerted (see Service.alert_failing_check_ids)."""
+        service = self.service
+        service.overall_status = self.overall_status
+        service.old_overall_status = self.old_overall_status
+        service.alert_failing_check_ids = json.loads(self.failing_check_ids)
+        return service
+
+
+def _send_plugin_alerts(alert, alerts, duty_officers, fallback_officers):
+    try:
+        failed = alert.send_alerts(alerts, duty_officers) or []
+    except Exception:
+        logger.exception('Could not send {} alert'.format(alert.name))
+        failed = alerts
+    if failed and fallback_officers:
+        # only the services the duty officers didn't get
+        try:
+            if alert.send_alerts(failed, fallback_officers):
+                logger.error('Could not send {} alert to fallback officer'.format(alert.name))
+        except Exception:
+            logger.exception('Could not send {} alert to fallback officer'.format(alert.name))
+
+
 def send_alert(service, duty_officers=[], fallback_officers=[]):
     users = service.users_to_notify.filter(is_active=True)
     for alert in service.alerts.all():
-        try:
-            alert.send_alert(service, users, duty_officers)
-        except Exception:
-            logging.exception('Could not sent {} alert'.format(alert.name))
-            if fallback_officers:
-                try:
-                    alert.send_alert(service, users, fallback_officers)
-                except Exception:
-                    logging.exception('Could not send {} alert to fallback officer'.format(alert.name))
+        _send_plugin_alerts(alert, [(service, users)], duty_officers, fallback_officers)
+
+
+def send_alerts_async(service, recipients):
+    # type: (Service, List[Tuple[List[User], List[User]]]) -> None
+    """
+    Queue the service's alert to be sent through each plugin from the alert queue, so the plugins send it concurrently
+    and a slow one doesn't hold up the others (or the service update). Alerts through the same plugin to the same
+    people within ALERT_COALESCE_SECONDS are sent together, so a shared dependency failing doesn't flood them.
+    :param recipients: (duty officers, fallback officers) for each schedule, [([], [])] for only users_to_notify
+    """
+    now = timezone.now()
+    failing_check_ids = json.dumps(list(service.all_failing_checks().order_by('pk').values_list('pk', flat=True)))
+    pending = [PendingAlert(alert_id=alert_id, service=service, created_at=now,
+                            overall_status=service.overall_status, old_overall_status=service.old_overall_status,
+                            failing_check_ids=failing_check_ids,
+                            recipients=json.dumps([[user.pk for user in duty_officers],
+                                                   [user.pk for user in fallback_officers]]))
+               for alert_id in service.alerts.values_list('id', flat=True)
+               for duty_officers, fallback_officers in recipients]
+    PendingAlert.objects.bulk_create(pending)
+    for alert in pending:
+        send_pending_alerts.apply_async((alert.alert_id, alert.recipients), countdown=settings.ALERT_COALESCE_SECONDS)
+
+
+def _users(user_ids):
+    # type: (List[int]) -> List[User]
+    users = User.objects.in_bulk(user_ids)
+    return [users[pk] for pk in user_ids if pk in users]
+
+
+# the fallback officers get the rest of the hard limit if the duty officers' alert times out
+@task(ignore_result=True, soft_time_limit=settings.ALERT_PLUGIN_TIMEOUT, time_limit=2 * settings.ALERT_PLUGIN_TIMEOUT)
+def send_pending_alerts(alert_id, recipients):
+    # type: (int, str) -> None
+    """
+    Send the pending alerts through one plugin to the same recipients together (see send_alerts_async()), and record
+    how long after the first service alerted they were delivered.
+    """
+    with transaction.atomic():
+        pending = list(PendingAlert.objects.select_for_update().filter(alert_id=alert_id, recipients=recipients)
+                       .select_related('service').order_by('created_at', 'id'))
+        PendingAlert.objects.filter(pk__in=[p.pk for p in pending]).delete()
+    alert = AlertPlugin.objects.filter(pk=alert_id).first()
+    if not pending or alert is None:
+        # already sent along with an earlier alert, or the plugin was deleted
+        return
+
+    start = time.time()
+    # a service that alerted more than once is sent once per transition (e.g. failing, then passing again)
+    services = OrderedDict(((p.service_id, p.old_overall_status, p.overall_status, p.failing_check_ids),
+                            p.alerting_service()) for p in pending)
+    alerts = [(service, service.users_to_notify.filter(is_active=True)) for service in services.values()]
+    duty_officer_ids, fallback_officer_ids = json.loads(recipients)
+    _send_plugin_alerts(alert, alerts, _users(duty_officer_ids), _users(fallback_officer_ids))
+
+    latency = (timezone.now() - pending[0].created_at).total_seconds()
+    logger.info('Sent %s alert for %s services in %.2fs, %.2fs after the first one alerted',
+                alert.name, len(services), time.time() - start, latency)
+    monitor.put_metric('alert.{}.latency'.format(alert.name), latency, unit='Seconds')
 
 
 def update_alert_plugins():
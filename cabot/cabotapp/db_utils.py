@@ -0,0 +1,62 @@
+from django.db import connection
+from django.db.models import Func, IntegerField
+
+
+# django 1.11's bulk_create() can't ignore conflicts, so we write the statement ourselves
+_INSERT_IGNORE_SQL = {
+    'postgresql': 'INSERT INTO {table} ({columns}) VALUES {values} ON CONFLICT DO NOTHING',
+    'mysql': 'INSERT IGNORE INTO {table} ({columns}) VALUES {values}',
+    'sqlite': 'INSERT OR IGNORE INTO {table} ({columns}) VALUES {values}',
+}
+
+
+def insert_ignore(model, field_names, rows, batch_size=100):
+    # type: (Type[models.Model], List[str], List[Tuple], int) -> None
+    """
+    Insert rows in statements of up to batch_size rows (fewer if the database limits query parameters, like sqlite),
+    skipping any that conflict with an existing row (e.g. duplicate primary key). Model.save() and signals are not
+    called.
+    :param model: model class to insert into
+    :param field_names: names of the fields being set
+    :param rows: list of tuples of values, in the same order as field_names
+    """
+    if not rows:
+        return
+
+    fields = [model._meta.get_field(name) for name in field_names]
+    batch_size = max(min(batch_size, connection.ops.bulk_batch_size(fields, rows)), 1)
+    qn = connection.ops.quote_name
+    row_sql = '({})'.format(', '.join(['%s'] * len(fields)))
+
+    with connection.cursor() as cursor:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            sql = _INSERT_IGNORE_SQL[connection.vendor].format(
+                table=qn(model._meta.db_table),
+                columns=', '.join(qn(f.column) for f in fields),
+                values=', '.join([row_sql] * len(batch)),
+            )
+            params = [f.get_db_prep_save(value, connection) for row in batch for f, value in zip(fields, row)]
+            cursor.execute(sql, params)
+
+
+class TimeBucket(Func):
+    """
+    The number of the `seconds` long bucket starting at `start` (in seconds since the epoch) that a datetime falls
+    in, e.g. for grouping rows by time in the database. Only meaningful for datetimes after start.
+    """
+    template = 'CAST(FLOOR((EXTRACT(EPOCH FROM %(expressions)s) - %(start)s) / %(seconds)s) AS INTEGER)'
+
+    def __init__(self, expression, start, seconds, **extra):
+        # type: (Union[str, Expression], int, int, **Any) -> None
+        super(TimeBucket, self).__init__(expression, start=int(start), seconds=int(seconds),
+                                         output_field=IntegerField(), **extra)
+
+    def as_sqlite(self, compiler, connection):
+        # the %s is escaped twice, for the template and the query params
+        return self.as_sql(compiler, connection,
+                           template="((CAST(strftime('%%%%s', %(expressions)s) AS INTEGER) - %(start)s) / %(seconds)s)")
+
+    def as_mysql(self, compiler, connection):
+        return self.as_sql(compiler, connection,
+                           template='FLOOR((UNIX_TIMESTAMP(%(expressions)s) - %(start)s) / %(seconds)s)')
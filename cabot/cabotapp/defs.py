@@ -16,6 +16,43 @@ CRITICAL_STATUS = 'CRITICAL'
 
 RAW_DATA_LIMIT = 500000
 
+# which results keep their raw data (e.g. the response body), see StatusCheck.raw_data_policy
+RAW_DATA_ALWAYS = 'always'
+RAW_DATA_FAILURES = 'failures'
+RAW_DATA_TRANSITIONS = 'transitions'
+RAW_DATA_NEVER = 'never'
+RAW_DATA_POLICIES = (
+    (RAW_DATA_ALWAYS, 'All results'),
+    (RAW_DATA_FAILURES, 'Failed results'),
+    (RAW_DATA_TRANSITIONS, 'Results that differ from the previous one'),
+    (RAW_DATA_NEVER, 'No results'),
+)
+
+# how long a process trusts its cache of existing StatusCheckResultTags (must be much less than result retention)
+TAG_CACHE_TTL_SECONDS = 60 * 60
+TAG_CACHE_MAX_SIZE = 10000
+# clean_orphaned_tags only looks at tags that no new result has used for this long (must be more than the cache TTL),
+# this many at a time
+TAG_UNUSED_DAYS = 7
+TAG_CLEANUP_BATCH_SIZE = 1000
+
+# how many days of partitions to create in advance, for partitioned tables (see cabot.cabotapp.partitions)
+PARTITION_DAYS_AHEAD = 7
+
+# clean_db deletes in batches of ids, sized to take about RETENTION_TARGET_BATCH_SECONDS each (see
+# cabot.cabotapp.retention), for up to CLEAN_DB_TIME_LIMIT_SECONDS before handing off to a new task
+RETENTION_MIN_BATCH_SIZE = 100
+RETENTION_MAX_BATCH_SIZE = 50000
+RETENTION_TARGET_BATCH_SECONDS = 1.0
+CLEAN_DB_TIME_LIMIT_SECONDS = 60
+
+# the shift list page refreshes a schedule's shifts in the background if they haven't been checked against its iCal
+# feed for this long (update_shifts_and_problems checks them every UPDATE_SHIFTS_FREQUENCY)
+SHIFTS_STALE_SECONDS = 5 * 60
+
+# compact_rollups recomputes the rollups for this many hours back, to pick up results saved late
+ROLLUP_RECOMPUTE_HOURS = 2
+
 DEFAULT_CHECK_FREQUENCY = 5
 DEFAULT_CHECK_RETRIES = 0
 
@@ -31,6 +68,10 @@ TIMESTAMP_FORMAT = "%b %d, %Y, %H:%M %Z"  # Eg: "Dec 10, 2018, 21:34 UTC"
 # options to present in the dropdown on the for creating an ack
 EXPIRE_AFTER_HOURS_OPTIONS = [1, 2, 4, 8, 12, 24, 48, 72]
 
+# the per-process index of each check's acks (see AckIndex) also keeps the acks closed this recently, for results that
+# completed before they were closed
+ACK_INDEX_CLOSED_SECONDS = 10 * 60
+
 # number of closed acks to show at the bottom of the acknowledgements page
 NUM_VISIBLE_CLOSED_ACKS = 12
 
@@ -38,3 +79,9 @@ NUM_VISIBLE_CLOSED_ACKS = 12
 ACK_UPDATE_SERVICE_TIMEOUT_SECONDS = 5.0
 ACK_SERVICE_NOT_YET_UPDATED_MSG = "Check still running; there may be some delay until the " \
                                   "check and service have the 'acked' status."
+
+# service history graph: hours shown by default and the most allowed, and the max number of points per request
+SERVICE_HISTORY_HOURS = 24
+SERVICE_HISTORY_MAX_HOURS = 24 * 31
+SERVICE_HISTORY_POINTS = 288
+SERVICE_HISTORY_MAX_POINTS = 2000
@@ -1,8 +1,13 @@
+import zlib
+
 from django import forms
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.query_utils import DeferredAttribute
 from django.utils import timezone
+from django.utils.encoding import force_bytes
 
+from cabot.cabotapp.recent_results import RecentResults
 from cabot.cabotapp.run_window import CheckRunWindow
 
 
@@ -95,6 +100,99 @@ class CheckRunWindowField(models.Field):
         return super(CheckRunWindowField, self).formfield(**defaults)
 
 
+class RecentResultsField(models.IntegerField):
+    """Stores a RecentResults window as its packed integer representation."""
+    def __init__(self, *args, **kwargs):
+        kwargs['editable'] = False
+        kwargs['null'] = True
+        super(RecentResultsField, self).__init__(*args, **kwargs)
+
+    def from_db_value(self, value, expression, connection, context):
+        return self.to_python(value)
+
+    def to_python(self, value):
+        # type: (Union[None, int, RecentResults]) -> Optional[RecentResults]
+        if value is None or isinstance(value, RecentResults):
+            return value
+        return RecentResults(int(value))
+
+    def get_prep_value(self, value):
+        # type: (Optional[RecentResults]) -> Optional[int]
+        if isinstance(value, RecentResults):
+            return value.bits
+        return super(RecentResultsField, self).get_prep_value(value)
+
+
+class CompressedBytes(bytes):
+    """A CompressedTextField's value as stored, before it's decompressed."""
+
+    def decompress(self):
+        # type: () -> unicode
+        return zlib.decompress(self).decode('utf-8', 'replace')
+
+
+class CompressedTextDescriptor(DeferredAttribute):
+    """Decompresses the field's value the first time it's read, or reads the fallback field if it's null."""
+
+    def __init__(self, field):
+        super(CompressedTextDescriptor, self).__init__(field.attname, field.model)
+        self.field = field
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super(CompressedTextDescriptor, self).__get__(instance, cls)
+        if isinstance(value, CompressedBytes):
+            value = instance.__dict__[self.field_name] = value.decompress()
+        if value is None and self.field.fallback:
+            return getattr(instance, self.field.fallback)
+        return value
+
+    def __set__(self, instance, value):
+        # a data descriptor, so it's used even when the value is in the instance's __dict__
+        instance.__dict__[self.field_name] = value
+
+
+class CompressedTextField(models.BinaryField):
+    """
+    Stores text zlib-compressed. Rows are loaded with the compressed value, which is only decompressed when the
+    attribute is read. While the value is null, reading it returns the `fallback` field instead, if given (e.g. the
+    uncompressed column it replaces).
+    """
+    def __init__(self, *args, **kwargs):
+        self.fallback = kwargs.pop('fallback', None)
+        super(CompressedTextField, self).__init__(*args, **kwargs)
+
+    def deconstruct(self):
+        name, path, args, kwargs = super(CompressedTextField, self).deconstruct()
+        if self.fallback:
+            kwargs['fallback'] = self.fallback
+        return name, path, args, kwargs
+
+    def contribute_to_class(self, cls, name, **kwargs):
+        super(CompressedTextField, self).contribute_to_class(cls, name, **kwargs)
+        setattr(cls, self.attname, CompressedTextDescriptor(self))
+
+    def from_db_value(self, value, expression, connection, context):
+        return None if value is None else CompressedBytes(value)
+
+    def pre_save(self, model_instance, add):
+        # the value as it is, so values that were loaded and not changed aren't decompressed to be compressed again
+        return model_instance.__dict__.get(self.attname)
+
+    def get_prep_value(self, value):
+        # type: (Union[None, str, unicode, CompressedBytes]) -> Optional[CompressedBytes]
+        if value is None or isinstance(value, CompressedBytes):
+            return value
+        return CompressedBytes(zlib.compress(force_bytes(value)))
+
+    def to_python(self, value):
+        return value
+
+    def value_to_string(self, obj):
+        return self.value_from_object(obj)
+
+
 class TimeFromNowField(forms.Select):
     """DateTime field that lets the user choose from a predetermined set of times from now()"""
     def __init__(self, times, message_format=None, choices=None, *args, **kwargs):
@@ -0,0 +1,31 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cabot.cabotapp import rollups
+
+
+class Command(BaseCommand):
+    help = 'Compute the hourly and daily check rollups for stored results from before the earliest rollups ' \
+           '(the compact_rollups task also does this, a day at a time), or recompute them for the last --days ' \
+           '(e.g. after changing TIME_ZONE).'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, help='How many days back to recompute rollups for.')
+
+    def handle(self, *args, **options):
+        if options['days'] is None:
+            start = rollups.backfill_rollups()
+            while start is not None:
+                self.stdout.write('Computed rollups back to {}'.format(start))
+                start = rollups.backfill_rollups()
+            return
+
+        end = timezone.now()
+        start = end - timedelta(days=options['days'])
+        # a day at a time, to keep transactions short
+        while start < end:
+            rollups.compact_rollups(start, min(start + timedelta(days=1), end))
+            start += timedelta(days=1)
+            self.stdout.write('Computed rollups up to {}'.format(start))
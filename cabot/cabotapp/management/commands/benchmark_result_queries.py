@@ -0,0 +1,126 @@
+from datetime import timedelta
+import random
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from cabot.cabotapp.models import HttpStatusCheck, StatusCheckResult
+
+
+def _hot_queries(check_id):
+    # type: (int) -> List[Tuple[str, QuerySet, Optional[str], bool]]
+    """
+    (name, queryset, index it should use or None for any index, whether the index covers it) for the result
+    queries that run all the time, as they are made in the code.
+    """
+    results = StatusCheckResult.objects.filter(status_check_id=check_id)
+    return [
+        ('refresh_recent_results()', results.order_by('-id').only('succeeded', 'acked')[:10],
+         'result_check_recent_idx', True),
+        ('recent_results()', results.order_by('-id').defer('raw_data', 'raw_data_uncompressed')[:10],
+         'result_check_recent_idx', False),
+        ('close_succeeding_acks()', results.order_by('-id').only('succeeded')[:20], 'result_check_recent_idx', True),
+        ('check detail page', results.order_by('-time_complete')[:100], 'result_check_completed_idx', False),
+        ('checks_run_recently()', StatusCheckResult.objects.filter(
+            time_complete__gte=timezone.now() - timedelta(minutes=10)).values('id')[:1], None, False),
+    ]
+
+
+def _explain(queryset):
+    # type: (QuerySet) -> Union[str, List[dict]]
+    sql, params = queryset.query.sql_with_params()
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            return '\n'.join(row[-1] for row in cursor.fetchall())
+        cursor.execute('EXPLAIN ' + sql, params)
+        if connection.vendor == 'mysql':
+            columns = [c[0] for c in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+        return '\n'.join(row[0] for row in cursor.fetchall())
+
+
+def _uses_index(plan, index, covering):
+    # type: (Union[str, List[dict]], Optional[str], bool) -> bool
+    if connection.vendor == 'mysql':
+        return any((row['key'] == index if index else row['key']) and
+                   (not covering or 'Using index' in (row['Extra'] or '')) for row in plan)
+    if connection.vendor == 'sqlite':
+        if index is None:
+            return 'INDEX' in plan
+        return '{} {}'.format('USING COVERING INDEX' if covering else 'INDEX', index) in plan
+    if index is None:
+        return 'Seq Scan' not in plan
+    # e.g. "Index Only Scan Backward using <index> on <table>", "Bitmap Index Scan on <index>"
+    lines = [line for line in plan.splitlines() if ' {} '.format(index) in line + ' ']
+    return any('Index Only Scan' in line for line in lines) if covering else bool(lines)
+
+
+class Command(BaseCommand):
+    help = 'Seed results for throwaway checks, then check and time the plans of the frequent result queries. ' \
+           'Adds a lot of rows to the database (deleted when done), so run it against a test database.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=2000000, help='How many results to seed.')
+        parser.add_argument('--checks', type=int, default=200, help='How many checks to spread them over.')
+        parser.add_argument('--repeat', type=int, default=20, help='How many times to run each query.')
+
+    def handle(self, *args, **options):
+        checks = [HttpStatusCheck.objects.create(name='benchmark {}'.format(n), active=False)
+                  for n in range(options['checks'])]
+        try:
+            self._seed(checks, options['rows'])
+            failures = self._benchmark(checks[0].pk, options['repeat'], options['verbosity'] > 1)
+        finally:
+            results = StatusCheckResult.objects.filter(status_check__in=checks)
+            results._raw_delete(results.db)
+            for check in checks:
+                check.delete()
+
+        if failures:
+            raise CommandError('Not using the intended index: {}'.format(', '.join(failures)))
+
+    def _seed(self, checks, rows):
+        start = time.time()
+        now = timezone.now()
+        batch_size = 10000
+        for offset in range(0, rows, batch_size):
+            batch = []
+            for n in range(offset, min(offset + batch_size, rows)):
+                # newest results last, like they're saved
+                result_time = now - timedelta(seconds=(rows - n) * 60 // len(checks))
+                batch.append(StatusCheckResult(status_check=checks[n % len(checks)], time=result_time,
+                                               time_complete=result_time, succeeded=random.random() > 0.1))
+            StatusCheckResult.objects.bulk_create(batch)
+        self.stdout.write('Seeded {} results in {:.1f}s'.format(rows, time.time() - start))
+
+        table = StatusCheckResult._meta.db_table
+        with connection.cursor() as cursor:
+            if connection.vendor == 'postgresql':
+                # also updates the visibility map, which index-only scans need
+                cursor.execute('VACUUM ANALYZE {}'.format(table))
+            elif connection.vendor == 'mysql':
+                cursor.execute('ANALYZE TABLE {}'.format(table))
+            else:
+                cursor.execute('ANALYZE')
+
+    def _benchmark(self, check_id, repeat, show_plans):
+        failures = []
+        for name, queryset, index, covering in _hot_queries(check_id):
+            plan = _explain(queryset)
+            ok = _uses_index(plan, index, covering)
+            if not ok:
+                failures.append(name)
+
+            start = time.time()
+            for _ in range(repeat):
+                list(queryset.all())
+            took = (time.time() - start) / max(repeat, 1) * 1000
+
+            self.stdout.write('{:<28} {:>8.2f}ms  {}{}'.format(
+                name, took, 'ok' if ok else 'NOT USING ' + (index or 'AN INDEX'), ' (index only)' if covering else ''))
+            if not ok or show_plans:
+                self.stdout.write('    {}'.format(plan))
+        return failures
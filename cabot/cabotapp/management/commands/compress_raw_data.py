@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Case, Value, When
+
+from cabot.cabotapp.models import StatusCheckResult
+
+
+class Command(BaseCommand):
+    help = 'Compress the raw data of results saved before it was stored compressed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='How many results to update at a time.')
+
+    def handle(self, *args, **options):
+        field = StatusCheckResult._meta.get_field('raw_data')
+        uncompressed = StatusCheckResult.objects.filter(raw_data_uncompressed__isnull=False).order_by('id')
+        last_id = 0
+        total = 0
+        while True:
+            with transaction.atomic():
+                batch = list(uncompressed.filter(id__gt=last_id)
+                             .values_list('id', 'raw_data_uncompressed')[:options['batch_size']])
+                if not batch:
+                    break
+                # one UPDATE per batch, the field compresses each value
+                StatusCheckResult.objects.filter(id__in=[pk for pk, _ in batch]).update(
+                    raw_data=Case(*[When(pk=pk, then=Value(text, output_field=field)) for pk, text in batch],
+                                  output_field=field),
+                    raw_data_uncompressed=None)
+            last_id = batch[-1][0]
+            total += len(batch)
+            self.stdout.write('Compressed raw data of {} results'.format(total))
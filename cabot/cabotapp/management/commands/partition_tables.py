@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from cabot.cabotapp import partitions
+
+
+class Command(BaseCommand):
+    help = 'Convert the check result and service snapshot tables to tables partitioned by day (Postgres 11+). ' \
+           'Locks and scans the tables, so run it in a maintenance window.'
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning is only supported on Postgres')
+
+        with transaction.atomic():
+            partitions.partition_tables()
+            # create the partitions for the next few days
+            partitioned = partitions.create_partitions()
+
+        for model in partitioned:
+            self.stdout.write('Partitioned {}'.format(model._meta.db_table))
@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 08:33
+from __future__ import unicode_literals
+
+import cabot.cabotapp.fields
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0008_statuscheck_run_window'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statuscheck',
+            name='recent_results_bitmap',
+            field=cabot.cabotapp.fields.RecentResultsField(editable=False, null=True),
+        ),
+    ]
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 08:52
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0009_statuscheck_recent_results_bitmap'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StatusCheckDailyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(db_index=True)),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('acked', models.PositiveIntegerField(default=0)),
+                ('first_failure', models.DateTimeField(null=True)),
+                ('last_failure', models.DateTimeField(null=True)),
+                ('transitions_json', models.TextField(default=b'[]')),
+                ('status_check', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cabotapp.StatusCheck')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='StatusCheckHourlyRollup',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField(db_index=True)),
+                ('runs', models.PositiveIntegerField(default=0)),
+                ('successes', models.PositiveIntegerField(default=0)),
+                ('acked', models.PositiveIntegerField(default=0)),
+                ('first_failure', models.DateTimeField(null=True)),
+                ('last_failure', models.DateTimeField(null=True)),
+                ('transitions_json', models.TextField(default=b'[]')),
+                ('status_check', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cabotapp.StatusCheck')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AlterUniqueTogether(
+            name='statuscheckhourlyrollup',
+            unique_together=set([('status_check', 'start')]),
+        ),
+        migrations.AlterUniqueTogether(
+            name='statuscheckdailyrollup',
+            unique_together=set([('status_check', 'start')]),
+        ),
+    ]
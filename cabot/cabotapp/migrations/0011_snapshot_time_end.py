@@ -0,0 +1,24 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 08:58
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0010_check_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='servicestatussnapshot',
+            name='time_end',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='servicestatussnapshot',
+            index=models.Index(fields=[b'service', b'time'], name='cabotapp_se_service_92d217_idx'),
+        ),
+    ]
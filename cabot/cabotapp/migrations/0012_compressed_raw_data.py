@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cabot.cabotapp.fields
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0011_snapshot_time_end'),
+    ]
+
+    operations = [
+        # the existing column keeps its name, only the field is renamed
+        migrations.SeparateDatabaseAndState(state_operations=[
+            migrations.RenameField(
+                model_name='statuscheckresult',
+                old_name='raw_data',
+                new_name='raw_data_uncompressed',
+            ),
+            migrations.AlterField(
+                model_name='statuscheckresult',
+                name='raw_data_uncompressed',
+                field=models.TextField(db_column='raw_data', editable=False, null=True),
+            ),
+        ]),
+        migrations.AddField(
+            model_name='statuscheckresult',
+            name='raw_data',
+            field=cabot.cabotapp.fields.CompressedTextField(db_column='raw_data_compressed', fallback='raw_data_uncompressed',
+                                                             null=True),
+        ),
+    ]
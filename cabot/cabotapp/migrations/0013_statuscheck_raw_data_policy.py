@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0012_compressed_raw_data'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statuscheck',
+            name='raw_data_policy',
+            field=models.CharField(blank=True, choices=[(b'always', b'All results'), (b'failures', b'Failed results'), (b'transitions', b'Results that differ from the previous one'), (b'never', b'No results')], default=b'', help_text=b'Which results keep their raw data (e.g. the response body) for troubleshooting. Leave blank for the server default.', max_length=20),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:09
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0013_statuscheck_raw_data_policy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='statuscheckresulttag',
+            name='last_used',
+            field=models.DateTimeField(db_index=True, null=True),
+        ),
+    ]
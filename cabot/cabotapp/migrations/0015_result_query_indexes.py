@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:12
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0014_statuscheckresulttag_last_used'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='statuscheckresult',
+            index=models.Index(fields=[b'status_check', b'-id', b'succeeded', b'acked'], name=b'result_check_recent_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='statuscheckresult',
+            index=models.Index(fields=[b'status_check', b'-time_complete', b'-id', b'succeeded'], name=b'result_check_completed_idx'),
+        ),
+        # after the new indexes, which lead with status_check (MySQL needs one for the foreign key)
+        migrations.AlterField(
+            model_name='statuscheckresult',
+            name='status_check',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to='cabotapp.StatusCheck'),
+        ),
+    ]
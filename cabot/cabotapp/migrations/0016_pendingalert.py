@@ -0,0 +1,27 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:22
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0015_result_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PendingAlert',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('recipients', models.TextField()),
+                ('created_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('alert', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cabotapp.AlertPlugin')),
+                ('service', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='cabotapp.Service')),
+            ],
+        ),
+    ]
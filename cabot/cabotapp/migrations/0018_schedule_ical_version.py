@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:28
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0017_schedule_shifts_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='ical_etag',
+            field=models.CharField(blank=True, default=b'', editable=False, max_length=255),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='ical_hash',
+            field=models.CharField(blank=True, default=b'', editable=False, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='schedule',
+            name='ical_last_modified',
+            field=models.CharField(blank=True, default=b'', editable=False, max_length=255),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:49
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0020_statuscheck_acks_version'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='pendingalert',
+            name='failing_check_ids',
+            field=models.TextField(default=b'[]'),
+        ),
+        migrations.AddField(
+            model_name='pendingalert',
+            name='old_overall_status',
+            field=models.TextField(default=b'PASSING'),
+        ),
+        migrations.AddField(
+            model_name='pendingalert',
+            name='overall_status',
+            field=models.TextField(default=b'PASSING'),
+        ),
+    ]
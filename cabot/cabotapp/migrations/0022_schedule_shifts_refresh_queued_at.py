@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:51
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0021_pendingalert_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='schedule',
+            name='shifts_refresh_queued_at',
+            field=models.DateTimeField(editable=False, null=True),
+        ),
+    ]
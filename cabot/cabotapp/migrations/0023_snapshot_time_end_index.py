@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.11.27 on 2026-10-19 09:53
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('cabotapp', '0022_schedule_shifts_refresh_queued_at'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='servicestatussnapshot',
+            index=models.Index(fields=[b'time_end'], name='cabotapp_se_time_en_c03304_idx'),
+        ),
+    ]
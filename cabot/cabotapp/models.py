@@ -1,5 +1,6 @@
 # coding=utf-8
 import errno
+import json
 
 from celery.exceptions import SoftTimeLimitExceeded
 from celery.utils.log import get_task_logger
@@ -8,33 +9,47 @@ from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
 from django.urls import reverse
 from django.core.validators import MaxValueValidator
-from django.db import models, transaction
+from django.db import connection, models, transaction
+from django.db.models import Case, Count, IntegerField, Max, Min, Q, Sum, Value, When
+from django.dispatch import Signal
 from polymorphic.models import PolymorphicModel
 from timezone_field import TimeZoneField
 
 from .jenkins import get_job_status
-from .alert import (send_alert, AlertPluginUserData)
+from .alert import (send_alerts_async, AlertPluginUserData)
 from cabot.cabotapp.models_plugins import (  # noqa (unused, imported for side effects)
     HipchatInstance,
     MatterMostInstance,
 )
 from cabot.cabotapp import defs
-from cabot.cabotapp.fields import PositiveIntegerMaxField, CheckRunWindowField
-
-from collections import defaultdict
+from cabot.cabotapp.db_utils import insert_ignore, TimeBucket
+from cabot.cabotapp.fields import PositiveIntegerMaxField, CheckRunWindowField, CompressedTextField, \
+    RecentResultsField
+from cabot.cabotapp.recent_results import RecentResults
+
+from bisect import bisect_left, bisect_right
+from collections import defaultdict, OrderedDict
+from itertools import takewhile
 from datetime import timedelta
 from django.utils import timezone
 from icalendar import Calendar
 
+import calendar
+import hashlib
 import re
 import socket
 import time
+import uuid
 import yaml
 
 import requests
 
 logger = get_task_logger(__name__)
 
+# sent once the transaction commits, with the ids of checks whose status may have changed, so the services that
+# contain them are updated (see signals.py)
+check_status_changed = Signal(providing_args=['check_ids'])
+
 
 def clone_model(model):
     '''
@@ -95,6 +110,10 @@ class CheckGroupMixin(models.Model):
     CALCULATED_INTERMITTENT_STATUS = 'intermittent'
     CALCULATED_FAILING_STATUS = 'failing'
 
+    # the checks that were failing when the alert being sent was raised (set by send_pending_alerts()), so plugins
+    # see those in all_failing_checks() rather than the ones failing when it's sent
+    alert_failing_check_ids = None
+
     STATUSES = (
         (CALCULATED_PASSING_STATUS, CALCULATED_PASSING_STATUS),
         (CALCULATED_ACKED_STATUS, CALCULATED_ACKED_STATUS),
@@ -200,6 +219,26 @@ class CheckGroupMixin(models.Model):
             return self.ACKED_STATUS
         return self.PASSING_STATUS
 
+    def check_status_summary(self):
+        # type: () -> Tuple[int, int, str]
+        """
+        Summarize the active checks in one aggregate query.
+        :returns (number of active checks, number of failing checks, most_severe() of the failing checks)
+        """
+        failing = ~Q(calculated_status=Service.CALCULATED_PASSING_STATUS)
+        # most severe first, like most_severe()
+        severities = [self.CRITICAL_STATUS, self.ERROR_STATUS, self.WARNING_STATUS, self.ACKED_STATUS]
+        severity = Case(
+            When(calculated_status=Service.CALCULATED_ACKED_STATUS, then=Value(severities.index(self.ACKED_STATUS))),
+            *[When(failing & Q(importance=status), then=Value(rank)) for rank, status in enumerate(severities)],
+            output_field=IntegerField())
+        totals = self.active_status_checks().aggregate(
+            active=Count('id'),
+            failing=Sum(Case(When(failing, then=Value(1)), default=Value(0), output_field=IntegerField())),
+            severity=Min(severity))
+        status = severities[totals['severity']] if totals['severity'] is not None else self.PASSING_STATUS
+        return totals['active'], totals['failing'] or 0, status
+
     @property
     def is_critical(self):
         """
@@ -245,27 +284,100 @@ class CheckGroupMixin(models.Model):
         else:
             # We don't count "back to normal" as an alert
             self.last_alert_sent = None
-        self.save()
-        self.snapshot.did_send_alert = True
-        self.snapshot.save()
+        with transaction.atomic():
+            # lock the service as update_status() does, so no snapshot is inserted while it's being deleted
+            if not type(self).objects.select_for_update().filter(pk=self.pk).exists():
+                return
+            self.save()
+            if not self.snapshot_changed:
+                # the snapshot started at an earlier update, start a new one to record when we alerted
+                self.snapshot = self._record_snapshot(self.snapshot, **{
+                    field: getattr(self.snapshot, field) for field in Snapshot.STATUS_FIELDS})
+                self.snapshot_changed = True
+            self.snapshot.did_send_alert = True
+            self.snapshot.save()
 
         schedules = self.schedules.all()
-
         if not schedules:
-            send_alert(self)
-
-        for schedule in schedules:
-            send_alert(self, duty_officers=get_duty_officers(schedule),
-                       fallback_officers=get_fallback_officers(schedule))
+            send_alerts_async(self, [([], [])])
+        else:
+            send_alerts_async(self, [(get_duty_officers(schedule), get_fallback_officers(schedule))
+                                     for schedule in schedules])
 
     @property
     def recent_snapshots(self):
-        snapshots = self.snapshots.filter(
-            time__gt=(timezone.now() - timedelta(minutes=60 * 24)))
-        snapshots = list(snapshots.values())
-        for s in snapshots:
-            s['time'] = time.mktime(s['time'].timetuple())
-        return snapshots
+        """
+        The status over the last day, as a point at the start and end of each snapshot's interval (so the status
+        is flat between updates), starting with the snapshot in effect a day ago. For alert plugins; the service
+        page uses snapshot_history().
+        """
+        now = timezone.now()
+        since = now - timedelta(minutes=60 * 24)
+        snapshots = list(self.snapshots.filter(time__lte=since).order_by('-time').values()[:1])
+        if snapshots and snapshots[0]['time_end'] is not None and snapshots[0]['time_end'] <= since:
+            snapshots = []
+        snapshots.extend(self.snapshots.filter(time__gt=since).order_by('time').values())
+
+        points = []
+        for snapshot, following in zip(snapshots, snapshots[1:] + [None]):
+            start = max(snapshot['time'], since)
+            end = snapshot.pop('time_end') or (following['time'] if following else now)
+            points.append(dict(snapshot, time=start))
+            if end > start:
+                points.append(dict(snapshot, time=end, did_send_alert=False))
+        for point in points:
+            point['time'] = time.mktime(point['time'].timetuple())
+        return points
+
+    def snapshot_history(self, start, end, num_buckets):
+        # type: (datetime, datetime, int) -> List[dict]
+        """
+        The status between start and end, downsampled in the database to at most `num_buckets` equal time buckets.
+        Each point has the bucket's start time (in seconds since the epoch), the most active checks, the fewest and
+        most failing checks, and whether an alert was sent in it. A bucket without snapshots gets the status in
+        effect at the time; buckets before the first snapshot are left out.
+        """
+        # buckets are computed from whole seconds
+        start = start.replace(microsecond=0)
+        end = end.replace(microsecond=0) + timedelta(seconds=1 if end.microsecond else 0)
+        seconds = max(-(-int((end - start).total_seconds()) // num_buckets), 1)
+        start_epoch = calendar.timegm(start.utctimetuple())
+
+        buckets = list(self.snapshots.filter(time__gte=start, time__lt=end)
+                       .annotate(bucket=TimeBucket('time', start_epoch, seconds)).order_by().values('bucket')
+                       .annotate(num_checks_active=Max('num_checks_active'),
+                                 num_checks_failing_min=Min('num_checks_failing'),
+                                 num_checks_failing=Max('num_checks_failing'),
+                                 did_send_alert=Max('did_send_alert'), last=Max('time')))
+
+        def state(snapshot):
+            return dict(num_checks_active=snapshot['num_checks_active'], did_send_alert=False,
+                        num_checks_failing_min=snapshot['num_checks_failing'],
+                        num_checks_failing=snapshot['num_checks_failing'])
+
+        # the snapshot in effect at the start, and the last one of each bucket, are in effect until the next one
+        fields = ('time', 'time_end', 'num_checks_active', 'num_checks_failing')
+        before = self.snapshots.filter(time__lt=start).order_by('-time').values(*fields)[:1]
+        current = state(before[0]) if before and (before[0]['time_end'] or end) > start else None
+        last = {snapshot['time']: state(snapshot)
+                for snapshot in self.snapshots.filter(time__in=[b['last'] for b in buckets]).values(*fields)}
+
+        by_bucket = {b['bucket']: b for b in buckets}
+        points = []
+        for bucket in range(-(-int((end - start).total_seconds()) // seconds)):
+            parts = [part for part in (current, by_bucket.get(bucket)) if part is not None]
+            if not parts:
+                continue
+            points.append({
+                'time': start_epoch + bucket * seconds,
+                'num_checks_active': max(part['num_checks_active'] for part in parts),
+                'num_checks_failing_min': min(part['num_checks_failing_min'] for part in parts),
+                'num_checks_failing': max(part['num_checks_failing'] for part in parts),
+                'did_send_alert': any(part['did_send_alert'] for part in parts),
+            })
+            if bucket in by_bucket:
+                current = last.get(by_bucket[bucket]['last'], current)
+        return points
 
     # order checks by: critical + failing, error + failing, warning + failing, passing, disabled
     _CHECK_ORDER = "(CASE " \
@@ -316,6 +428,8 @@ class CheckGroupMixin(models.Model):
         return self.active_status_checks().filter(calculated_status=self.CALCULATED_PASSING_STATUS)
 
     def all_failing_checks(self):
+        if self.alert_failing_check_ids is not None:
+            return self.status_checks.filter(pk__in=self.alert_failing_check_ids)
         return self.active_status_checks().exclude(calculated_status=self.CALCULATED_PASSING_STATUS)
 
 
@@ -332,6 +446,19 @@ class Schedule(models.Model):
         help_text='Fallback officer to alert if the duty officer is unavailable.',
         on_delete=models.SET_NULL
     )
+    # version stamp of the schedule's shifts, set by update_shifts() (see OnCallIndex)
+    shifts_updated_at = models.DateTimeField(null=True, editable=False)
+    # version of the iCal feed the shifts were last updated from (see calendar_changed())
+    ical_etag = models.CharField(max_length=255, blank=True, default='', editable=False)
+    ical_last_modified = models.CharField(max_length=255, blank=True, default='', editable=False)
+    ical_hash = models.CharField(max_length=64, blank=True, default='', editable=False)
+    # when the shifts were last checked against the iCal feed, changed or not
+    ical_synced_at = models.DateTimeField(null=True, editable=False)
+    # when the shift list page last queued a refresh_shifts task (see claim_shifts_refresh())
+    shifts_refresh_queued_at = models.DateTimeField(null=True, editable=False)
+
+    # (url, response or requests exception) of this instance's iCal fetch, so it's only fetched once
+    _ical_fetch = (None, None)
 
     def get_edit_url(self):
         """Returns the relative URL for modifying this schedule"""
@@ -340,14 +467,93 @@ class Schedule(models.Model):
     def has_problems(self):
         return ScheduleProblems.objects.filter(schedule=self).exists()
 
+    def _fetched_calendar(self):
+        url, resp = self._ical_fetch
+        return resp if url == self.ical_url else None
+
+    def _fetch_calendar(self, conditional=False):
+        resp = self._fetched_calendar()
+        if resp is None or (not conditional and not isinstance(resp, Exception) and resp.status_code == 304):
+            headers = {}
+            if conditional and self.ical_etag:
+                headers['If-None-Match'] = self.ical_etag
+            if conditional and self.ical_last_modified:
+                headers['If-Modified-Since'] = self.ical_last_modified
+            try:
+                resp = requests.get(self.ical_url, headers=headers)
+                if resp.status_code != 304:
+                    resp.raise_for_status()
+            except requests.RequestException as e:
+                resp = e
+            self._ical_fetch = (self.ical_url, resp)
+        if isinstance(resp, Exception):
+            raise resp
+        return resp
+
     def get_calendar_data(self):
         """
-        Parse icalendar data
+        Parse icalendar data, downloaded once per Schedule instance (so update_shifts() and the schedule validation
+        share it)
         :return: String containing the calendar data
         """
-        resp = requests.get(self.ical_url)
-        resp.raise_for_status()
-        return Calendar.from_ical(resp.content)
+        return Calendar.from_ical(self._fetch_calendar().content)
+
+    def calendar_changed(self):
+        # type: () -> bool
+        """
+        Whether the iCal feed changed since the shifts were last updated from it (see mark_calendar_synced()), with
+        a conditional GET (ETag/If-Modified-Since), then by a hash of the content for servers that don't support it.
+        The response is kept for get_calendar_data(). Raises requests exceptions.
+        """
+        resp = self._fetch_calendar(conditional=True)
+        return resp.status_code != 304 and hashlib.sha256(resp.content).hexdigest() != self.ical_hash
+
+    def validate_calendar(self):
+        # type: () -> None
+        """
+        Raises requests exceptions if the iCal feed can't be fetched, or whatever icalendar raises if it can't be
+        parsed. Doesn't parse it again if it's unchanged since the shifts were last updated from it.
+        """
+        if self.calendar_changed():
+            self.get_calendar_data()
+
+    def mark_calendar_synced(self):
+        # type: () -> None
+        """
+        Remember when the shifts were last checked against the fetched iCal feed, and its version, after updating
+        the shifts from it (or finding it unchanged).
+        """
+        resp = self._fetched_calendar()
+        if resp is None or isinstance(resp, Exception):
+            return
+        self.ical_synced_at = timezone.now()
+        if resp.status_code != 304:
+            self.ical_etag = resp.headers.get('ETag', '')[:255]
+            self.ical_last_modified = resp.headers.get('Last-Modified', '')[:255]
+            self.ical_hash = hashlib.sha256(resp.content).hexdigest()
+        Schedule.objects.filter(pk=self.pk).update(ical_etag=self.ical_etag, ical_last_modified=self.ical_last_modified,
+                                                   ical_hash=self.ical_hash, ical_synced_at=self.ical_synced_at)
+
+    def shifts_stale(self):
+        # type: () -> bool
+        """Whether the shifts haven't been checked against the iCal feed for defs.SHIFTS_STALE_SECONDS."""
+        return self.ical_synced_at is None or \
+            self.ical_synced_at < timezone.now() - timedelta(seconds=defs.SHIFTS_STALE_SECONDS)
+
+    def claim_shifts_refresh(self):
+        # type: () -> bool
+        """
+        Whether the caller should queue a refresh of the stale shifts: only one caller gets True per
+        SHIFTS_STALE_SECONDS (across processes), so page views don't pile up refreshes.
+        """
+        now = timezone.now()
+        claimed = Schedule.objects.filter(pk=self.pk).filter(
+            Q(shifts_refresh_queued_at__isnull=True) |
+            Q(shifts_refresh_queued_at__lt=now - timedelta(seconds=defs.SHIFTS_STALE_SECONDS))
+        ).update(shifts_refresh_queued_at=now)
+        if claimed:
+            self.shifts_refresh_queued_at = now
+        return bool(claimed)
 
     def __unicode__(self):
         return self.name
@@ -380,6 +586,9 @@ class ScheduleProblems(models.Model):
 
 class Service(CheckGroupMixin):
 
+    # False if update_status() kept using the previous snapshot
+    snapshot_changed = True
+
     def update_status(self):
         # Services that have been around for a long time accumulate a huge history of snapshots.
         # When these services are deleted, Django manually deletes these snapshots (through on_delete=models.CASCADE).
@@ -411,17 +620,19 @@ class Service(CheckGroupMixin):
 
             self.old_overall_status = self.overall_status
             # Only active checks feed into our calculation
-            status_checks_failed_count = self.all_failing_checks().count()
-            self.overall_status = self.most_severe(self.all_failing_checks())
-            self.snapshot = ServiceStatusSnapshot(
-                service=self,
-                num_checks_active=self.active_status_checks().count(),
-                num_checks_passing=self.active_status_checks().count() - status_checks_failed_count,
-                num_checks_failing=status_checks_failed_count,
+            num_active, num_failing, self.overall_status = self.check_status_summary()
+            status = dict(
+                num_checks_active=num_active,
+                num_checks_passing=num_active - num_failing,
+                num_checks_failing=num_failing,
                 overall_status=self.overall_status,
-                time=timezone.now(),
             )
-            self.snapshot.save()
+
+            # only record a snapshot when something changed; the latest one stays valid until then
+            current = self.snapshots.order_by('-time').first()
+            self.snapshot_changed = current is None or current.time_end is not None or \
+                any(getattr(current, field) != value for field, value in status.items())
+            self.snapshot = self._record_snapshot(current, **status) if self.snapshot_changed else current
             self.save()
 
         if not (self.overall_status == Service.PASSING_STATUS and self.old_overall_status == Service.PASSING_STATUS):
@@ -432,6 +643,17 @@ class Service(CheckGroupMixin):
         help_text="URL of service."
     )
 
+    def _record_snapshot(self, current, **status):
+        # type: (Optional[ServiceStatusSnapshot], **Any) -> ServiceStatusSnapshot
+        """Save a new snapshot starting now, ending the current one (if any)."""
+        now = timezone.now()
+        if current is not None and current.time_end is None:
+            current.time_end = now
+            current.save(update_fields=['time_end'])
+        snapshot = ServiceStatusSnapshot(service=self, time=now, **status)
+        snapshot.save()
+        return snapshot
+
     def delete(self, *args, **kwargs):
         # to handle django's cascading deletes for large services; see update_status()
         with transaction.atomic():
@@ -445,10 +667,18 @@ class Service(CheckGroupMixin):
 
 class Snapshot(models.Model):
 
+    """
+    The status from `time` until `time_end`. A new snapshot is only recorded when the status changes (or an alert
+    is sent), so the latest snapshot has no `time_end` and is valid until the next one.
+    """
+
     class Meta:
         abstract = True
 
+    STATUS_FIELDS = ('num_checks_active', 'num_checks_passing', 'num_checks_failing', 'overall_status')
+
     time = models.DateTimeField(db_index=True)
+    time_end = models.DateTimeField(null=True, blank=True)
     num_checks_active = models.IntegerField(default=0)
     num_checks_passing = models.IntegerField(default=0)
     num_checks_failing = models.IntegerField(default=0)
@@ -459,6 +689,12 @@ class Snapshot(models.Model):
 class ServiceStatusSnapshot(Snapshot):
     service = models.ForeignKey(Service, related_name='snapshots', on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['service', 'time']),
+            models.Index(fields=['time_end']),
+        ]
+
     def __unicode__(self):
         return u"%s: %s" % (self.service.name, self.overall_status)
 
@@ -519,6 +755,10 @@ class StatusCheck(PolymorphicModel):
         max_length=50, choices=Service.STATUSES, default=Service.CALCULATED_PASSING_STATUS, blank=True)
     last_run = models.DateTimeField(null=True)
     cached_health = models.TextField(editable=False, null=True)
+    # outcomes of the last RecentResults.SIZE results, kept up to date by run(); None if not yet calculated
+    recent_results_bitmap = RecentResultsField()
+    # changes whenever one of the check's acks changes (see AckIndex)
+    acks_version = models.CharField(max_length=32, blank=True, default='', editable=False)
     runbook = models.TextField(
         default=None,
         null=True,
@@ -526,6 +766,19 @@ class StatusCheck(PolymorphicModel):
         help_text='Notes for on-calls to correctly diagnose and resolve the alert. Supports HTML!',
     )
     run_window = CheckRunWindowField()
+    raw_data_policy = models.CharField(
+        max_length=20,
+        blank=True,
+        default='',
+        choices=defs.RAW_DATA_POLICIES,
+        help_text='Which results keep their raw data (e.g. the response body) for troubleshooting. '
+                  'Leave blank for the server default.',
+    )
+
+    # columns written by run(); metrics checks set importance based on which threshold failed
+    RUN_UPDATE_FIELDS = ('last_run', 'calculated_status', 'cached_health', 'recent_results_bitmap', 'importance')
+    # columns that change how the check counts towards its services' status
+    SERVICE_STATUS_FIELDS = ('active', 'retries', 'importance', 'calculated_status')
 
     class Meta(PolymorphicModel.Meta):
         ordering = ['name']
@@ -536,14 +789,31 @@ class StatusCheck(PolymorphicModel):
     def recent_results(self):
         # Not great to use id but we are getting lockups, possibly because of something to do with index
         # on time_complete
-        return StatusCheckResult.objects.filter(status_check=self).order_by('-id').defer('raw_data')[:10]
+        return StatusCheckResult.objects.filter(status_check=self).order_by('-id')\
+            .defer('raw_data', 'raw_data_uncompressed')[:10]
 
     def last_result(self):
         try:
-            return StatusCheckResult.objects.filter(status_check=self).order_by('-id').defer('raw_data')[0]
+            return StatusCheckResult.objects.filter(status_check=self).order_by('-id')\
+                .defer('raw_data', 'raw_data_uncompressed')[0]
         except:
             return None
 
+    def refresh_recent_results(self):
+        """
+        Rebuild recent_results_bitmap from the stored StatusCheckResults. run() keeps the bitmap up to date,
+        so this is only needed if results were written some other way. Does not save the check (save() then keeps
+        the rebuilt bitmap rather than the stored one).
+        """
+        recent = RecentResults.from_results(self.recent_results().only('succeeded', 'acked'))
+        if recent != recent.without_acks() and \
+                not Acknowledgement.objects.filter(status_check_id=self.pk, closed_at__isnull=True).exists():
+            # the results keep the acked flag they were saved with, but once their acks have closed they count as
+            # unacked (as clear_acked_results() leaves the bitmap)
+            recent = recent.without_acks()
+        self.recent_results_bitmap = recent
+        self._results_refreshed = True
+
     def should_run(self):
         '''Returns true if the check should run, false otherwise.'''
 
@@ -606,8 +876,12 @@ class StatusCheck(PolymorphicModel):
         next_run_time = self.last_run + timedelta(minutes=self.frequency)
         return timezone.now() > next_run_time
 
-    @transaction.atomic()
-    def run(self):
+    def probe(self):
+        # type: () -> Tuple[StatusCheckResult, List[str]]
+        """
+        Run the check without writing anything to the database.
+        :return: the (unsaved) timestamped result and its tags, to pass to save_results()
+        """
         start = timezone.now()
         try:
             result, tags = self._run()
@@ -620,29 +894,145 @@ class StatusCheck(PolymorphicModel):
                                        error=u'Error in performing check: %s' % (e,))
             tags = ['run_error']
 
-        finish = timezone.now()
         result.time = start
-        result.time_complete = finish
-        result.save()
+        result.time_complete = timezone.now()
+        return result, tags
 
-        # would like to do this in bulk, but django can't fetch the tag object PKs from bulk_create()...
-        try:
-            tag_objs = [StatusCheckResultTag.objects.get_or_create(value=t)[0] for t in tags if t]
-            result.tags.add(*tag_objs)
-        except:  # noqa
-            # can fail if a tag's name is too long
-            logger.exception("Error creating/adding tags: %s", tags)
+    def run(self):
+        # probe first, so the transaction isn't held open while we wait on the network
+        result, tags = self.probe()
+        StatusCheck.save_results([(self, result, tags)])
 
-        if result.succeeded:
-            Acknowledgement.close_succeeding_acks(check=self, at_time=finish)
+    def keeps_raw_data(self, succeeded, previous_succeeded):
+        # type: (bool, Optional[bool]) -> bool
+        """
+        Whether a result should keep its raw data under the check's raw_data_policy (or the default).
+        :param previous_succeeded: outcome of the check's previous result, None if unknown
+        """
+        policy = self.raw_data_policy or settings.RAW_DATA_POLICY
+        if policy == defs.RAW_DATA_NEVER:
+            return False
+        if policy == defs.RAW_DATA_FAILURES:
+            return not succeeded
+        if policy == defs.RAW_DATA_TRANSITIONS:
+            return succeeded != previous_succeeded
+        return True
+
+    @classmethod
+    @transaction.atomic()
+    def save_results(cls, runs):
+        # type: (List[Tuple[StatusCheck, StatusCheckResult, List[str]]]) -> None
+        """
+        Save the results of probe() for any number of checks (and runs of the same check, oldest first) and update
+        the checks' status, in a fixed number of queries.
+        :param runs: list of (check, result, tags)
+        """
+        if not runs:
+            return
+
+        # match acks against the tags in memory, so results can be inserted with their final acked value
+        acks_by_check = ack_index.acks_for_checks(set(check.pk for check, _, _ in runs))
+        for check, result, tags in runs:
+            if not result.succeeded:
+                result.acked = any(ack.is_open(result.time_complete) and ack.matches_result(result, tags)
+                                   for ack in acks_by_check[check.pk])
+
+        for check, _, _ in runs:
+            if check.recent_results_bitmap is None:
+                # before this batch's results are saved, so they're only pushed once
+                check.refresh_recent_results()
+
+        previous_succeeded = {}
+        for check, result, _ in runs:
+            if check.pk not in previous_succeeded:
+                recent = check.recent_results_bitmap
+                previous_succeeded[check.pk] = recent[0].succeeded if recent else None
+            if not check.keeps_raw_data(result.succeeded, previous_succeeded[check.pk]):
+                result.raw_data = None
+            previous_succeeded[check.pk] = result.succeeded
+
+        results = [result for _, result, _ in runs]
+        if len(results) > 1 and connection.features.can_return_ids_from_bulk_insert:
+            for result in results:
+                result.truncate_raw_data()
+            StatusCheckResult.objects.bulk_create(results)
         else:
-            acks = Acknowledgement.get_acks_matching_result(result, at_time=finish)
-            if len(acks) > 0:
-                result.acked = True
-                result.save(update_fields=('acked',))
+            for result in results:
+                result.save()
 
-        self.last_run = finish
-        self.save()
+        results_tags = [(result, tags) for _, result, tags in runs if tags]
+        if results_tags:
+            try:
+                with transaction.atomic():
+                    StatusCheckResult.add_tags_to_results(results_tags)
+            except:  # noqa
+                logger.exception("Error creating/adding tags: %s", [tags for _, tags in results_tags])
+
+        checks = OrderedDict()
+        passed_with_acks = OrderedDict()
+        for check, result, _ in runs:
+            check = checks.setdefault(check.pk, check)
+            if result.succeeded and acks_by_check[check.pk]:
+                passed_with_acks[check.pk] = check
+
+            check.recent_results_bitmap = check.recent_results_bitmap.push(result.succeeded, result.acked)
+            check.last_run = result.time_complete
+
+        if passed_with_acks:
+            Acknowledgement.close_succeeding_acks(passed_with_acks.values(), acks_by_check)
+
+        previous_status = {pk: check.calculated_status for pk, check in checks.items()}
+        for check in checks.values():
+            check._update_calculated_status()
+
+        # only write the columns a run changes, for all of the checks with a single UPDATE
+        updated = cls._update_checks(checks.values(), cls.RUN_UPDATE_FIELDS)
+        if updated < len(checks):
+            logger.error('Cannot find %s of checks %s in the database, presumably have been deleted',
+                         len(checks) - updated, checks.keys())
+
+        changed = [pk for pk, check in checks.items() if check.calculated_status != previous_status[pk]]
+        if changed:
+            transaction.on_commit(lambda: check_status_changed.send(sender=cls, check_ids=changed))
+
+    @classmethod
+    def _update_checks(cls, checks, names):
+        # type: (Iterable[StatusCheck], Iterable[str]) -> int
+        """Write these columns of the checks with a single UPDATE; returns the number of checks updated."""
+        checks = list(checks)
+        return StatusCheck.objects.filter(pk__in=[check.pk for check in checks]).update(**{
+            name: Case(*[When(pk=check.pk, then=Value(getattr(check, name), output_field=field))
+                         for check in checks], output_field=field)
+            for name, field in ((name, cls._meta.get_field(name)) for name in names)
+        })
+
+    @classmethod
+    @transaction.atomic()
+    def clear_acked_results(cls, check_ids):
+        # type: (Iterable[int]) -> None
+        """
+        Recompute the status of checks whose acks were closed from their recent results, as if none of them had
+        been acked, without running the checks (e.g. when acks expire). Checks that still have an open ack are left
+        alone. The services of the checks whose status changed are updated through check_status_changed.
+        """
+        still_acked = Acknowledgement.objects.filter(status_check_id__in=check_ids, closed_at__isnull=True)\
+            .values('status_check_id')
+        checks = list(StatusCheck.objects.non_polymorphic().filter(pk__in=check_ids)
+                      .exclude(pk__in=still_acked).order_by())
+        if not checks:
+            return
+
+        previous_status = {check.pk: check.calculated_status for check in checks}
+        for check in checks:
+            if check.recent_results_bitmap is None:
+                check.refresh_recent_results()
+            check.recent_results_bitmap = check.recent_results_bitmap.without_acks()
+            check._update_calculated_status()
+        cls._update_checks(checks, ('calculated_status', 'cached_health', 'recent_results_bitmap'))
+
+        changed = [check.pk for check in checks if check.calculated_status != previous_status[check.pk]]
+        if changed:
+            transaction.on_commit(lambda: check_status_changed.send(sender=cls, check_ids=changed))
 
     def _run(self):
         # type: () -> Tuple[StatusCheckResult, List[str]]
@@ -665,30 +1055,62 @@ class StatusCheck(PolymorphicModel):
                           "unique! This one matches check #{}.".format(other.id)
                     raise ValidationError(msg)
 
+    def _update_calculated_status(self):
+        """Set calculated_status and cached_health from recent_results_bitmap."""
+        if self.recent_results_bitmap is None:
+            # checks that haven't run since the bitmap was introduced
+            self.refresh_recent_results()
+        recent_results = self.recent_results_bitmap
+        if get_success_with_retries(recent_results, self.retries):
+            self.calculated_status = Service.CALCULATED_PASSING_STATUS
+        else:
+            last_result = recent_results[0] if recent_results and len(recent_results) > 0 else None
+            if last_result and last_result.acked:
+                # last result is acked, so we are too
+                self.calculated_status = Service.CALCULATED_ACKED_STATUS
+            else:
+                # get_success_with_retries returned False, so we're failing
+                self.calculated_status = Service.CALCULATED_FAILING_STATUS
+        self.cached_health = serialize_recent_results(recent_results)
+
     def save(self, *args, **kwargs):
+        if self.pk is not None and not kwargs.get('force_insert'):
+            # don't re-insert a check that was deleted while it was running
+            kwargs['force_update'] = True
+            with transaction.atomic():
+                # run() may have stored results since this instance was loaded (its UPDATE waits on the lock), so
+                # calculate the status from the stored results instead of overwriting them with the ones in memory.
+                # acks_version is only changed by Acknowledgement.acks_changed(), so keep the stored one too
+                stored = StatusCheck.objects.non_polymorphic().select_for_update().filter(pk=self.pk)\
+                    .values_list('last_run', 'recent_results_bitmap', 'acks_version',
+                                 *self.SERVICE_STATUS_FIELDS).first()
+                if stored is None:
+                    logger.error('Cannot find myself (check %s) in the database, presumably have been deleted'
+                                 % self.pk)
+                    return
+                last_run, stored_bitmap, self.acks_version = stored[:3]
+                if not getattr(self, '_results_refreshed', False):
+                    self.recent_results_bitmap = stored_bitmap
+                self._results_refreshed = False
+                if last_run and (self.last_run is None or last_run > self.last_run):
+                    self.last_run = last_run
+                self._set_calculated_status()
+                ret = super(StatusCheck, self).save(*args, **kwargs)
+
+            if tuple(getattr(self, name) for name in self.SERVICE_STATUS_FIELDS) != stored[3:]:
+                transaction.on_commit(lambda: check_status_changed.send(sender=StatusCheck, check_ids=[self.pk]))
+            return ret
+
+        self._set_calculated_status()
+        return super(StatusCheck, self).save(*args, **kwargs)
+
+    def _set_calculated_status(self):
         if self.last_run:
-            recent_results = list(self.recent_results())
-            if get_success_with_retries(recent_results, self.retries):
-                self.calculated_status = Service.CALCULATED_PASSING_STATUS
-            else:
-                last_result = recent_results[0] if recent_results and len(recent_results) > 0 else None
-                if last_result and last_result.acked:
-                    # last result is acked, so we are too
-                    self.calculated_status = Service.CALCULATED_ACKED_STATUS
-                else:
-                    # get_success_with_retries returned False, so we're failing
-                    self.calculated_status = Service.CALCULATED_FAILING_STATUS
-            self.cached_health = serialize_recent_results(recent_results)
-            try:
-                StatusCheck.objects.get(pk=self.pk)
-            except StatusCheck.DoesNotExist:
-                logger.error('Cannot find myself (check %s) in the database, presumably have been deleted' % self.pk)
-                return
+            self._update_calculated_status()
         else:
             self.cached_health = ''
             self.calculated_status = Service.CALCULATED_PASSING_STATUS
-        ret = super(StatusCheck, self).save(*args, **kwargs)
-        return ret
+            self.recent_results_bitmap = None
 
     def duplicate(self, inst_set=(), serv_set=()):
         new_check = self
@@ -1073,10 +1495,41 @@ class TCPStatusCheck(StatusCheck):
 
 class StatusCheckResultTag(models.Model):
     value = models.CharField(max_length=255, blank=False, primary_key=True)
+    # when a process last made sure the tag exists to add it to results (or clean_orphaned_tags() found it in use)
+    last_used = models.DateTimeField(null=True, db_index=True)
+
+    # {value: time.time()} of tags this process has created (or found to already exist).
+    # clean_orphaned_tags() only deletes tags that weren't used for TAG_UNUSED_DAYS, which is much longer than
+    # TAG_CACHE_TTL_SECONDS, so a tag in this cache can't have been deleted yet.
+    _known_values = {}
 
     def __unicode__(self):
         return self.value
 
+    @classmethod
+    def ensure_exist(cls, values):
+        # type: (Iterable[str]) -> None
+        """
+        Create tags for any of these values that don't exist yet and mark them as used, in one query if they all
+        exist and two if not (none for values this process has done this for recently).
+        """
+        now = time.time()
+        missing = [v for v in values if now - cls._known_values.get(v, 0) > defs.TAG_CACHE_TTL_SECONDS]
+        if not missing:
+            return
+
+        last_used = timezone.now()
+        if cls.objects.filter(value__in=missing).update(last_used=last_used) < len(missing):
+            insert_ignore(cls, ['value', 'last_used'], [(v, last_used) for v in missing])
+
+        def remember():
+            if len(cls._known_values) + len(missing) > defs.TAG_CACHE_MAX_SIZE:
+                cls._known_values.clear()
+            cls._known_values.update((v, now) for v in missing)
+
+        # if the transaction rolls back, the tags we just inserted won't exist
+        transaction.on_commit(remember)
+
 
 class StatusCheckResult(models.Model):
     """
@@ -1086,10 +1539,13 @@ class StatusCheckResult(models.Model):
     Checks don't have to use all the fields, so most should be
     nullable
     """
-    status_check = models.ForeignKey(StatusCheck, on_delete=models.CASCADE)
+    # indexed by the first column of the indexes in Meta
+    status_check = models.ForeignKey(StatusCheck, on_delete=models.CASCADE, db_index=False)
     time = models.DateTimeField(null=False, db_index=True)
     time_complete = models.DateTimeField(null=True, db_index=True)
-    raw_data = models.TextField(null=True)
+    raw_data = CompressedTextField(null=True, fallback='raw_data_uncompressed', db_column='raw_data_compressed')
+    # results saved before raw_data was compressed, until `manage.py compress_raw_data` moves them to raw_data
+    raw_data_uncompressed = models.TextField(null=True, editable=False, db_column='raw_data')
     succeeded = models.BooleanField(default=False)
     error = models.TextField(null=True)
 
@@ -1099,12 +1555,47 @@ class StatusCheckResult(models.Model):
     # Jenkins specific
     job_number = models.PositiveIntegerField(null=True)
 
+    class Meta:
+        # a check's latest results, by id (recent_results(), last_result(), close_succeeding_acks()) and by completion
+        # time (the check page); the trailing columns let queries that only need the outcomes skip the table
+        # (see `manage.py benchmark_result_queries`)
+        indexes = [
+            models.Index(fields=['status_check', '-id', 'succeeded', 'acked'], name='result_check_recent_idx'),
+            models.Index(fields=['status_check', '-time_complete', '-id', 'succeeded'],
+                         name='result_check_completed_idx'),
+        ]
+
     def __unicode__(self):
         return '%s: %s @%s' % (self.status, self.status_check.name, self.time)
 
     def print_tags(self):
         return '\n'.join([tag[0] for tag in self.tags.values_list('value')])
 
+    def add_tags(self, values):
+        # type: (Iterable[str]) -> None
+        """
+        Add tags to this (saved) result by value, creating any that don't exist yet.
+        Empty values and values that are too long to be a tag are skipped.
+        """
+        StatusCheckResult.add_tags_to_results([(self, values)])
+
+    @staticmethod
+    def add_tags_to_results(results_tags):
+        # type: (Iterable[Tuple[StatusCheckResult, Iterable[str]]]) -> None
+        """Like add_tags(), for any number of (saved) results at once, in at most three queries."""
+        max_length = StatusCheckResultTag._meta.get_field('value').max_length
+        rows = set()
+        for result, values in results_tags:
+            too_long = [v for v in values if v and len(v) > max_length]
+            if too_long:
+                logger.error("Skipping tags longer than %s characters: %s", max_length, too_long)
+            rows.update((result.pk, v) for v in values if v and len(v) <= max_length)
+        if not rows:
+            return
+
+        StatusCheckResultTag.ensure_exist(sorted(set(v for _, v in rows)))
+        insert_ignore(StatusCheckResult.tags.through, ['statuscheckresult', 'statuscheckresulttag'], sorted(rows))
+
     @property
     def status(self):
         if self.succeeded:
@@ -1127,12 +1618,63 @@ class StatusCheckResult(models.Model):
         else:
             return self.error
 
-    def save(self, *args, **kwargs):
+    def truncate_raw_data(self):
         if isinstance(self.raw_data, basestring):
             self.raw_data = self.raw_data[:defs.RAW_DATA_LIMIT]
+
+    def save(self, *args, **kwargs):
+        self.truncate_raw_data()
         return super(StatusCheckResult, self).save(*args, **kwargs)
 
 
+class StatusCheckRollup(models.Model):
+    """
+    Summary of a check's results over a period, so reports don't have to read every result.
+    Maintained by cabot.cabotapp.rollups.compact_rollups().
+    """
+    class Meta:
+        abstract = True
+        unique_together = ('status_check', 'start')
+
+    status_check = models.ForeignKey(StatusCheck, on_delete=models.CASCADE)
+    start = models.DateTimeField(db_index=True)
+    runs = models.PositiveIntegerField(default=0)
+    successes = models.PositiveIntegerField(default=0)
+    acked = models.PositiveIntegerField(default=0)
+    first_failure = models.DateTimeField(null=True)
+    last_failure = models.DateTimeField(null=True)
+    # json list of [microseconds since the epoch, succeeded] for the first result in the period and every result
+    # whose outcome differs from the one before it, i.e. the boundaries of the outages in the period
+    transitions_json = models.TextField(default='[]')
+
+    @property
+    def transitions(self):
+        # type: () -> List[Tuple[datetime, bool]]
+        return [(_EPOCH + timedelta(microseconds=us), succeeded) for us, succeeded in json.loads(self.transitions_json)]
+
+    @transitions.setter
+    def transitions(self, transitions):
+        # type: (Iterable[Tuple[datetime, bool]]) -> None
+        self.transitions_json = json.dumps([[_microseconds_since_epoch(t), succeeded] for t, succeeded in transitions])
+
+
+_EPOCH = timezone.datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def _microseconds_since_epoch(dt):
+    # type: (datetime) -> int
+    delta = dt - _EPOCH
+    return (delta.days * 24 * 60 * 60 + delta.seconds) * 10 ** 6 + delta.microseconds
+
+
+class StatusCheckHourlyRollup(StatusCheckRollup):
+    pass
+
+
+class StatusCheckDailyRollup(StatusCheckRollup):
+    pass
+
+
 class UserProfile(models.Model):
     user = models.OneToOneField(User, related_name='profile', on_delete=models.CASCADE)
 
@@ -1204,8 +1746,12 @@ class ResultFilter(models.Model):
     )
     match_if = models.TextField(max_length=1, null=False, blank=False, default=MATCH_ALL_IN, choices=MATCH_TYPE_CHOICES)
 
-    def matches_result(self, result):
-        # type: (StatusCheckResult) -> bool
+    def matches_result(self, result, result_tags=None):
+        # type: (StatusCheckResult, Optional[Iterable[str]]) -> bool
+        """
+        :param result: result to match
+        :param result_tags: the result's tag values, if already known (e.g. the result isn't saved yet)
+        """
 
         # status_check must match, regardless of match type
         if result.status_check_id != self.status_check_id:
@@ -1214,8 +1760,11 @@ class ResultFilter(models.Model):
         if self.match_if == self.MATCH_CHECK:
             return True
         elif self.match_if == self.MATCH_ALL_IN:
-            ack_tags = self.tags.values_list('value', flat=True)
-            return all([tag in ack_tags for tag in result.tags.values_list('value', flat=True)])
+            if result_tags is None:
+                result_tags = result.tags.values_list('value', flat=True)
+            # tags.all() so prefetch_related('tags') is used if present
+            ack_tags = set(tag.value for tag in self.tags.all())
+            return set(t for t in result_tags if t).issubset(ack_tags)
 
         raise NotImplementedError()
 
@@ -1230,8 +1779,8 @@ class Acknowledgement(ResultFilter):
       2) A periodic celery task calls ack.close() on checks where expire_at <= now.
 
     Acknowledgements are also automatically closed when their StatusCheck succeeds at least close_after_successes
-    times (consecutively). This is done by Acknowledgement.close_succeeding_acks(), which is called by StatusCheck.run()
-    whenever a check succeeds.
+    times (consecutively). This is done by Acknowledgement.close_succeeding_acks(), which is called by
+    StatusCheck.save_results() whenever a check succeeds.
 
     For simplicity, only one Acknowledgement can exist per StatusCheck. This is enforced by automatically closing
     Acknowledgements that already exist for the same status check in Acknowledgement.save() (with a fixed reason).
@@ -1272,38 +1821,102 @@ class Acknowledgement(ResultFilter):
         return acks.exclude(closed_at__lte=at_time).exclude(expire_at__lte=at_time).exclude(created_at__gt=at_time)
 
     @classmethod
-    def get_acks_matching_result(cls, result, at_time=None):
-        # type: (StatusCheckResult, Union[timezone.datetime, None]) -> List[Acknowledgement]
+    def get_acks_matching_result(cls, result, at_time=None, result_tags=None):
+        # type: (StatusCheckResult, Union[timezone.datetime, None], Optional[Iterable[str]]) -> List[Acknowledgement]
         """
         :param result: result to gather acks for
         :param at_time: only consider acks that were open at this time; leave None for all currently open acks
+        :param result_tags: the result's tag values, if already known (see matches_result())
         :returns list of Acknowledgements where ack.matches_result(result) == True
         """
-        return [a for a in cls.get_acks_matching_check(result.status_check, at_time) if a.matches_result(result)]
+        acks = cls.get_acks_matching_check(result.status_check, at_time).prefetch_related('tags')
+        if result_tags is None:
+            # once, rather than per ack
+            result_tags = set(result.tags.values_list('value', flat=True))
+        return [a for a in acks if a.matches_result(result, result_tags)]
 
     @classmethod
-    def close_succeeding_acks(cls, check, at_time=None):
-        # type: (StatusCheck, Union[timezone.datetime, None]) -> None
+    def close_succeeding_acks(cls, checks, acks_by_check=None):
+        # type: (Iterable[StatusCheck], Optional[Dict[int, List[Acknowledgement]]]) -> None
         """
-        This function closes acks that have hit their close_after_successes threshold.
-        This should be called after a StatusCheck saves a new StatusCheckResult (including its tags!).
-        It technically only needs to be called after a check succeeds, but it's idempotent - you can call it whenever.
-        :param check: StatusCheck to update acks for.
-        :param at_time: Time to pass into get_acks_matching_check. Leave as None to use timezone.now().
+        This function closes acks that have hit their close_after_successes threshold, with a single UPDATE.
+        Their checks' consecutive successes are counted from recent_results_bitmap, so this should be called after
+        it includes the new results (StatusCheck.save_results() does). Results are only read for thresholds longer
+        than the bitmap. It technically only needs to be called after a check succeeds, but it's idempotent - you can
+        call it whenever.
+        :param checks: StatusChecks to update acks for.
+        :param acks_by_check: the checks' acks, if already loaded (e.g. by AckIndex.acks_for_checks()); only the
+                              currently open ones are considered.
         """
-        for ack in cls.get_acks_matching_check(check, at_time=at_time):
-            if ack.close_after_successes:
-                # get last n results for our check, regardless of status
-                results = StatusCheckResult.objects.filter(status_check=ack.status_check)\
-                              .order_by('-time_complete', '-id').only('succeeded')[:ack.close_after_successes]
-
-                # now filter down to the results that succeeded
-                results = [r for r in results if r.succeeded]
+        if acks_by_check is None:
+            acks_by_check = ack_index.acks_for_checks([check.pk for check in checks])
+
+        now = timezone.now()
+        closing = defaultdict(list)  # type: Dict[int, List[Acknowledgement]]
+        for check in checks:
+            acks = [ack for ack in acks_by_check[check.pk] if ack.is_open(now) and ack.close_after_successes]
+            if not acks:
+                continue
+
+            if check.recent_results_bitmap is None:
+                check.refresh_recent_results()
+            recent = check.recent_results_bitmap
+            passed = len(list(takewhile(lambda outcome: outcome.succeeded, recent)))
+
+            for ack in acks:
+                streak = passed
+                if passed == RecentResults.SIZE and ack.close_after_successes > passed:
+                    # longer than the bitmap, count from the results
+                    results = StatusCheckResult.objects.filter(status_check=check.pk)\
+                        .order_by('-id').only('succeeded')[:ack.close_after_successes]
+                    streak = len(list(takewhile(lambda result: result.succeeded, results)))
 
                 # if we hit our threshold, this check should expire
-                if len(results) >= ack.close_after_successes:
-                    reason = 'check passed {} times'.format(len(results)) if len(results) != 1 else 'check passed'
-                    ack.close(reason)
+                if streak >= ack.close_after_successes:
+                    closing[ack.close_after_successes].append(ack)
+
+        if not closing:
+            return
+
+        reasons = {times: 'check passed {} times'.format(times) if times != 1 else 'check passed' for times in closing}
+        cls.objects.filter(pk__in=[ack.pk for closed in closing.values() for ack in closed]).update(
+            closed_at=now,
+            closed_reason=Case(*[When(pk__in=[ack.pk for ack in closed], then=Value(reasons[times]))
+                                 for times, closed in closing.items()], output_field=models.TextField()))
+        for times, closed in closing.items():
+            for ack in closed:
+                ack.closed_at, ack.closed_reason = now, reasons[times]
+        cls.acks_changed(set(ack.status_check_id for closed in closing.values() for ack in closed))
+
+    def is_open(self, at_time):
+        # type: (timezone.datetime) -> bool
+        """Whether get_acks_matching_check(at_time=at_time) would include this ack."""
+        return (self.created_at <= at_time and (self.closed_at is None or self.closed_at > at_time) and
+                (self.expire_at is None or self.expire_at > at_time))
+
+    @classmethod
+    @transaction.atomic()
+    def close_expired_acks(cls, now):
+        # type: (timezone.datetime) -> int
+        """
+        Close the open acks whose expire_at has passed with a single UPDATE, and recompute their checks' status
+        from the stored results (see StatusCheck.clear_acked_results()). Returns the number of acks closed.
+        """
+        expired = cls.objects.filter(closed_at__isnull=True, expire_at__lte=now)
+        check_ids = set(expired.values_list('status_check_id', flat=True))
+        if not check_ids:
+            return 0
+
+        closed = expired.update(closed_at=now, closed_reason='expired')
+        cls.acks_changed(check_ids)
+        StatusCheck.clear_acked_results(check_ids)
+        return closed
+
+    @classmethod
+    def acks_changed(cls, check_ids):
+        # type: (Iterable[int]) -> None
+        """Invalidate the AckIndex entries of these checks, in every process."""
+        StatusCheck.objects.filter(pk__in=check_ids).update(acks_version=uuid.uuid4().hex)
 
     def save(self, **kwargs):
         # THERE CAN BE ONLY ONE. for log trails.
@@ -1313,7 +1926,14 @@ class Acknowledgement(ResultFilter):
         for old_ack in existing:
             old_ack.close('ack updated')
 
-        return super(Acknowledgement, self).save(**kwargs)
+        ret = super(Acknowledgement, self).save(**kwargs)
+        Acknowledgement.acks_changed([self.status_check_id])
+        return ret
+
+    def delete(self, **kwargs):
+        ret = super(Acknowledgement, self).delete(**kwargs)
+        Acknowledgement.acks_changed([self.status_check_id])
+        return ret
 
     def close(self, reason):
         # type: (str) -> None
@@ -1341,6 +1961,87 @@ class Acknowledgement(ResultFilter):
         return ack
 
 
+class OnCallIndex(object):
+    """
+    Per-process index of each schedule's shifts (with their users), sorted by start time, so looking up who is on
+    duty doesn't query the database. A schedule's entry is keyed by its shifts_updated_at stamp: it's rebuilt when
+    update_shifts() commits in this process, and when a schedule with a different stamp is looked up (i.e. the
+    shifts were updated by another process).
+    """
+
+    def __init__(self):
+        # {schedule id: (shifts_updated_at, shift starts, [(start, end, shift id, user)], longest shift)}
+        self._schedules = {}
+
+    def _load(self, schedule_id, stamp):
+        shifts = [(shift.start, shift.end, shift.pk, shift.user)
+                  for shift in Shift.objects.filter(schedule_id=schedule_id, deleted=False)
+                  .select_related('user').order_by('start', 'id')]
+        entry = (stamp, [start for start, _, _, _ in shifts], shifts,
+                 max([end - start for start, end, _, _ in shifts] or [timedelta(0)]))
+        if stamp is not None:
+            # without a stamp (shifts never updated) there's no way to tell when the entry goes stale
+            self._schedules[schedule_id] = entry
+        return entry
+
+    def rebuild(self, schedule):
+        # type: (Schedule) -> None
+        self._load(schedule.pk, schedule.shifts_updated_at)
+
+    def duty_officers(self, schedule, at_time):
+        # type: (Schedule, datetime) -> List[User]
+        """The users with a shift in progress at at_time, in the order the shifts were created."""
+        entry = self._schedules.get(schedule.pk)
+        if entry is None or entry[0] != schedule.shifts_updated_at:
+            entry = self._load(schedule.pk, schedule.shifts_updated_at)
+        _, starts, shifts, longest = entry
+
+        if timezone.is_naive(at_time):
+            at_time = timezone.make_aware(at_time)
+        # only shifts that started in the last `longest` can still be in progress
+        first, last = bisect_right(starts, at_time - longest), bisect_left(starts, at_time)
+        current = sorted((shift_id, user) for start, end, shift_id, user in shifts[first:last] if end > at_time)
+        return [user for shift_id, user in current]
+
+
+on_call_index = OnCallIndex()
+
+
+class AckIndex(object):
+    """
+    Per-process index of each check's open (and recently closed) acks, with their tags, so matching a run's results
+    against them doesn't load the acks and tags every time. A check's entry is keyed by its acks_version, which
+    Acknowledgement.acks_changed() changes whenever one of its acks is saved (including closed), deleted or has its
+    tags changed, so the index only reads the current versions of the checks.
+    """
+
+    def __init__(self):
+        # {check id: (acks_version, [Acknowledgement])}
+        self._checks = {}
+
+    def acks_for_checks(self, check_ids):
+        # type: (Iterable[int]) -> Dict[int, List[Acknowledgement]]
+        """
+        :returns defaultdict of check id -> list of Acknowledgements (with tags prefetched) that are open or were
+                 closed in the last ACK_INDEX_CLOSED_SECONDS; use ack.is_open() to narrow them down to a point in time.
+        """
+        versions = dict(StatusCheck.objects.non_polymorphic().filter(pk__in=check_ids).order_by()
+                        .values_list('pk', 'acks_version'))
+        stale = [pk for pk, version in versions.iteritems() if self._checks.get(pk, (None,))[0] != version]
+        if stale:
+            closed_since = timezone.now() - timedelta(seconds=defs.ACK_INDEX_CLOSED_SECONDS)
+            acks = defaultdict(list)
+            for ack in Acknowledgement.objects.filter(status_check_id__in=stale)\
+                    .exclude(closed_at__lte=closed_since).prefetch_related('tags'):
+                acks[ack.status_check_id].append(ack)
+            for pk in stale:
+                self._checks[pk] = (versions[pk], acks[pk])
+        return defaultdict(list, ((pk, self._checks[pk][1]) for pk in versions))
+
+
+ack_index = AckIndex()
+
+
 def get_duty_officers(schedule, at_time=None):
     """
     Return the users on duty for a given schedule and time
@@ -1350,14 +2051,8 @@ def get_duty_officers(schedule, at_time=None):
     """
     if not at_time:
         at_time = timezone.now()
-    current_shifts = Shift.objects.filter(
-        deleted=False,
-        start__lt=at_time,
-        end__gt=at_time,
-        schedule=schedule,
-    )
-    if current_shifts:
-        duty_officers = [shift.user for shift in current_shifts]
+    duty_officers = on_call_index.duty_officers(schedule, at_time)
+    if duty_officers:
         return duty_officers
     else:
         if schedule.fallback_officer:
@@ -1386,7 +2081,7 @@ def get_all_duty_officers(at_time=None):
     """
     out = defaultdict(list)
 
-    for schedule in Schedule.objects.all():
+    for schedule in Schedule.objects.select_related('fallback_officer'):
         for user in get_duty_officers(schedule, at_time):
             out[user].append(schedule)
 
@@ -1401,7 +2096,7 @@ def get_all_fallback_officers():
     """
     out = defaultdict(list)
 
-    for schedule in Schedule.objects.all():
+    for schedule in Schedule.objects.select_related('fallback_officer'):
         out[schedule.fallback_officer].append(schedule)
 
     return out
@@ -1417,9 +2112,19 @@ def get_fallback_officers(schedule):
     return []
 
 
+def _same_time(a, b):
+    # iCal times may be naive or dates, which can't be compared with the stored (aware) times
+    try:
+        return a == b
+    except TypeError:
+        return False
+
+
 def update_shifts(schedule):
     """
-    Update oncall Shifts for a given schedule
+    Update oncall Shifts for a given schedule, by comparing the calendar's events with the stored shifts (by uid) and
+    only writing the differences: the new shifts in one bulk insert, the changed ones in one UPDATE (per batch),
+    and the ones no longer in the calendar in one soft delete.
     :param schedule: The oncall schedule
     :return: none
     """
@@ -1432,10 +2137,19 @@ def update_shifts(schedule):
         email_lookup[u.email.lower()] = u
 
     with transaction.atomic():
-        # Set all shifts to deleted, ones that are still active will set deleted to False
-        shifts = Shift.objects.filter(schedule=schedule)
-        shifts.update(deleted=True)
-
+        # new version of the shifts, for the OnCallIndex of every process
+        schedule.shifts_updated_at = timezone.now()
+        Schedule.objects.filter(pk=schedule.pk).update(shifts_updated_at=schedule.shifts_updated_at)
+        transaction.on_commit(lambda: on_call_index.rebuild(schedule))
+
+        shifts = list(Shift.objects.filter(schedule=schedule).order_by('id'))
+        existing = {}
+        for shift in shifts:
+            existing.setdefault(shift.uid, shift)
+        in_calendar = set()
+
+        new_shifts = []
+        changed = OrderedDict()
         for event in events:
             summary = event['summary'].lower().strip()
             attendee = event['attendee'].lower().strip()
@@ -1456,14 +2170,36 @@ def update_shifts(schedule):
                     logger.exception('Could not find user % for schedule %'.format(e, schedule.name))
                     return
 
-                s = Shift.objects.filter(uid=event['uid'], schedule=schedule).first()
+                in_calendar.add(event['uid'])
+                s = existing.get(event['uid'])
                 if s is None:
                     s = Shift(uid=event['uid'], schedule=schedule)
+                    existing[s.uid] = s
+                    new_shifts.append(s)
+                elif s.pk is not None and not (_same_time(s.start, event['start']) and
+                                               _same_time(s.end, event['end']) and
+                                               s.user_id == user.pk and not s.deleted):
+                    changed[s.pk] = s
 
                 s.start = event['start']
                 s.end = event['end']
                 s.user = user
                 s.deleted = False
-                s.schedule = schedule
-                s.updated = True
-                s.save()
+
+        # shifts that are no longer in the calendar (or duplicates of a uid) are soft-deleted
+        deleted = [shift.pk for shift in shifts
+                   if not shift.deleted and (shift.uid not in in_calendar or existing[shift.uid] is not shift)]
+
+        Shift.objects.bulk_create(new_shifts)
+        # in batches, so the queries stay under sqlite's limit on parameters
+        batch_size = 100
+        changed = changed.values()
+        for offset in range(0, len(changed), batch_size):
+            batch = changed[offset:offset + batch_size]
+            Shift.objects.filter(pk__in=[shift.pk for shift in batch]).update(**{
+                field.attname: Case(*[When(pk=shift.pk, then=Value(getattr(shift, field.attname), output_field=field))
+                                      for shift in batch], output_field=field)
+                for field in (Shift._meta.get_field(name) for name in ('start', 'end', 'user', 'deleted'))
+            })
+        for offset in range(0, len(deleted), batch_size):
+            Shift.objects.filter(pk__in=deleted[offset:offset + batch_size]).update(deleted=True)
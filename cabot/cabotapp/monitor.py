@@ -28,22 +28,29 @@ except ImportError:
     CONNECTION = None
 
 
-def _notify_cloudwatch(task_name, state):
+def put_metric(name, value=1, unit=None):
     '''
-    Update cloudwatch with a metric alert about a task
+    Send a metric to cloudwatch, if it's configured
     '''
     if CONNECTION:
         if PREFIX:
-            metric = '%s.%s.%s' % (PREFIX, task_name, state)
+            metric = '%s.%s' % (PREFIX, name)
         else:
-            metric = '%s.%s' % (task_name, state)
+            metric = name
 
         try:
-            CONNECTION.put_metric_data(NAMESPACE, metric, 1)
+            CONNECTION.put_metric_data(NAMESPACE, metric, value, unit=unit)
         except:
             logger.exception('Error sending cloudwatch metric')
 
 
+def _notify_cloudwatch(task_name, state):
+    '''
+    Update cloudwatch with a metric alert about a task
+    '''
+    put_metric('%s.%s' % (task_name, state))
+
+
 @task_success.connect
 def notify_success(sender=None, *args, **kwargs):
     '''
@@ -0,0 +1,204 @@
+"""
+Day-partitioned storage for the high-volume tables (Postgres 11+ only).
+
+`manage.py partition_tables` converts the tables below to tables range-partitioned by day, with the existing
+table attached as the partition holding everything up to the end of the day of conversion. After that, the
+create_partitions task keeps partitions created a week ahead, and maintain_partitions() (called by the clean_db
+task) drops whole partitions once they are past retention, instead of deleting rows. Snapshots are only written
+when a service's status changes, so before a snapshot partition is dropped, the snapshots in it that are still in
+effect are moved into the oldest partition that's kept.
+
+The partitioned tables keep their columns' defaults, their check constraints and their own foreign keys (to
+StatusCheck, Service and StatusCheckResultTag). But they can't be referenced by foreign keys (the partition
+column would have to be part of the reference), so the foreign key from the result tags join table to
+StatusCheckResult is the one constraint dropped. Django still deletes tags along with their results.
+"""
+from collections import namedtuple
+from datetime import datetime, timedelta
+import logging
+
+from django.db import connection
+from django.utils import timezone
+
+from cabot.cabotapp import defs
+from cabot.cabotapp.models import StatusCheckResult, ServiceStatusSnapshot
+
+
+logger = logging.getLogger(__name__)
+
+# column: what to partition by
+# added_column: True if the column doesn't exist on the model and is added (defaulting to the time of insertion)
+# primary_key: the columns of the primary key (the partition column is added)
+# unique: other unique columns, if any. The partition column is added, since Postgres only allows unique
+#   constraints on a partitioned table that include the partition key, so they're only enforced within a day
+# indexes: column lists to index
+# end_column: for rows that cover an interval, the column with the end of the interval (null while the row is still
+#   in effect). Rows whose interval reaches past the partitions being dropped are kept, starting at the oldest kept day
+PartitionedTable = namedtuple('PartitionedTable', ['model', 'column', 'added_column', 'primary_key', 'unique',
+                                                   'indexes', 'end_column'])
+
+PARTITIONED_TABLES = [
+    PartitionedTable(StatusCheckResult, 'time', False, ['id'], None,
+                     [['status_check_id', 'id', 'succeeded', 'acked'],
+                      ['status_check_id', 'time_complete', 'id', 'succeeded'], ['time'], ['time_complete']], None),
+    # the join table has no time column, so tag rows are partitioned by when they were inserted (right after their
+    # result); a partition is dropped together with the result partition for the same day. The unique constraint would
+    # allow a tag to be linked to a result again on a later day, but tags are added when the result is saved
+    PartitionedTable(StatusCheckResult.tags.through, 'created_at', True, ['id'],
+                     ['statuscheckresult_id', 'statuscheckresulttag_id'], [['statuscheckresulttag_id']], None),
+    PartitionedTable(ServiceStatusSnapshot, 'time', False, ['id'], None, [['service_id', 'time'], ['time']],
+                     'time_end'),
+]
+
+_DAY_FORMAT = '%Y%m%d'
+
+
+def _partition_name(table, day):
+    # type: (str, date) -> str
+    return '{}_p{}'.format(table, day.strftime(_DAY_FORMAT))
+
+
+def _day_bound(day):
+    # type: (date) -> str
+    return "'{} 00:00:00+00'".format(day.isoformat())
+
+
+def _is_partitioned(cursor, table):
+    # type: (CursorWrapper, str) -> bool
+    cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)', [table])
+    return cursor.fetchone() is not None
+
+
+def _partition_days(cursor, table):
+    # type: (CursorWrapper, str) -> Dict[date, str]
+    """:returns {day: partition name} of the table's partitions"""
+    cursor.execute('SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+                   'WHERE i.inhparent = to_regclass(%s)', [table])
+    prefix = '{}_p'.format(table)
+    days = {}
+    for name, in cursor.fetchall():
+        try:
+            days[datetime.strptime(name[len(prefix):], _DAY_FORMAT).date()] = name
+        except ValueError:
+            logger.warning('Ignoring partition %s of %s, which is not named by day', name, table)
+    return days
+
+
+def partition_tables():
+    """
+    Convert the PARTITIONED_TABLES that aren't partitioned yet. Locks the tables and scans the existing rows,
+    so run it in a maintenance window. Should be run in a transaction.
+    """
+    if connection.vendor != 'postgresql':
+        raise NotImplementedError('Partitioning is only supported on Postgres')
+
+    qn = connection.ops.quote_name
+    today = timezone.now().date()
+    with connection.cursor() as cursor:
+        for spec in PARTITIONED_TABLES:
+            table = spec.model._meta.db_table
+            if _is_partitioned(cursor, table):
+                continue
+            existing = _partition_name(table, today)
+            logger.info('Partitioning %s by %s, existing rows are in %s', table, spec.column, existing)
+
+            cursor.execute("SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                           "WHERE contype = 'f' AND confrelid = to_regclass(%s)", [table])
+            for referencing_table, constraint in cursor.fetchall():
+                cursor.execute('ALTER TABLE {} DROP CONSTRAINT {}'.format(referencing_table, qn(constraint)))
+
+            cursor.execute('ALTER TABLE {} RENAME TO {}'.format(qn(table), qn(existing)))
+            if spec.added_column:
+                cursor.execute('ALTER TABLE {} ADD COLUMN {} timestamp with time zone NOT NULL DEFAULT now()'
+                               .format(qn(existing), qn(spec.column)))
+
+            # not INCLUDING ALL: the existing primary key and unique indexes don't include the partition column
+            cursor.execute('CREATE TABLE {} (LIKE {} INCLUDING DEFAULTS INCLUDING CONSTRAINTS) PARTITION BY RANGE ({})'
+                           .format(qn(table), qn(existing), qn(spec.column)))
+            # LIKE doesn't copy foreign keys. A partitioned table can reference other tables, so add this table's back
+            cursor.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+                           "WHERE contype = 'f' AND conrelid = to_regclass(%s)", [existing])
+            for constraint, definition in cursor.fetchall():
+                cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} {}'.format(qn(table), qn(constraint), definition))
+            cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} PRIMARY KEY ({})'.format(
+                qn(table), qn(table + '_part_pkey'), ', '.join(qn(c) for c in spec.primary_key + [spec.column])))
+            if spec.unique:
+                cursor.execute('ALTER TABLE {} ADD CONSTRAINT {} UNIQUE ({})'.format(
+                    qn(table), qn(table + '_part_uniq'), ', '.join(qn(c) for c in spec.unique + [spec.column])))
+            for columns in spec.indexes:
+                cursor.execute('CREATE INDEX {} ON {} ({})'.format(
+                    qn('{}_{}_pidx'.format(table, '_'.join(columns))), qn(table), ', '.join(qn(c) for c in columns)))
+
+            # the id sequence belongs to the old table, and would be dropped with it
+            cursor.execute('SELECT pg_get_serial_sequence(%s, %s)', [existing, 'id'])
+            sequence, = cursor.fetchone()
+            cursor.execute('ALTER SEQUENCE {} OWNED BY {}.{}'.format(sequence, qn(table), qn('id')))
+
+            cursor.execute('ALTER TABLE {} ATTACH PARTITION {} FOR VALUES FROM (MINVALUE) TO ({})'.format(
+                qn(table), qn(existing), _day_bound(today + timedelta(days=1))))
+
+
+def _partitioned_specs(cursor):
+    # type: (CursorWrapper) -> List[PartitionedTable]
+    return [spec for spec in PARTITIONED_TABLES if _is_partitioned(cursor, spec.model._meta.db_table)]
+
+
+def create_partitions():
+    # type: () -> Set[Type[models.Model]]
+    """
+    Create any missing partitions for today and the next PARTITION_DAYS_AHEAD days. Inserts fail if there's no
+    partition for their day, so this runs often (the create_partitions task) to keep well ahead.
+    :returns the models whose tables are partitioned (empty unless on Postgres)
+    """
+    if connection.vendor != 'postgresql':
+        return set()
+
+    qn = connection.ops.quote_name
+    today = timezone.now().date()
+    with connection.cursor() as cursor:
+        specs = _partitioned_specs(cursor)
+        for spec in specs:
+            table = spec.model._meta.db_table
+            days = _partition_days(cursor, table)
+            for day in (today + timedelta(days=n) for n in range(defs.PARTITION_DAYS_AHEAD + 1)):
+                if day not in days:
+                    logger.info('Creating partition %s', _partition_name(table, day))
+                    cursor.execute('CREATE TABLE {} PARTITION OF {} FOR VALUES FROM ({}) TO ({})'.format(
+                        qn(_partition_name(table, day)), qn(table), _day_bound(day),
+                        _day_bound(day + timedelta(days=1))))
+
+    return set(spec.model for spec in specs)
+
+
+def maintain_partitions(cutoff=None):
+    # type: (Optional[datetime]) -> Set[Type[models.Model]]
+    """
+    Create partitions for the next few days and drop partitions that only hold rows older than cutoff (if given).
+    :returns the models whose tables are partitioned (empty unless on Postgres), which don't need rows deleted
+    """
+    partitioned = create_partitions()
+    if cutoff is None or not partitioned:
+        return partitioned
+
+    qn = connection.ops.quote_name
+    with connection.cursor() as cursor:
+        for spec in PARTITIONED_TABLES:
+            if spec.model not in partitioned:
+                continue
+            table = spec.model._meta.db_table
+
+            expired = [name for day, name in sorted(_partition_days(cursor, table).items())
+                       if day + timedelta(days=1) <= cutoff.date()]
+            if expired and spec.end_column:
+                kept_from = _day_bound(cutoff.date())
+                # Postgres (11+) moves the updated rows into the partition for their new time
+                cursor.execute('UPDATE {table} SET {column} = {bound} WHERE {column} < {bound} '
+                               'AND ({end} IS NULL OR {end} > {bound})'.format(
+                                   table=qn(table), column=qn(spec.column), end=qn(spec.end_column), bound=kept_from))
+                if cursor.rowcount:
+                    logger.info('Moved %s %s rows still in effect to %s', cursor.rowcount, table, kept_from)
+            for name in expired:
+                logger.info('Dropping partition %s', name)
+                cursor.execute('DROP TABLE {}'.format(qn(name)))
+
+    return partitioned
@@ -0,0 +1,79 @@
+from collections import namedtuple
+
+
+ResultOutcome = namedtuple('ResultOutcome', ['succeeded', 'acked'])
+
+
+class RecentResults(object):
+    """
+    Packed window of a check's most recent result outcomes, newest first.
+
+    Each result takes two bits (succeeded, acked) and the number of results in the window is stored above
+    the result bits, so the whole thing fits in a single integer column on StatusCheck.
+
+    Behaves like a read-only list of ResultOutcome, so it can be used in place of a list of StatusCheckResults
+    anywhere only `succeeded` and `acked` are looked at (e.g. get_success_with_retries()).
+    """
+    SIZE = 10
+
+    _SUCCEEDED = 0b01
+    _ACKED = 0b10
+    _BITS_PER_RESULT = 2
+    _COUNT_SHIFT = SIZE * _BITS_PER_RESULT
+    _RESULTS_MASK = (1 << _COUNT_SHIFT) - 1
+    _ACKED_MASK = int('10' * SIZE, 2)  # the _ACKED bit of every result
+
+    def __init__(self, bits=0):
+        # type: (int) -> None
+        self.bits = bits
+
+    @classmethod
+    def from_results(cls, results):
+        # type: (Iterable[StatusCheckResult]) -> RecentResults
+        """Build the window from results (or anything with succeeded/acked attributes), newest first."""
+        recent = cls()
+        for result in reversed(list(results)[:cls.SIZE]):
+            recent = recent.push(result.succeeded, result.acked)
+        return recent
+
+    def push(self, succeeded, acked=False):
+        # type: (bool, bool) -> RecentResults
+        """Returns a new window with this outcome as the newest result, dropping the oldest if the window is full."""
+        outcome = (self._SUCCEEDED if succeeded else 0) | (self._ACKED if acked else 0)
+        results = ((self.bits << self._BITS_PER_RESULT) | outcome) & self._RESULTS_MASK
+        count = min(len(self) + 1, self.SIZE)
+        return RecentResults(results | (count << self._COUNT_SHIFT))
+
+    def without_acks(self):
+        # type: () -> RecentResults
+        """Returns the same window with none of the results acked (e.g. after their ack closed)."""
+        return RecentResults(self.bits & ~self._ACKED_MASK)
+
+    def _outcome(self, index):
+        # type: (int) -> ResultOutcome
+        slot = (self.bits >> (index * self._BITS_PER_RESULT)) & (self._SUCCEEDED | self._ACKED)
+        return ResultOutcome(succeeded=bool(slot & self._SUCCEEDED), acked=bool(slot & self._ACKED))
+
+    def __len__(self):
+        return self.bits >> self._COUNT_SHIFT
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._outcome(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('recent results index out of range')
+        return self._outcome(index)
+
+    def __iter__(self):
+        return (self._outcome(i) for i in range(len(self)))
+
+    def __eq__(self, other):
+        return isinstance(other, RecentResults) and self.bits == other.bits
+
+    def __ne__(self, other):
+        return not (self == other)
+
+    def __repr__(self):
+        return 'RecentResults({})'.format(''.join('1' if r.succeeded else 'a' if r.acked else '0' for r in self))
@@ -0,0 +1,104 @@
+import logging
+import os
+import threading
+import time
+
+from django.conf import settings
+from django.db import connection
+
+from cabot.cabotapp.models import StatusCheck
+
+
+logger = logging.getLogger(__name__)
+
+
+class ResultBuffer(object):
+    """
+    Collects check runs (check, result, tags) in this process and saves them with StatusCheck.save_results(),
+    in one transaction per batch instead of one per run.
+
+    A batch is saved as soon as flush_size runs are buffered, or by a background thread at most flush_seconds
+    after the first run was buffered. Only the check's last_run is written right away. Anything still buffered
+    when the process exits is lost, so call flush() on shutdown.
+    """
+
+    def __init__(self, flush_size, flush_seconds):
+        # type: (int, float) -> None
+        self.flush_size = flush_size
+        self.flush_seconds = flush_seconds
+        self._runs = []
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._pid = None
+
+    def add(self, check, result, tags):
+        # type: (StatusCheck, StatusCheckResult, List[str]) -> None
+        # the scheduler goes by last_run, so record the run now instead of when the batch is saved, or the check
+        # would be queued again in the meantime
+        StatusCheck.objects.filter(pk=check.pk).update(last_run=result.time_complete)
+        with self._lock:
+            self._runs.append((check, result, tags))
+            full = len(self._runs) >= self.flush_size
+            self._start_thread()
+
+        if full:
+            self.flush()
+        else:
+            self._wakeup.set()
+
+    def flush(self):
+        # type: () -> None
+        """Save everything buffered so far."""
+        with self._lock:
+            runs, self._runs = self._runs, []
+        if not runs:
+            return
+
+        try:
+            self._save(runs)
+        except Exception:
+            # don't lose the whole batch because of one bad run (e.g. the check was deleted)
+            logger.exception('Error saving %s check results, saving them one at a time', len(runs))
+            for run in runs:
+                try:
+                    self._save([run])
+                except Exception:
+                    logger.exception('Error saving result for check %s', run[0].pk)
+
+    @staticmethod
+    def _save(runs):
+        # other runs may have updated these checks since they were loaded (and a failed save may have left them
+        # half-updated), so start from what's in the db
+        current = {pk: (last_run, bitmap) for pk, last_run, bitmap in StatusCheck.objects.filter(
+            pk__in=set(check.pk for check, _, _ in runs)).values_list('pk', 'last_run', 'recent_results_bitmap')}
+        for check, result, _ in runs:
+            check.last_run, check.recent_results_bitmap = current.get(check.pk, (check.last_run, None))
+            result.pk = None
+        StatusCheck.save_results(runs)
+
+    def _start_thread(self):
+        # the thread doesn't survive a fork (e.g. into a celery worker process), so start one per process
+        if self._pid == os.getpid():
+            return
+        self._pid = os.getpid()
+        self._thread = threading.Thread(target=self._flush_periodically, name='cabot-result-buffer')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def _flush_periodically(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # give the batch time to fill up
+            time.sleep(self.flush_seconds)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Error flushing check results')
+                # start over with a new connection next time
+                connection.close()
+
+
+result_buffer = ResultBuffer(flush_size=settings.CHECK_RESULTS_FLUSH_SIZE,
+                             flush_seconds=settings.CHECK_RESULTS_FLUSH_SECONDS)
@@ -0,0 +1,97 @@
+import logging
+import time
+
+from django.db import connection, transaction
+
+from cabot.cabotapp import defs
+
+
+logger = logging.getLogger(__name__)
+
+
+class RetentionDeleter(object):
+    """
+    Deletes a model's rows older than a cutoff in ranges of ids, oldest first (`id >= start AND id < start + n`,
+    so each batch is a primary key range scan, without a `LIMIT` subquery or re-reading already deleted rows).
+
+    The batch size (n) doubles while batches take less than half of RETENTION_TARGET_BATCH_SECONDS and halves
+    when they take longer, so deleting keeps up with however fast the database is.
+
+    Rows of the model's many-to-many tables are deleted explicitly before their parent rows, with plain DELETE
+    statements instead of going through the Django delete collector, which would load every row of the batch
+    first. That skips cascades, delete signals and delete() overrides, so nothing else may reference the model.
+    (Acknowledgement.delete() marks its check's acks as changed, which doesn't matter for acks closed this long
+    ago: the ack index doesn't hold them.)
+    """
+
+    def __init__(self, model, time_field, cutoff, batch_size=None):
+        # type: (Type[models.Model], str, datetime, Optional[int]) -> None
+        self.model = model
+        self.time_field = time_field
+        self.cutoff = cutoff
+        self.batch_size = batch_size or defs.RETENTION_MIN_BATCH_SIZE
+        self.deleted = 0
+        self.elapsed = 0.0
+        self.done = False
+
+    def _expired(self):
+        return self.model.objects.filter(**{'{}__lte'.format(self.time_field): self.cutoff})
+
+    def _watermark(self):
+        # type: () -> Optional[int]
+        """
+        Every expired row has an id below this, assuming rows expire in id order. Any that don't are deleted by a
+        later run, once the watermark has passed them.
+        """
+        newest = self._expired().order_by('-' + self.time_field).values_list('id', flat=True)[:1]
+        return newest[0] + 1 if newest else None
+
+    def run(self, deadline):
+        # type: (float) -> bool
+        """
+        Delete batches until there's nothing left to delete or time.time() passes deadline.
+        :returns True if there's nothing left to delete.
+        """
+        watermark = self._watermark()
+        oldest = self.model.objects.order_by('id').values_list('id', flat=True)[:1]
+        if watermark is None or not oldest:
+            self.done = True
+            return True
+
+        start = oldest[0]
+        while start < watermark and time.time() < deadline:
+            end = min(start + self.batch_size, watermark)
+            batch_start = time.time()
+            self._delete_batch(start, end)
+            batch_seconds = time.time() - batch_start
+            self.elapsed += batch_seconds
+            start = end
+
+            if batch_seconds < defs.RETENTION_TARGET_BATCH_SECONDS / 2:
+                self.batch_size = min(self.batch_size * 2, defs.RETENTION_MAX_BATCH_SIZE)
+            elif batch_seconds > defs.RETENTION_TARGET_BATCH_SECONDS:
+                self.batch_size = max(self.batch_size // 2, defs.RETENTION_MIN_BATCH_SIZE)
+
+        self.done = start >= watermark
+        logger.info('Deleted %s %s rows in %.1fs (%.0f rows/s), about %s ids left to check, batch size %s',
+                    self.deleted, self.model.__name__, self.elapsed, self.deleted / max(self.elapsed, 0.001),
+                    max(watermark - start, 0), self.batch_size)
+        return self.done
+
+    @transaction.atomic()
+    def _delete_batch(self, start, end):
+        # type: (int, int) -> None
+        qn = connection.ops.quote_name
+        expired = '{id} >= %s AND {id} < %s AND {time} <= %s'.format(
+            id=qn('id'), time=qn(self.model._meta.get_field(self.time_field).column))
+        params = [start, end, connection.ops.adapt_datetimefield_value(self.cutoff)]
+        with connection.cursor() as cursor:
+            for field in self.model._meta.many_to_many:
+                through = field.remote_field.through
+                cursor.execute('DELETE FROM {through} WHERE {parent} IN (SELECT {id} FROM {table} WHERE {expired})'
+                               .format(through=qn(through._meta.db_table),
+                                       parent=qn(through._meta.get_field(field.m2m_field_name()).column),
+                                       id=qn('id'), table=qn(self.model._meta.db_table), expired=expired), params)
+            # the many-to-many rows were the only things referencing these rows
+            cursor.execute('DELETE FROM {} WHERE {}'.format(qn(self.model._meta.db_table), expired), params)
+            self.deleted += cursor.rowcount
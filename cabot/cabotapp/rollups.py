@@ -0,0 +1,238 @@
+from collections import defaultdict, OrderedDict
+from datetime import datetime, timedelta
+from itertools import dropwhile, izip_longest
+import logging
+import sqlite3
+
+from django.db import connection, transaction
+from django.db.models import Case, Count, DateTimeField, F, IntegerField, Max, Min, Q, Sum, Value, When
+from django.utils import timezone
+
+from cabot.cabotapp.models import StatusCheckResult, StatusCheckHourlyRollup, StatusCheckDailyRollup
+
+
+logger = logging.getLogger(__name__)
+
+HOUR = timedelta(hours=1)
+DAY = timedelta(days=1)
+
+
+# Rollups are bucketed by hours and days in the default time zone (TIME_ZONE), which reports' date ranges use,
+# so a report's whole days can be read from the daily rollups. Stored times are UTC.
+def _floor_hour(dt):
+    # type: (datetime) -> datetime
+    local = timezone.localtime(dt)
+    return (local - timedelta(minutes=local.minute, seconds=local.second, microseconds=local.microsecond))\
+        .astimezone(timezone.utc)
+
+
+def _next_hour(hour):
+    # type: (datetime) -> datetime
+    return hour + HOUR
+
+
+def _floor_day(dt):
+    # type: (datetime) -> datetime
+    return _local_midnight(timezone.localtime(dt).date())
+
+
+def _next_day(day):
+    # type: (datetime) -> datetime
+    """The start of the day after this one (days are 23 or 25 hours long around DST changes)."""
+    return _local_midnight(timezone.localtime(day).date() + DAY)
+
+
+def _local_midnight(date):
+    # type: (date) -> datetime
+    return timezone.make_aware(datetime.combine(date, datetime.min.time()), is_dst=False).astimezone(timezone.utc)
+
+
+def _ceil(dt, floor, step):
+    floored = floor(dt)
+    return floored if floored == dt else step(floored)
+
+
+class RollupSummary(object):
+    """Accumulates rollups (in order) into the totals for a longer period."""
+
+    def __init__(self):
+        self.runs = 0
+        self.successes = 0
+        self.acked = 0
+        self.first_failure = None
+        self.last_failure = None
+        self.transitions = []
+
+    def add_rollup(self, rollup):
+        # type: (StatusCheckRollup) -> None
+        self.runs += rollup.runs
+        self.successes += rollup.successes
+        self.acked += rollup.acked
+        self.first_failure = self.first_failure or rollup.first_failure
+        self.last_failure = rollup.last_failure or self.last_failure
+        self.add_transitions(rollup.transitions)
+
+    def add_transitions(self, transitions):
+        for time, succeeded in transitions:
+            if not self.transitions or self.transitions[-1][1] != succeeded:
+                self.transitions.append((time, succeeded))
+
+    @property
+    def success_rate(self):
+        # type: () -> Optional[float]
+        """Percentage of runs that succeeded, or None if there weren't any."""
+        return self.successes / float(self.runs) * 100 if self.runs else None
+
+    def outages(self, now):
+        # type: (datetime) -> List[Tuple[datetime, Optional[datetime], timedelta]]
+        """(start, end, duration) of each period the check was failing, end is None if it still is."""
+        times = [time for time, _ in dropwhile(lambda transition: transition[1], self.transitions)]
+        pairs = izip_longest(*([iter(times)] * 2))
+        return [(start, end, (end or now) - start) for start, end in pairs]
+
+    def to_rollup(self, model, status_check_id, start):
+        # type: (Type[StatusCheckRollup], int, datetime) -> StatusCheckRollup
+        rollup = model(status_check_id=status_check_id, start=start, runs=self.runs, successes=self.successes,
+                       acked=self.acked, first_failure=self.first_failure, last_failure=self.last_failure)
+        rollup.transitions = self.transitions
+        return rollup
+
+
+def _supports_window_functions():
+    # type: () -> bool
+    if connection.vendor == 'sqlite':
+        return sqlite3.sqlite_version_info >= (3, 25)
+    if connection.vendor == 'mysql':
+        return connection.mysql_version >= (8, 0)
+    return connection.vendor == 'postgresql'
+
+
+def result_transitions(start, end, check_ids=None):
+    # type: (datetime, datetime, Optional[Iterable[int]]) -> Iterator[Tuple[int, datetime, bool]]
+    """
+    Stream the first result of each check between start and end, and every result whose outcome differs from the
+    one before it. Computed in the database with lag() where window functions are supported, so only those rows
+    are read.
+    :param check_ids: checks to include, or None for all of them
+    :returns (check id, time, succeeded), ordered by check and time
+    """
+    results = StatusCheckResult.objects.filter(time__gte=start, time__lt=end)
+    if check_ids is not None:
+        results = results.filter(status_check_id__in=check_ids)
+
+    if not _supports_window_functions():
+        previous = None
+        for status_check_id, time, succeeded in results.order_by('status_check_id', 'time', 'id')\
+                .values_list('status_check_id', 'time', 'succeeded').iterator():
+            if previous != (status_check_id, succeeded):
+                yield status_check_id, time, succeeded
+            previous = (status_check_id, succeeded)
+        return
+
+    # raw() applies the fields' converters (e.g. sqlite returns times as strings)
+    inner, params = results.extra(select={'previous': 'lag(succeeded) OVER (PARTITION BY status_check_id '
+                                                      'ORDER BY time, id)'})\
+        .values('id', 'status_check_id', 'time', 'succeeded', 'previous').query.sql_with_params()
+    sql = 'SELECT * FROM ({}) transitions WHERE previous IS NULL OR previous <> succeeded ' \
+          'ORDER BY status_check_id, time, id'.format(inner)
+    for result in StatusCheckResult.objects.raw(sql, params):
+        yield result.status_check_id, result.time, result.succeeded
+
+
+def _count_if(**conditions):
+    return Sum(Case(When(then=Value(1), **conditions), default=Value(0), output_field=IntegerField()))
+
+
+def _failure_time():
+    return Case(When(succeeded=False, then=F('time')), output_field=DateTimeField())
+
+
+def _hourly_rollups(hour):
+    # type: (datetime) -> List[StatusCheckHourlyRollup]
+    """Rollups for every check with results in this hour, from one aggregate query and the transitions."""
+    totals = StatusCheckResult.objects.filter(time__gte=hour, time__lt=hour + HOUR).order_by()\
+        .values('status_check_id')\
+        .annotate(runs=Count('id'), successes=_count_if(succeeded=True), acked=_count_if(acked=True),
+                  first_failure=Min(_failure_time()), last_failure=Max(_failure_time()))
+    rollups = OrderedDict((row['status_check_id'], StatusCheckHourlyRollup(start=hour, **row)) for row in totals)
+
+    transitions = defaultdict(list)
+    for status_check_id, time, succeeded in result_transitions(hour, hour + HOUR):
+        transitions[status_check_id].append((time, succeeded))
+    for status_check_id, rollup in rollups.items():
+        rollup.transitions = transitions[status_check_id]
+    return rollups.values()
+
+
+@transaction.atomic()
+def compact_rollups(start, end):
+    # type: (datetime, datetime) -> None
+    """
+    Recompute the hourly rollups for every hour between start and end from the results, then the daily rollups
+    for those days from the hourly rollups. Results deleted by retention stay counted in the rollups.
+    """
+    start, end = _floor_hour(start), _ceil(end, _floor_hour, _next_hour)
+
+    hourly = []
+    hour = start
+    while hour < end:
+        hourly.extend(_hourly_rollups(hour))
+        hour = _next_hour(hour)
+
+    StatusCheckHourlyRollup.objects.filter(start__gte=start, start__lt=end).delete()
+    StatusCheckHourlyRollup.objects.bulk_create(hourly)
+
+    day_start, day_end = _floor_day(start), _ceil(end, _floor_day, _next_day)
+    daily = OrderedDict()
+    for rollup in StatusCheckHourlyRollup.objects.filter(start__gte=day_start, start__lt=day_end)\
+            .order_by('status_check_id', 'start').iterator():
+        daily.setdefault((rollup.status_check_id, _floor_day(rollup.start)), RollupSummary()).add_rollup(rollup)
+
+    StatusCheckDailyRollup.objects.filter(start__gte=day_start, start__lt=day_end).delete()
+    StatusCheckDailyRollup.objects.bulk_create(
+        summary.to_rollup(StatusCheckDailyRollup, status_check_id, day)
+        for (status_check_id, day), summary in daily.items())
+
+    logger.info('Compacted %s hourly and %s daily rollups between %s and %s', len(hourly), len(daily), start, end)
+
+
+def backfill_rollups():
+    # type: () -> Optional[datetime]
+    """
+    If there are stored results from before the earliest hourly rollup (e.g. saved before rollups existed, so
+    reports would leave them out), recompute the rollups for the whole day of the newest of them. Whole days, so
+    the day's daily rollup counts all of its results. Call repeatedly to backfill all of them, newest day first.
+    :returns the start of the backfilled day, or None if there was nothing to backfill
+    """
+    earliest = StatusCheckHourlyRollup.objects.order_by('start').values_list('start', flat=True)[:1]
+    results = StatusCheckResult.objects.filter(time__lt=earliest[0]) if earliest else StatusCheckResult.objects
+    newest = results.order_by('-time').values_list('time', flat=True)[:1]
+    if not newest:
+        return None
+    day = _floor_day(newest[0])
+    compact_rollups(day, _next_day(day))
+    return day
+
+
+def summarize(check_ids, start, end):
+    # type: (Iterable[int], datetime, datetime) -> Dict[int, RollupSummary]
+    """
+    Summarize the rollups of these checks between start and end (rounded to the hour), using the daily rollups
+    for whole days and hourly rollups for the rest.
+    :returns {check id: RollupSummary}, for checks that have any rollups
+    """
+    start, end = _floor_hour(start), _ceil(end, _floor_hour, _next_hour)
+    first_day, last_day = _ceil(start, _floor_day, _next_day), _floor_day(end)
+
+    hourly = StatusCheckHourlyRollup.objects.filter(status_check_id__in=check_ids, start__gte=start, start__lt=end)
+    rollups = []
+    if first_day < last_day:
+        rollups.extend(StatusCheckDailyRollup.objects.filter(status_check_id__in=check_ids, start__gte=first_day,
+                                                             start__lt=last_day))
+        hourly = hourly.filter(Q(start__lt=first_day) | Q(start__gte=last_day))
+    rollups.extend(hourly)
+
+    summaries = {}
+    for rollup in sorted(rollups, key=lambda r: (r.status_check_id, r.start)):
+        summaries.setdefault(rollup.status_check_id, RollupSummary()).add_rollup(rollup)
+    return summaries
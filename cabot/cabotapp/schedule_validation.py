@@ -76,7 +76,7 @@ def _find_problems(schedule, current_time=None):
     # test the iCal url
     if schedule.ical_url:
         try:
-            schedule.get_calendar_data()
+            schedule.validate_calendar()
         except requests.RequestException as e:
             problems.append("The schedule's iCal URL returns an HTTP error ({}).".format(e))
         except Exception as e:
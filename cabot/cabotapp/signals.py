@@ -1,10 +1,35 @@
-from django.db.models.signals import post_save
+from django.contrib.auth.models import User
+from django.db.models.signals import m2m_changed, post_save
 from django.dispatch import receiver
 
-from cabot.cabotapp.models import Schedule
-from cabot.cabotapp.tasks import reset_shifts_and_problems
+from cabot.cabotapp.models import Acknowledgement, Schedule, check_status_changed
+from cabot.cabotapp.tasks import reset_shifts_and_problems, update_services_for_checks
 
 
 @receiver(post_save, sender=Schedule, dispatch_uid="reset_shifts_and_problems")
 def schedule_post_save(sender, instance, **kwargs):
     reset_shifts_and_problems.apply_async(args=[instance.id])
+
+
+@receiver(post_save, sender=User, dispatch_uid="forget_calendar_versions")
+def user_post_save(sender, instance, created, update_fields=None, **kwargs):
+    # shifts are matched to active users by username or email, so users changing can change the shifts without the
+    # iCal feeds changing - make the next update_shift_and_problems() update the shifts from every feed
+    if created or update_fields is None or {'username', 'email', 'is_active'} & set(update_fields):
+        Schedule.objects.update(ical_etag='', ical_last_modified='', ical_hash='')
+
+
+@receiver(check_status_changed, dispatch_uid="update_services_for_checks")
+def status_check_status_changed(sender, check_ids, **kwargs):
+    update_services_for_checks.apply_async(args=[check_ids])
+
+
+@receiver(m2m_changed, sender=Acknowledgement.tags.through, dispatch_uid="ack_tags_changed")
+def ack_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        Acknowledgement.acks_changed([instance.status_check_id])
+    elif pk_set:
+        # tag.acknowledgement_set changed
+        Acknowledgement.acks_changed(Acknowledgement.objects.filter(pk__in=pk_set).values('status_check_id'))
@@ -1,19 +1,26 @@
 import os
 from datetime import timedelta
 import logging
+import time
 
 from celery import Celery
 from celery._state import set_default_app
+from celery.signals import worker_process_shutdown
 from celery.task import task
 from django.core.mail import EmailMessage
 from django.core.urlresolvers import reverse
 
 from cabot.cabotapp.models import Schedule, StatusCheckResultTag, StatusCheckResult, Acknowledgement, StatusCheck
+from cabot.cabotapp import defs, partitions, rollups
+from cabot.cabotapp.result_buffer import result_buffer
+from cabot.cabotapp.retention import RetentionDeleter
 from cabot.cabotapp.schedule_validation import update_schedule_problems
 from cabot.cabotapp.utils import build_absolute_url
 from cabot.celery.celery_queue_config import STATUS_CHECK_TO_QUEUE
 
 from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
 from django.utils import timezone
 
 from cabot.cabotapp import models
@@ -63,7 +70,16 @@ def _classify_status_check(pk):
 @task(ignore_result=True)
 def run_status_check(pk):
     check = models.StatusCheck.objects.get(pk=pk)
-    check.run()
+    if settings.CHECK_RESULTS_WRITE_BEHIND:
+        result, tags = check.probe()
+        result_buffer.add(check, result, tags)
+    else:
+        check.run()
+
+
+@worker_process_shutdown.connect
+def flush_result_buffer(*args, **kwargs):
+    result_buffer.flush()
 
 
 @task(ignore_result=True)
@@ -90,13 +106,39 @@ def update_service(service_or_id):
     service.update_status()
 
 
+@task(ignore_result=True)
+def update_services_for_checks(check_ids):
+    # type: (List[int]) -> None
+    """Update the alerting services that contain any of these checks (found through the service-check table)."""
+    services = models.Service.objects.filter(alerts_enabled=True, status_checks__in=check_ids).order_by()\
+        .values_list('id', flat=True).distinct()
+    for service_id in services:
+        update_service.apply_async((service_id,))
+
+
 @task(ignore_result=True)
 def update_all_services():
+    """
+    Safety sweep: services are updated when their checks' status changes (update_services_for_checks), this catches
+    anything that didn't go through a check, e.g. checks added to a service.
+    """
     services = models.Service.objects.filter(alerts_enabled=True)
     for service in services:
         update_service.apply_async((service.id,))
 
 
+@task(ignore_result=True)
+def update_failing_services():
+    """
+    Update the services that aren't passing, whose checks may not change for a while, so repeat alerts are sent
+    (see Service.alert()).
+    """
+    services = models.Service.objects.filter(alerts_enabled=True)\
+        .exclude(overall_status=models.Service.PASSING_STATUS).values_list('id', flat=True)
+    for service_id in services:
+        update_service.apply_async((service_id,))
+
+
 @task(ignore_result=True)
 def update_shifts_and_problems():
     schedules = models.Schedule.objects.all()
@@ -109,9 +151,20 @@ def update_shift_and_problems(schedule_id):
     schedule = models.Schedule.objects.get(id=schedule_id)
 
     try:
-        models.update_shifts(schedule)
+        changed = schedule.calendar_changed()
     except Exception:
-        logger.exception('Error when updating shifts for schedule %s.', schedule.name)
+        # update_shifts() and the problems will report it
+        changed = True
+
+    if changed:
+        try:
+            models.update_shifts(schedule)
+            schedule.mark_calendar_synced()
+        except Exception:
+            logger.exception('Error when updating shifts for schedule %s.', schedule.name)
+    else:
+        logger.debug('iCal feed for schedule %s is unchanged, not updating shifts.', schedule.name)
+        schedule.mark_calendar_synced()
 
     try:
         update_schedule_problems(schedule)  # must happen after update_shifts()
@@ -123,6 +176,24 @@ def update_shift_and_problems(schedule_id):
         send_schedule_problems_email.apply_async((schedule.pk,))
 
 
+@task(ignore_result=True)
+def refresh_shifts(schedule_id):
+    """
+    Update a schedule's shifts if its iCal feed changed, for the shift list page (see ShiftListView). Doesn't update
+    the schedule problems or send emails, that's left to update_shift_and_problems.
+    """
+    schedule = models.Schedule.objects.filter(id=schedule_id).first()
+    if schedule is None:
+        return
+
+    try:
+        if schedule.calendar_changed():
+            models.update_shifts(schedule)
+        schedule.mark_calendar_synced()
+    except Exception:
+        logger.exception('Error when refreshing shifts for schedule %s.', schedule.name)
+
+
 @task(ignore_result=True)
 def reset_shifts_and_problems(schedule_id):
     """
@@ -137,6 +208,7 @@ def reset_shifts_and_problems(schedule_id):
 
     try:
         models.update_shifts(schedule)
+        schedule.mark_calendar_synced()
     except Exception:
         logger.exception('Error when resetting shifts for schedule %s.', schedule.name)
 
@@ -147,44 +219,53 @@ def reset_shifts_and_problems(schedule_id):
 
 
 @task(ignore_result=True)
-def clean_db(days_to_retain=60):
+def clean_db(days_to_retain=60, batch_sizes=None):
     """
     Clean up database otherwise it gets overwhelmed with StatusCheckResults.
 
-    To loop over undeleted results, spawn new tasks to make sure
-    db connection closed etc
+    Deletes for up to CLEAN_DB_TIME_LIMIT_SECONDS, then spawns a new task to continue (to make sure db connection
+    closed etc), passing along the batch sizes the deletes have adapted to.
     """
-
-    to_discard_results = models.StatusCheckResult.objects.filter(
-        time__lte=timezone.now()-timedelta(days=days_to_retain))
-    to_discard_snapshots = models.ServiceStatusSnapshot.objects.filter(
-        time__lte=timezone.now()-timedelta(days=days_to_retain))
-    to_discard_acks = models.Acknowledgement.objects.filter(
-        closed_at__lte=timezone.now()-timedelta(days=days_to_retain))
-
-    result_ids = to_discard_results.values_list('id', flat=True)[:100]
-    snapshot_ids = to_discard_snapshots.values_list('id', flat=True)[:100]
-    ack_ids = to_discard_acks.values_list('id', flat=True)[:100]
-
-    if not result_ids:
-        logger.info('Completed deleting StatusCheckResult objects')
-    if not snapshot_ids:
-        logger.info('Completed deleting ServiceStatusSnapshot objects')
-    if not ack_ids:
-        logger.info('Completed deleting Acknowledgement objects')
-    if (not snapshot_ids) and (not result_ids) and (not ack_ids):
+    cutoff = timezone.now() - timedelta(days=days_to_retain)
+    # partitioned tables (Postgres only) drop whole days of rows at once, so only delete from the others
+    partitioned = partitions.maintain_partitions(cutoff)
+
+    batch_sizes = batch_sizes or {}
+    deleters = [RetentionDeleter(model, time_field, model_cutoff, batch_sizes.get(model.__name__))
+                for model, time_field, model_cutoff in (
+                    (models.StatusCheckResult, 'time', cutoff),
+                    # snapshots still in effect have no time_end, so they're never expired
+                    (models.ServiceStatusSnapshot, 'time_end', cutoff),
+                    (models.Acknowledgement, 'closed_at', cutoff),
+                    # daily rollups are kept, for reports on older results. Hourly ones are kept until their whole
+                    # hour is past the cutoff, so every stored result has one (see rollups.backfill_rollups())
+                    (models.StatusCheckHourlyRollup, 'start', cutoff - timedelta(hours=1)))
+                if model not in partitioned]
+
+    deadline = time.time() + defs.CLEAN_DB_TIME_LIMIT_SECONDS
+    for deleter in deleters:
+        if deleter.run(deadline):
+            logger.info('Completed deleting %s objects', deleter.model.__name__)
+
+    if all(deleter.done for deleter in deleters):
         return
 
-    logger.info('Processing %s StatusCheckResult objects' % len(result_ids))
-    logger.info('Processing %s ServiceStatusSnapshot objects' %
-                len(snapshot_ids))
+    clean_db.apply_async(kwargs={'days_to_retain': days_to_retain,
+                                 'batch_sizes': {d.model.__name__: d.batch_size for d in deleters}},
+                         countdown=3)
 
-    models.StatusCheckResult.objects.filter(id__in=result_ids).delete()
-    models.ServiceStatusSnapshot.objects.filter(id__in=snapshot_ids).delete()
-    models.Acknowledgement.objects.filter(id__in=ack_ids).delete()
 
-    clean_db.apply_async(kwargs={'days_to_retain': days_to_retain},
-                         countdown=3)
+@task(ignore_result=True)
+def create_partitions():
+    partitions.create_partitions()
+
+
+@task(ignore_result=True)
+def compact_rollups():
+    now = timezone.now()
+    rollups.compact_rollups(now - timedelta(hours=defs.ROLLUP_RECOMPUTE_HOURS), now)
+    # results from before rollups existed get theirs a day at a time, so reports include them
+    rollups.backfill_rollups()
 
 
 # because django 1.6 doesn't have send_mail(html_message=...) :|
@@ -248,23 +329,45 @@ def send_schedule_problems_email(schedule_id):
 
 @task(ignore_result=True)
 def clean_orphaned_tags():
-    ack_tags = Acknowledgement.tags.through.objects.values('statuscheckresulttag')
-    result_tags = StatusCheckResult.tags.through.objects.values('statuscheckresulttag')
-    orphaned_tags = StatusCheckResultTag.objects.exclude(pk__in=ack_tags).exclude(pk__in=result_tags)
-
-    logger.info("Deleting {} orphaned tags (out of {} total tags)..."
-                .format(orphaned_tags.count(), StatusCheckResultTag.objects.count()))
-    orphaned_tags.delete()
+    """
+    Delete tags that no result or ack references. Only tags that haven't been used for TAG_UNUSED_DAYS are looked
+    at (through the last_used index), and their references are looked up by tag, so the work depends on how many
+    tags went out of use rather than on how many results there are. Unused tags that are still referenced (by old
+    results or acks) are marked used, so they aren't looked at again until TAG_UNUSED_DAYS later.
+    """
+    unused = Q(last_used__lt=timezone.now() - timedelta(days=defs.TAG_UNUSED_DAYS)) | Q(last_used__isnull=True)
+    deleted = kept = 0
+    while True:
+        with transaction.atomic():
+            candidates = list(StatusCheckResultTag.objects.filter(unused).order_by()
+                              .values_list('value', flat=True)[:defs.TAG_CLEANUP_BATCH_SIZE])
+            if not candidates:
+                break
+            referenced = set()
+            for through in (StatusCheckResult.tags.through, Acknowledgement.tags.through):
+                referenced.update(through.objects.filter(statuscheckresulttag__in=candidates)
+                                  .values_list('statuscheckresulttag', flat=True).distinct())
+
+            # the tags are only deleted if they haven't been used since we looked (so nothing references them).
+            # delete() still looks up their links in both join tables (by tag, so it's cheap), which keeps a link
+            # made in the meantime from pointing at a deleted tag
+            orphaned = StatusCheckResultTag.objects.filter(
+                unused, value__in=[value for value in candidates if value not in referenced])
+            deleted += orphaned.delete()[1].get(StatusCheckResultTag._meta.label, 0)
+            kept += StatusCheckResultTag.objects.filter(value__in=referenced).update(last_used=timezone.now())
+
+    logger.info("Deleted %s orphaned tags, %s unused tags are still referenced", deleted, kept)
 
 
 @task(ignore_result=True)
 def close_expired_acknowledgements():
-    now = timezone.now()
-
-    # loop over open acks where expire_at >= now
-    for ack in Acknowledgement.objects.filter(closed_at__isnull=True, expire_at__lte=now):
-        ack.close('expired')
-        update_check_and_services.apply_async((ack.status_check_id,))
+    """
+    Close expired acks and update their checks' status from the results they already have, rather than running
+    them again; the services of the checks that changed are then updated once each (see update_services_for_checks).
+    """
+    closed = Acknowledgement.close_expired_acks(timezone.now())
+    if closed:
+        logger.info('Closed %s expired acknowledgements', closed)
 
 
 @task(ignore_result=True)
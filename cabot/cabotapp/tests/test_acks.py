@@ -1,9 +1,11 @@
 from mock import patch
 from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
 from django.utils import timezone
 
 from cabot.cabotapp import tasks
-from cabot.cabotapp.models import Acknowledgement, StatusCheckResult, StatusCheckResultTag
+from cabot.cabotapp.models import Acknowledgement, StatusCheck, StatusCheckResult, StatusCheckResultTag
 from cabot.cabotapp.tests.utils import LocalTestCase, fake_http_404_response, fake_http_200_response
 
 
@@ -169,6 +171,36 @@ class TestAcks(LocalTestCase):
         self.assertFalse(Acknowledgement.objects.filter(pk=ack.pk, closed_at__isnull=True).exists())
         self.assertTrue(Acknowledgement.objects.filter(pk=ack_not_yet.pk, closed_at__isnull=True).exists())
 
+    @patch('cabot.cabotapp.models.transaction.on_commit', lambda callback: callback())
+    @patch('cabot.cabotapp.signals.update_services_for_checks')
+    def test_expired_acks_update_status_without_running(self, fake_update_services):
+        now = timezone.now()
+        ack = Acknowledgement(status_check=self.http_check, match_if=Acknowledgement.MATCH_CHECK,
+                              created_at=now - timezone.timedelta(hours=1), expire_at=now + timezone.timedelta(hours=1))
+        ack.save()
+        self.fail_http_check()
+        self.assertEqual(self.http_check.calculated_status, 'acked')
+        passing = Acknowledgement(status_check=self.tcp_check, match_if=Acknowledgement.MATCH_CHECK,
+                                  created_at=now - timezone.timedelta(hours=1), expire_at=now)
+        passing.save()
+        fake_update_services.reset_mock()
+
+        with patch('cabot.cabotapp.models.requests.request') as fake_request:
+            with patch('cabot.cabotapp.tasks.timezone.now', return_value=now + timezone.timedelta(hours=2)):
+                tasks.close_expired_acknowledgements()
+        self.assertFalse(fake_request.called)
+
+        self.assertEqual(set(Acknowledgement.objects.values_list('closed_reason', flat=True)), {'expired'})
+        self.http_check.refresh_from_db()
+        self.assertEqual(self.http_check.calculated_status, 'failing')
+        self.assertFalse(self.http_check.recent_results_bitmap[0].acked)
+        # the result is still stored as acked, but rebuilding the bitmap doesn't bring the ack back
+        self.assertTrue(self.http_check.last_result().acked)
+        self.http_check.refresh_recent_results()
+        self.assertFalse(self.http_check.recent_results_bitmap[0].acked)
+        # only the check whose status changed
+        fake_update_services.apply_async.assert_called_once_with(args=[[self.http_check.pk]])
+
     def test_service_acked_status(self):
         self.pass_http_check()
 
@@ -193,6 +225,39 @@ class TestAcks(LocalTestCase):
         self.service.update_status()
         self.assertEquals(self.service.overall_status, 'CRITICAL')
 
+    def test_ack_index(self):
+        """Results are matched against cached acks until the check's acks change"""
+        def save_failure(tags):
+            now = timezone.now()
+            result = StatusCheckResult(status_check=self.http_check, succeeded=False, time=now, time_complete=now)
+            StatusCheck.save_results([(self.http_check, result, tags)])
+            return result
+
+        ack = Acknowledgement(status_check=self.http_check, match_if=Acknowledgement.MATCH_ALL_IN)
+        ack.save()
+        ack.tags.add(StatusCheckResultTag.objects.create(value='cool_tag'))
+        self.assertTrue(save_failure(['cool_tag']).acked)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.assertFalse(save_failure(['other_tag']).acked)
+        self.assertFalse([q for q in queries if Acknowledgement._meta.db_table in q['sql']])
+
+        # tags changed
+        ack.tags.add(StatusCheckResultTag.objects.get_or_create(value='other_tag')[0])
+        self.assertTrue(save_failure(['other_tag']).acked)
+
+        # closed
+        ack.close('done')
+        self.assertFalse(save_failure(['cool_tag']).acked)
+
+    def test_check_save_keeps_acks_version(self):
+        check = StatusCheck.objects.get(pk=self.http_check.pk)
+        Acknowledgement.acks_changed([self.http_check.pk])
+        version = StatusCheck.objects.get(pk=self.http_check.pk).acks_version
+
+        check.save()
+        self.assertEqual(StatusCheck.objects.get(pk=self.http_check.pk).acks_version, version)
+
     def test_match_check_only(self):
         ack = Acknowledgement(status_check=self.http_check, match_if=Acknowledgement.MATCH_CHECK)
         ack.save()
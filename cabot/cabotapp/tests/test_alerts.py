@@ -3,8 +3,8 @@ from mock import ANY, call, patch
 from django.conf import settings
 from django.contrib.auth.models import User
 from django.utils import timezone
-from cabot.cabotapp.alert import send_alert, AlertPlugin
-from cabot.cabotapp.models import Schedule, Service, UserProfile
+from cabot.cabotapp.alert import send_alert, send_alerts_async, send_pending_alerts, AlertPlugin, PendingAlert
+from cabot.cabotapp.models import Schedule, Service, StatusCheck, UserProfile
 from .utils import LocalTestCase
 
 
@@ -24,21 +24,21 @@ class TestAlerts(LocalTestCase):
         self.assertEqual(self.service.users_to_notify.all().count(), 1)
         self.assertEqual(self.service.users_to_notify.get().username, self.user.username)
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_alert(self, fake_send_alert):
         self.service.alert()
         self.assertEqual(fake_send_alert.call_count, 1)
-        fake_send_alert.assert_called_with(self.service, duty_officers=[], fallback_officers=[])
+        fake_send_alert.assert_called_with(self.service, [([], [])])
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_alert_no_schedule(self, fake_send_alert):
         """Users only should be alerted if there's no oncall schedule"""
         self.service.schedules = []
         self.service.alert()
         self.assertEqual(fake_send_alert.call_count, 1)
-        fake_send_alert.assert_called_with(self.service)
+        fake_send_alert.assert_called_with(self.service, [([], [])])
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_alert_empty_schedule(self, fake_send_alert):
         """Test service.alert() when there are no UserProfiles for the oncall schedule.
            The fallback officer shouldb be alerted."""
@@ -52,9 +52,9 @@ class TestAlerts(LocalTestCase):
         service.alert()
         self.assertEqual(fake_send_alert.call_count, 1)
         # Since there are no duty officers with profiles, the fallback will be alerted
-        fake_send_alert.assert_called_with(service, duty_officers=[self.user], fallback_officers=[self.user])
+        fake_send_alert.assert_called_with(service, [([self.user], [self.user])])
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_alert_multiple_schedules(self, fake_send_alert):
         """
         Make sure service.alert() works with multiple schedules per service.
@@ -77,11 +77,9 @@ class TestAlerts(LocalTestCase):
         service.update_status()
 
         service.alert()
-        self.assertEqual(fake_send_alert.call_count, 2)
+        self.assertEqual(fake_send_alert.call_count, 1)
         # Since there are no duty officers with profiles, the fallback will be alerted
-        calls = [call(service, duty_officers=[self.user], fallback_officers=[self.user]),
-                 call(service, duty_officers=[user], fallback_officers=[user])]
-        fake_send_alert.has_calls(calls)
+        fake_send_alert.assert_called_with(service, [([self.user], [self.user]), ([user], [user])])
 
     @patch('cabot.cabotapp.alert.AlertPlugin.send_alert')
     def test_alert_plugin(self, fake_send_alert):
@@ -143,9 +141,122 @@ class TestAlerts(LocalTestCase):
         self.assertEqual(fake_send_alert.call_count, 1)
         fake_send_alert.assert_called_once_with(self.service, ANY, duty_officers)
 
+    @patch('cabot.cabotapp.alert.monitor.put_metric')
+    @patch('cabot.cabotapp.alert.AlertPlugin.send_alert')
+    def test_send_alerts_async(self, fake_send_alert, fake_put_metric):
+        """Each plugin sends the alert to each schedule's duty officers (and fallback officers if that fails)"""
+        alert_plugin = AlertPlugin()
+        alert_plugin.save()
+        self.service.alerts.add(alert_plugin)
+        user = User.objects.create(username='fallback')
+        fake_send_alert.side_effect = [RuntimeError, None, None]
+
+        send_alerts_async(self.service, [([self.user], [user]), ([user], [])])
+
+        self.assertEqual(fake_send_alert.call_args_list, [call(self.service, ANY, [self.user]),
+                                                          call(self.service, ANY, [user]),
+                                                          call(self.service, ANY, [user])])
+        fake_put_metric.assert_any_call('alert.noop.latency', ANY, unit='Seconds')
+        self.assertFalse(PendingAlert.objects.exists())
+
+    @patch('cabot.cabotapp.alert.send_pending_alerts.apply_async')
+    @patch('cabot.cabotapp.alert.AlertPlugin.send_alert')
+    def test_coalesce_alerts(self, fake_send_alert, fake_apply_async):
+        """Alerts through the same plugin to the same people are sent together"""
+        alert_plugin = AlertPlugin()
+        alert_plugin.save()
+        other = Service.objects.create(name='Other')
+        for service in (self.service, other):
+            service.alerts.add(alert_plugin)
+        user = User.objects.create(username='other')
+
+        send_alerts_async(self.service, [([self.user], [])])
+        send_alerts_async(other, [([self.user], [])])
+        send_alerts_async(other, [([user], [])])
+        send_alerts_async(self.service, [([self.user], [])])
+        self.assertEqual(fake_apply_async.call_count, 4)
+
+        with patch('cabot.cabotapp.alert.AlertPlugin.send_alerts', wraps=alert_plugin.send_alerts) as send_alerts:
+            send_pending_alerts(*fake_apply_async.call_args_list[0][0][0])
+            send_alerts.assert_called_once_with([(self.service, ANY), (other, ANY)], [self.user])
+            self.assertEqual(fake_send_alert.call_args_list, [call(self.service, ANY, [self.user]),
+                                                              call(other, ANY, [self.user])])
+
+            send_alerts.reset_mock()
+            send_pending_alerts(*fake_apply_async.call_args_list[1][0][0])
+            self.assertFalse(send_alerts.called)
+
+            send_pending_alerts(*fake_apply_async.call_args_list[2][0][0])
+            send_alerts.assert_called_once_with([(other, ANY)], [user])
+
+    @patch('cabot.cabotapp.alert.send_pending_alerts.apply_async')
+    @patch('cabot.cabotapp.alert.AlertPlugin.send_alert')
+    def test_coalesced_fallback_only_failed(self, fake_send_alert, fake_apply_async):
+        """Only the services the duty officers couldn't be alerted about go to the fallback officers"""
+        alert_plugin = AlertPlugin()
+        alert_plugin.save()
+        other = Service.objects.create(name='Other')
+        for service in (self.service, other):
+            service.alerts.add(alert_plugin)
+        fallback = User.objects.create(username='fallback')
+
+        send_alerts_async(self.service, [([self.user], [fallback])])
+        send_alerts_async(other, [([self.user], [fallback])])
+        fake_send_alert.side_effect = [None, RuntimeError, None]
+        send_pending_alerts(*fake_apply_async.call_args[0][0])
+
+        self.assertEqual(fake_send_alert.call_args_list, [call(self.service, ANY, [self.user]),
+                                                          call(other, ANY, [self.user]),
+                                                          call(other, ANY, [fallback])])
+
+    @patch('cabot.cabotapp.alert.send_pending_alerts.apply_async')
+    def test_coalesce_keeps_each_transition(self, fake_apply_async):
+        """A service that fails and recovers within the coalescing window alerts for both"""
+        alert_plugin = AlertPlugin()
+        alert_plugin.save()
+        self.service.alerts.add(alert_plugin)
+        transitions = [(Service.PASSING_STATUS, Service.CRITICAL_STATUS),
+                       (Service.CRITICAL_STATUS, Service.PASSING_STATUS)]
+        for old_status, status in transitions:
+            self.service.old_overall_status, self.service.overall_status = old_status, status
+            send_alerts_async(self.service, [([self.user], [])])
+
+        sent = []
+
+        def send_alert(service, users, duty_officers):
+            sent.append((service.old_overall_status, service.overall_status))
+
+        with patch('cabot.cabotapp.alert.AlertPlugin.send_alert', side_effect=send_alert):
+            send_pending_alerts(*fake_apply_async.call_args[0][0])
+        self.assertEqual(sent, transitions)
+
+    @patch('cabot.cabotapp.alert.send_pending_alerts.apply_async')
+    def test_alert_sent_with_status_when_raised(self, fake_apply_async):
+        """Plugins see the transition that raised the alert, even if the service changed again before it's sent"""
+        alert_plugin = AlertPlugin()
+        alert_plugin.save()
+        self.service.alerts.add(alert_plugin)
+        StatusCheck.objects.filter(pk=self.http_check.pk).update(calculated_status=Service.CALCULATED_FAILING_STATUS)
+        self.service.overall_status, self.service.old_overall_status = Service.CRITICAL_STATUS, Service.PASSING_STATUS
+        send_alerts_async(self.service, [([self.user], [])])
+
+        # the check recovers and the service is updated again
+        StatusCheck.objects.filter(pk=self.http_check.pk).update(calculated_status=Service.CALCULATED_PASSING_STATUS)
+        Service.objects.filter(pk=self.service.pk).update(overall_status=Service.PASSING_STATUS,
+                                                          old_overall_status=Service.PASSING_STATUS)
+
+        sent = []
+
+        def send_alert(service, users, duty_officers):
+            sent.append((service.is_critical, list(service.all_failing_checks())))
+
+        with patch('cabot.cabotapp.alert.AlertPlugin.send_alert', side_effect=send_alert):
+            send_pending_alerts(*fake_apply_async.call_args[0][0])
+        self.assertEqual(sent, [(True, [self.http_check])])
+
 
 class TestAlertCases(LocalTestCase):
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_passing_to_critical(self, fake_alert):
         self.service.update_status()
         self.service.overall_status = Service.PASSING_STATUS
@@ -155,7 +266,7 @@ class TestAlertCases(LocalTestCase):
         self.service.alert()
         self.assertTrue(fake_alert.called)
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_error_to_passing(self, fake_alert):
         self.service.update_status()
         self.service.overall_status = Service.PASSING_STATUS
@@ -164,7 +275,7 @@ class TestAlertCases(LocalTestCase):
         self.service.alert()
         self.assertTrue(fake_alert.called)
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_critical_to_warning(self, fake_alert):
         """Changing status should alert no matter what"""
         self.service.update_status()
@@ -176,7 +287,7 @@ class TestAlertCases(LocalTestCase):
         self.service.alert()
         self.assertTrue(fake_alert.called)
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_warning_to_error(self, fake_alert):
         """Changing status should alert no matter what"""
         self.service.update_status()
@@ -188,7 +299,7 @@ class TestAlertCases(LocalTestCase):
         self.service.alert()
         self.assertTrue(fake_alert.called)
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_error_to_error_outside_interval(self, fake_alert):
         """If ALERT_INTERVAL has passed, error -> error should alert"""
         self.service.update_status()
@@ -199,7 +310,7 @@ class TestAlertCases(LocalTestCase):
         self.service.alert()
         self.assertTrue(fake_alert.called)
 
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_critical_to_critical_inside_interval(self, fake_alert):
         """If ALERT_INTERVAL has not passed, critical -> critical should alert"""
         self.service.update_status()
@@ -0,0 +1,92 @@
+from datetime import timedelta
+import time
+
+from django.utils import timezone
+from mock import patch
+
+from cabot.cabotapp import tasks
+from cabot.cabotapp.models import StatusCheckResult, ServiceStatusSnapshot, Acknowledgement
+from cabot.cabotapp.retention import RetentionDeleter
+from .utils import LocalTestCase
+
+
+@patch('cabot.cabotapp.tasks.clean_db.apply_async')
+class TestCleanDb(LocalTestCase):
+
+    def setUp(self):
+        super(TestCleanDb, self).setUp()
+        old = timezone.now() - timedelta(days=61)
+        self.old_result = StatusCheckResult.objects.create(status_check=self.http_check, time=old,
+                                                           time_complete=old, succeeded=True)
+        self.old_result.add_tags(['old'])
+        self.old_snapshot = ServiceStatusSnapshot.objects.create(service=self.service, time=old,
+                                                                 time_end=old + timedelta(hours=1))
+        self.new_snapshot = ServiceStatusSnapshot.objects.create(service=self.service, time=timezone.now())
+        # a service whose status hasn't changed since before the cutoff
+        self.stable_snapshot = ServiceStatusSnapshot.objects.create(service=self.service, time=old)
+
+    def test_deletes_old_rows(self, apply_async):
+        num_results = StatusCheckResult.objects.count()
+        tasks.clean_db(days_to_retain=60)
+
+        self.assertFalse(StatusCheckResult.objects.filter(pk=self.old_result.pk).exists())
+        self.assertFalse(StatusCheckResult.tags.through.objects.filter(statuscheckresult=self.old_result.pk).exists())
+        self.assertEqual(StatusCheckResult.objects.count(), num_results - 1)
+        self.assertEqual(list(ServiceStatusSnapshot.objects.order_by('id')), [self.new_snapshot, self.stable_snapshot])
+        self.assertFalse(apply_async.called)
+
+    @patch('cabot.cabotapp.tasks.defs.CLEAN_DB_TIME_LIMIT_SECONDS', 0)
+    def test_continues_in_new_task(self, apply_async):
+        tasks.clean_db(days_to_retain=60, batch_sizes={'StatusCheckResult': 400})
+
+        self.assertTrue(StatusCheckResult.objects.filter(pk=self.old_result.pk).exists())
+        apply_async.assert_called_once_with(kwargs={
+            'days_to_retain': 60,
+            'batch_sizes': {'StatusCheckResult': 400, 'ServiceStatusSnapshot': 100, 'Acknowledgement': 100,
+                            'StatusCheckHourlyRollup': 100},
+        }, countdown=3)
+
+    @patch('cabot.cabotapp.tasks.partitions.maintain_partitions')
+    def test_skips_partitioned_tables(self, maintain_partitions, apply_async):
+        maintain_partitions.return_value = {StatusCheckResult}
+        tasks.clean_db(days_to_retain=60)
+
+        self.assertTrue(StatusCheckResult.objects.filter(pk=self.old_result.pk).exists())
+        self.assertFalse(ServiceStatusSnapshot.objects.filter(pk=self.old_snapshot.pk).exists())
+
+
+class TestRetentionDeleter(LocalTestCase):
+
+    def setUp(self):
+        super(TestRetentionDeleter, self).setUp()
+        self.cutoff = timezone.now() - timedelta(days=1)
+        old = self.cutoff - timedelta(hours=1)
+        StatusCheckResult.objects.all().delete()
+        for _ in range(5):
+            StatusCheckResult.objects.create(status_check=self.http_check, time=old, succeeded=True).add_tags(['a'])
+        self.new_result = StatusCheckResult.objects.create(status_check=self.http_check, time=timezone.now())
+
+    @patch('cabot.cabotapp.retention.defs.RETENTION_MIN_BATCH_SIZE', 1)
+    def test_batch_size_grows_when_fast(self):
+        deleter = RetentionDeleter(StatusCheckResult, 'time', self.cutoff)
+        self.assertTrue(deleter.run(deadline=time.time() + 60))
+
+        self.assertEqual(list(StatusCheckResult.objects.all()), [self.new_result])
+        self.assertEqual(StatusCheckResult.tags.through.objects.count(), 0)
+        self.assertEqual(deleter.deleted, 5)
+        # 1 -> 2 -> 4 -> 8
+        self.assertEqual(deleter.batch_size, 8)
+
+    @patch('cabot.cabotapp.retention.defs.RETENTION_TARGET_BATCH_SECONDS', 0)
+    def test_batch_size_shrinks_when_slow(self):
+        deleter = RetentionDeleter(StatusCheckResult, 'time', self.cutoff, batch_size=400)
+        deleter.run(deadline=time.time() + 60)
+        self.assertEqual(deleter.batch_size, 200)
+
+    def test_deletes_m2m_rows(self):
+        ack = Acknowledgement.objects.create(status_check=self.http_check, closed_at=self.cutoff)
+        ack.tags.create(value='b')
+        with self.assertNumQueries(2 + 2 + 2):  # watermark, first id, savepoint + tags + acks + release
+            RetentionDeleter(Acknowledgement, 'closed_at', timezone.now()).run(deadline=time.time() + 60)
+        self.assertFalse(Acknowledgement.objects.exists())
+        self.assertFalse(Acknowledgement.tags.through.objects.exists())
@@ -0,0 +1,166 @@
+from datetime import datetime, timedelta
+from itertools import dropwhile, groupby, izip_longest
+import random
+
+from django.test import override_settings
+from django.utils import timezone
+from mock import patch
+
+from cabot.cabotapp import rollups
+from cabot.cabotapp.models import StatusCheckResult, StatusCheckHourlyRollup, StatusCheckDailyRollup
+from .utils import LocalTestCase
+
+
+class TestRollups(LocalTestCase):
+
+    def setUp(self):
+        super(TestRollups, self).setUp()
+        StatusCheckResult.objects.all().delete()
+        self.day = datetime(2019, 3, 1, tzinfo=timezone.utc)
+        # (minutes into the day, succeeded), across 3 hours and 2 days
+        self.outcomes = [(0, True), (10, False), (20, False), (65, False), (70, True), (125, True), (130, False),
+                         (24 * 60 + 5, False), (24 * 60 + 10, True)]
+        for minutes, succeeded in self.outcomes:
+            time = self.day + timedelta(minutes=minutes)
+            StatusCheckResult.objects.create(status_check=self.http_check, time=time, time_complete=time,
+                                             succeeded=succeeded, acked=minutes == 20)
+        rollups.compact_rollups(self.day, self.day + timedelta(days=2))
+
+    def at(self, minutes):
+        return self.day + timedelta(minutes=minutes)
+
+    def test_hourly(self):
+        hourly = StatusCheckHourlyRollup.objects.filter(status_check=self.http_check).order_by('start')
+        self.assertEqual([(r.start, r.runs, r.successes, r.acked) for r in hourly], [
+            (self.at(0), 3, 1, 1),
+            (self.at(60), 2, 1, 0),
+            (self.at(120), 2, 1, 0),
+            (self.at(24 * 60), 2, 1, 0),
+        ])
+        first = hourly[0]
+        self.assertEqual((first.first_failure, first.last_failure), (self.at(10), self.at(20)))
+        self.assertEqual(first.transitions, [(self.at(0), True), (self.at(10), False)])
+
+    def test_daily(self):
+        daily = StatusCheckDailyRollup.objects.filter(status_check=self.http_check).order_by('start')
+        self.assertEqual([(r.start, r.runs, r.successes) for r in daily], [(self.day, 7, 3),
+                                                                           (self.at(24 * 60), 2, 1)])
+        self.assertEqual((daily[0].first_failure, daily[0].last_failure), (self.at(10), self.at(130)))
+        self.assertEqual(daily[0].transitions, [(self.at(0), True), (self.at(10), False), (self.at(70), True),
+                                                (self.at(130), False)])
+
+    def test_recompute(self):
+        StatusCheckResult.objects.create(status_check=self.http_check, time=self.at(30), succeeded=True)
+        rollups.compact_rollups(self.at(30), self.at(31))
+        self.assertEqual(StatusCheckHourlyRollup.objects.get(start=self.day).runs, 4)
+        self.assertEqual(StatusCheckDailyRollup.objects.get(start=self.day).runs, 8)
+
+    def test_summarize(self):
+        now = self.at(3 * 24 * 60)
+        # a whole day from the daily rollup, plus hours on either side
+        summary = rollups.summarize([self.http_check.id], self.at(60), self.at(24 * 60 + 30))[self.http_check.id]
+        self.assertEqual(summary.runs, 6)
+        self.assertEqual(summary.outages(now), [
+            (self.at(65), self.at(70), timedelta(minutes=5)),
+            (self.at(130), self.at(24 * 60 + 10), timedelta(minutes=24 * 60 - 120)),
+        ])
+
+        summary = rollups.summarize([self.http_check.id], self.day, self.at(2 * 24 * 60))[self.http_check.id]
+        self.assertAlmostEqual(summary.success_rate, 4 / 9.0 * 100)
+        self.assertEqual([(start, end) for start, end, _ in summary.outages(now)], [
+            (self.at(10), self.at(70)),
+            (self.at(130), self.at(24 * 60 + 10)),
+        ])
+
+    @override_settings(TIME_ZONE='America/New_York')
+    def test_days_in_time_zone(self):
+        StatusCheckDailyRollup.objects.all().delete()
+        rollups.compact_rollups(self.day - timedelta(days=1), self.day + timedelta(days=2))
+        # the results on the first UTC day are on Feb 28 in New York (UTC-5), the rest on Mar 1
+        daily = StatusCheckDailyRollup.objects.filter(status_check=self.http_check).order_by('start')
+        self.assertEqual([(r.start, r.runs) for r in daily], [(self.at(-19 * 60), 7), (self.at(5 * 60), 2)])
+
+        # a report for Feb 28 local time reads that day's rollup
+        summary = rollups.summarize([self.http_check.id], self.at(-19 * 60), self.at(5 * 60))[self.http_check.id]
+        self.assertEqual(summary.runs, 7)
+
+    def test_backfill(self):
+        expected = [(r.start, r.runs) for r in StatusCheckDailyRollup.objects.order_by('start')]
+        StatusCheckHourlyRollup.objects.all().delete()
+        StatusCheckDailyRollup.objects.all().delete()
+
+        starts = list(iter(rollups.backfill_rollups, None))
+        self.assertEqual(starts, [self.at(24 * 60), self.day])
+        self.assertEqual([(r.start, r.runs) for r in StatusCheckDailyRollup.objects.order_by('start')], expected)
+        self.assertIsNone(rollups.backfill_rollups())
+
+    def test_backfill_after_first_compaction(self):
+        # the compact_rollups task has only done the last hours so far
+        StatusCheckHourlyRollup.objects.filter(start__lt=self.at(24 * 60)).delete()
+        StatusCheckDailyRollup.objects.all().delete()
+        rollups.compact_rollups(self.at(24 * 60), self.at(24 * 60 + 30))
+
+        self.assertEqual(rollups.backfill_rollups(), self.day)
+        self.assertEqual([(r.start, r.runs) for r in StatusCheckDailyRollup.objects.order_by('start')],
+                         [(self.day, 7), (self.at(24 * 60), 2)])
+
+    def test_summarize_ongoing_outage(self):
+        now = self.at(3 * 60)
+        summary = rollups.summarize([self.http_check.id], self.day, self.at(3 * 60))[self.http_check.id]
+        self.assertEqual(summary.outages(now)[-1], (self.at(130), None, timedelta(minutes=50)))
+
+
+class TestResultTransitions(LocalTestCase):
+
+    def setUp(self):
+        super(TestResultTransitions, self).setUp()
+        StatusCheckResult.objects.all().delete()
+        self.start = datetime(2019, 3, 1, tzinfo=timezone.utc)
+        self.end = self.start + timedelta(hours=5)
+        rand = random.Random(42)
+        time = self.start
+        while time < self.end:
+            for check in (self.http_check, self.tcp_check):
+                StatusCheckResult.objects.create(status_check=check, time=time, succeeded=rand.random() < 0.7)
+            time += timedelta(minutes=rand.randint(1, 5))
+
+    def python_outages(self, check, date_from, date_to, now):
+        """The outage pairing get_report() used to do over every result."""
+        results = check.statuscheckresult_set.filter(time__gte=date_from, time__lt=date_to).order_by('time')
+        groups = dropwhile(lambda item: item[0], groupby(results, key=lambda r: r.succeeded))
+        times = [next(group).time for succeeded, group in groups]
+        pairs = izip_longest(*([iter(times)] * 2))
+        return [(start, end, (end or now) - start) for start, end in pairs]
+
+    def transition_outages(self, check, start, end, now):
+        summary = rollups.RollupSummary()
+        transitions = rollups.result_transitions(start, end, check_ids=[check.id])
+        summary.add_transitions((time, succeeded) for _, time, succeeded in transitions)
+        return summary.outages(now)
+
+    def assert_parity(self):
+        now = self.end
+        for check in (self.http_check, self.tcp_check):
+            for start, end in ((self.start, self.end), (self.start + timedelta(minutes=37), self.end)):
+                expected = self.python_outages(check, start, end, now)
+                self.assertTrue(expected)
+                self.assertEqual(self.transition_outages(check, start, end, now), expected)
+
+    def test_parity(self):
+        self.assert_parity()
+
+    @patch('cabot.cabotapp.rollups._supports_window_functions', lambda: False)
+    def test_parity_without_window_functions(self):
+        self.assert_parity()
+
+    def test_rollup_parity(self):
+        rollups.compact_rollups(self.start, self.end)
+        summary = rollups.summarize([self.http_check.id], self.start, self.end)[self.http_check.id]
+        self.assertEqual(summary.outages(self.end), self.python_outages(self.http_check, self.start, self.end,
+                                                                        self.end))
+
+    def test_only_transitions_returned(self):
+        transitions = list(rollups.result_transitions(self.start, self.end, check_ids=[self.http_check.id]))
+        outcomes = [succeeded for _, _, succeeded in transitions]
+        self.assertTrue(all(a != b for a, b in zip(outcomes, outcomes[1:])))
+        self.assertLess(len(transitions), StatusCheckResult.objects.filter(status_check=self.http_check).count())
@@ -1,9 +1,10 @@
 import os
 
 from django.contrib.auth.models import User
-from datetime import datetime
+from datetime import datetime, timedelta
 
 from django.core.urlresolvers import reverse
+from django.test import RequestFactory
 from django.utils import timezone
 from mock import patch
 
@@ -11,9 +12,10 @@ from cabot.cabotapp import tasks
 from cabot.cabotapp.models import (
     get_duty_officers,
     get_all_duty_officers,
-    update_shifts, Schedule)
+    update_shifts, Schedule, Shift)
 from cabot.cabotapp.schedule_validation import update_schedule_problems
 from cabot.cabotapp.utils import build_absolute_url
+from cabot.cabotapp.views import ShiftListView
 from cabot.metricsapp.defs import SCHEDULE_PROBLEMS_EMAIL_SNOOZE_HOURS
 from .utils import LocalTestCase, fake_calendar, fake_http_404_response, fake_http_200_response
 
@@ -72,6 +74,21 @@ class TestSchedules(LocalTestCase):
         usernames = [str(user.username) for user in officers]
         self.assertEqual(usernames, ['teddy@affirm.com'])
 
+    @patch('cabot.cabotapp.models.requests.get', fake_calendar)
+    def test_duty_officers_from_index(self):
+        """Duty officers are looked up in memory until the shifts are updated"""
+        update_shifts(self.schedule)
+        get_duty_officers(self.schedule)
+        with self.assertNumQueries(0):
+            officers = get_duty_officers(self.schedule, at_time=datetime(2016, 11, 8, 0, 0, 0))
+        self.assertEqual([user.username for user in officers], ['teddy@affirm.com'])
+
+        # shifts updated by another process
+        Shift.objects.filter(schedule=self.schedule).update(deleted=True)
+        Schedule.objects.filter(pk=self.schedule.pk).update(shifts_updated_at=timezone.now())
+        schedule = Schedule.objects.get(pk=self.schedule.pk)
+        self.assertEqual(get_duty_officers(schedule, at_time=datetime(2016, 11, 8, 0, 0, 0)), [])
+
     @patch('cabot.cabotapp.models.requests.get', fake_calendar)
     def test_update_schedule_twice(self):
         """Make sure nothing changes if you update twice"""
@@ -81,6 +98,97 @@ class TestSchedules(LocalTestCase):
             usernames = [str(user.username) for user in officers]
             self.assertEqual(usernames, ['dolores@affirm.com'])
 
+    @patch('cabot.cabotapp.models.requests.get', fake_calendar)
+    def test_update_unchanged_schedule(self):
+        """Updating shifts from an unchanged calendar doesn't write any shifts"""
+        update_shifts(self.schedule)
+        shifts = list(Shift.objects.filter(schedule=self.schedule).values_list('id', 'uid', 'start', 'user', 'deleted'))
+
+        # users, savepoint, version stamp, shifts, release
+        with self.assertNumQueries(5):
+            update_shifts(self.schedule)
+        self.assertEqual(list(Shift.objects.filter(schedule=self.schedule)
+                              .values_list('id', 'uid', 'start', 'user', 'deleted')), shifts)
+
+    @patch('cabot.cabotapp.tasks.update_schedule_problems')
+    @patch('cabot.cabotapp.models.requests.get')
+    def test_update_shifts_only_when_calendar_changed(self, fake_get, fake_update_problems):
+        """The periodic update skips update_shifts() when the iCal feed is unchanged"""
+        fake_get.side_effect = fake_calendar
+        with patch('cabot.cabotapp.tasks.models.update_shifts', wraps=update_shifts) as fake_update_shifts:
+            tasks.update_shift_and_problems(self.schedule.pk)
+            self.assertEqual(fake_update_shifts.call_count, 1)
+            self.assertEqual(fake_get.call_count, 1)
+
+            # same content, the server doesn't support conditional requests
+            tasks.update_shift_and_problems(self.schedule.pk)
+            self.assertEqual(fake_update_shifts.call_count, 1)
+            self.assertEqual(fake_get.call_count, 2)
+            self.assertEqual(fake_update_problems.call_count, 2)
+
+            # the server says it's not modified
+            Schedule.objects.filter(pk=self.schedule.pk).update(ical_etag='"v1"')
+            fake_get.side_effect = None
+            fake_get.return_value.status_code = 304
+            tasks.update_shift_and_problems(self.schedule.pk)
+            self.assertEqual(fake_update_shifts.call_count, 1)
+            self.assertEqual(fake_get.call_args[1]['headers'], {'If-None-Match': '"v1"'})
+
+            # a new user could be on call now
+            fake_get.side_effect = fake_calendar
+            _create_fake_users(['newuser@affirm.com'])
+            tasks.update_shift_and_problems(self.schedule.pk)
+            self.assertEqual(fake_update_shifts.call_count, 2)
+
+        officers = get_duty_officers(self.schedule, at_time=datetime(2016, 11, 6, 0, 0, 0))
+        self.assertEqual([user.username for user in officers], ['dolores@affirm.com'])
+
+    @patch('cabot.cabotapp.views.refresh_shifts')
+    @patch('cabot.cabotapp.models.requests.get')
+    def test_shift_list_refreshes_in_background(self, fake_get, fake_update):
+        """
+        The shift list shows the stored shifts, and only refreshes them (in a task, once) when they're stale
+        """
+        fake_get.side_effect = fake_calendar
+        tasks.update_shift_and_problems(self.schedule.pk)
+        fake_get.reset_mock()
+        shift = Shift.objects.create(schedule=self.schedule, user=self.user, uid='upcoming', start=timezone.now(),
+                                     end=timezone.now() + timedelta(days=1))
+        request = RequestFactory().get(reverse('shifts-detail', kwargs={'pk': self.schedule.pk}))
+        request.user = self.user
+        view = ShiftListView.as_view()
+
+        response = view(request, pk=self.schedule.pk)
+        self.assertEqual(list(response.context_data['shifts']), [shift])
+        self.assertFalse(response.context_data['refreshing'])
+        self.assertFalse(fake_get.called)
+        self.assertFalse(fake_update.apply_async.called)
+
+        Schedule.objects.filter(pk=self.schedule.pk).update(ical_synced_at=timezone.now() - timedelta(hours=1))
+        response = view(request, pk=self.schedule.pk)
+        self.assertEqual(list(response.context_data['shifts']), [shift])
+        self.assertTrue(response.context_data['refreshing'])
+        self.assertFalse(fake_get.called)
+        fake_update.apply_async.assert_called_once_with((self.schedule.pk,))
+
+        # still stale, but the refresh is already queued
+        response = view(request, pk=self.schedule.pk)
+        self.assertTrue(response.context_data['refreshing'])
+        self.assertEqual(fake_update.apply_async.call_count, 1)
+
+    @patch('cabot.cabotapp.tasks.send_schedule_problems_email')
+    @patch('cabot.cabotapp.models.requests.get', fake_calendar)
+    def test_refresh_shifts(self, fake_send_email):
+        """The shift list's refresh updates the shifts, without the problems or their emails"""
+        with patch('cabot.cabotapp.tasks.update_schedule_problems') as fake_update_problems:
+            tasks.refresh_shifts(self.schedule.pk)
+        self.assertFalse(fake_update_problems.called)
+        self.assertFalse(fake_send_email.apply_async.called)
+        schedule = Schedule.objects.get(pk=self.schedule.pk)
+        self.assertFalse(schedule.shifts_stale())
+        officers = get_duty_officers(schedule, at_time=datetime(2016, 11, 6, 0, 0, 0))
+        self.assertEqual([user.username for user in officers], ['dolores@affirm.com'])
+
     @patch('cabot.cabotapp.models.requests.get', fake_calendar)
     def test_multiple_schedules(self):
         """
@@ -1,16 +1,28 @@
 # -*- coding: utf-8 -*-
 
+import calendar
 from datetime import timedelta, datetime, time
+from itertools import product
+from time import mktime
+from unittest import skipUnless
 
 from dateutil import rrule
+from six import StringIO
 from django.core.exceptions import ValidationError
-from django.test import TestCase
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
 from django.utils import timezone
-from cabot.cabotapp import tasks
+from cabot.cabotapp import defs, tasks
+from cabot.cabotapp.fields import CompressedBytes
 from mock import patch, call
-from cabot.cabotapp.models import HttpStatusCheck, Service, clone_model, ActivityCounter
+from cabot.cabotapp.models import HttpStatusCheck, Service, StatusCheck, clone_model, ActivityCounter, \
+    Acknowledgement, StatusCheckResultTag, StatusCheckResult, ServiceStatusSnapshot
+from cabot.cabotapp.recent_results import RecentResults
+from cabot.cabotapp.result_buffer import ResultBuffer, result_buffer
 from cabot.cabotapp.run_window import CheckRunWindow
-from cabot.cabotapp.tasks import update_service, update_all_services
+from cabot.cabotapp.tasks import update_service, update_all_services, update_failing_services, \
+    update_services_for_checks
 from .utils import (
     LocalTestCase,
     fake_jenkins_success,
@@ -26,6 +38,22 @@ from .utils import (
 
 class TestCheckRun(LocalTestCase):
 
+    def test_check_status_summary(self):
+        StatusCheck.objects.filter(pk=self.tcp_check.pk).update(importance=Service.WARNING_STATUS)
+        checks = [self.jenkins_check, self.http_check, self.tcp_check]
+        for statuses in product(dict(Service.STATUSES), repeat=len(checks)):
+            for check, status in zip(checks, statuses):
+                StatusCheck.objects.filter(pk=check.pk).update(calculated_status=status)
+            failing = list(self.service.all_failing_checks())
+            with self.assertNumQueries(1):
+                summary = self.service.check_status_summary()
+            self.assertEqual(summary, (3, len(failing), self.service.most_severe(failing)), statuses)
+
+        for check, status in zip(checks, ['acked', 'failing', 'passing']):
+            StatusCheck.objects.filter(pk=check.pk).update(calculated_status=status)
+        StatusCheck.objects.filter(pk=self.http_check.pk).update(active=False)
+        self.assertEqual(self.service.check_status_summary(), (2, 1, Service.ACKED_STATUS))
+
     def test_calculate_service_status(self):
         self.assertEqual(self.jenkins_check.calculated_status,
                          Service.CALCULATED_PASSING_STATUS)
@@ -40,6 +68,7 @@ class TestCheckRun(LocalTestCase):
         self.most_recent_result.succeeded = False
         self.most_recent_result.save()
         self.http_check.last_run = timezone.now()
+        self.http_check.refresh_recent_results()
         self.http_check.save()
         self.assertEqual(self.http_check.calculated_status,
                          Service.CALCULATED_FAILING_STATUS)
@@ -49,6 +78,7 @@ class TestCheckRun(LocalTestCase):
         # Will fail even if second one is working
         self.older_result.succeeded = True
         self.older_result.save()
+        self.http_check.refresh_recent_results()
         self.http_check.save()
         self.assertEqual(self.http_check.calculated_status,
                          Service.CALCULATED_FAILING_STATUS)
@@ -209,6 +239,7 @@ class TestCheckRun(LocalTestCase):
         self.most_recent_result.succeeded = False
         self.most_recent_result.save()
         self.http_check.last_run = timezone.now()
+        self.http_check.refresh_recent_results()
         self.http_check.save()
         self.assertEqual(self.http_check.calculated_status,
                          Service.CALCULATED_FAILING_STATUS)
@@ -230,12 +261,34 @@ class TestCheckRun(LocalTestCase):
         self.most_recent_result.succeeded = False
         self.most_recent_result.save()
         self.http_check.last_run = timezone.now()
+        self.http_check.refresh_recent_results()
         self.http_check.save()
         self.assertEqual(self.http_check.calculated_status,
                          Service.CALCULATED_FAILING_STATUS)
         update_all_services.apply().get()
         self.assertEqual(Service.objects.get(id=service_id).overall_status, Service.CRITICAL_STATUS)
 
+    def test_update_services_for_checks(self):
+        other = Service.objects.create(name='Other service', alerts_enabled=True)
+        other.status_checks.add(self.tcp_check)
+        self.older_result.succeeded = self.most_recent_result.succeeded = False
+        self.older_result.save()
+        self.most_recent_result.save()
+        self.http_check.last_run = timezone.now()
+        self.http_check.refresh_recent_results()
+        self.http_check.save()
+
+        update_services_for_checks.apply(([self.http_check.pk],)).get()
+        self.assertEqual(Service.objects.get(id=self.service.id).overall_status, Service.CRITICAL_STATUS)
+        self.assertFalse(other.snapshots.exists())
+
+    @patch('cabot.cabotapp.tasks.update_service.apply_async')
+    def test_update_failing_services(self, update_service):
+        Service.objects.create(name='Other service', alerts_enabled=True)
+        Service.objects.filter(pk=self.service.pk).update(overall_status=Service.ERROR_STATUS)
+        update_failing_services.apply().get()
+        update_service.assert_called_once_with((self.service.pk,))
+
 
 class TestStatusCheck(LocalTestCase):
 
@@ -310,6 +363,423 @@ class TestStatusCheck(LocalTestCase):
         check_1.clean()
 
 
+class TestRecentResults(LocalTestCase):
+
+    def test_push(self):
+        recent = RecentResults()
+        self.assertEqual(len(recent), 0)
+        self.assertFalse(recent)
+
+        recent = recent.push(succeeded=False, acked=True).push(succeeded=True)
+        self.assertEqual(len(recent), 2)
+        self.assertEqual([(r.succeeded, r.acked) for r in recent], [(True, False), (False, True)])
+        self.assertTrue(recent[0].succeeded)
+        self.assertTrue(recent[-1].acked)
+        self.assertEqual(len(recent[:1]), 1)
+
+    def test_without_acks(self):
+        recent = RecentResults().push(succeeded=False, acked=True).push(succeeded=True).push(False, acked=True)
+        self.assertEqual([(r.succeeded, r.acked) for r in recent.without_acks()],
+                         [(False, False), (True, False), (False, False)])
+
+    def test_push_drops_oldest(self):
+        recent = RecentResults().push(succeeded=False)
+        for _ in range(RecentResults.SIZE):
+            recent = recent.push(succeeded=True)
+        self.assertEqual(len(recent), RecentResults.SIZE)
+        self.assertTrue(all(r.succeeded for r in recent))
+
+    @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+    def test_run_updates_bitmap(self):
+        for _ in range(RecentResults.SIZE + 2):
+            self.http_check.run()
+        expected = RecentResults.from_results(self.http_check.recent_results())
+        self.assertEqual(self.http_check.recent_results_bitmap, expected)
+        self.assertEqual(StatusCheck.objects.get(pk=self.http_check.pk).recent_results_bitmap, expected)
+        self.assertEqual(self.http_check.cached_health, ','.join(['-1'] * RecentResults.SIZE))
+
+    def test_save_does_not_query_results(self):
+        self.http_check.last_run = timezone.now()
+        self.http_check.refresh_recent_results()
+        self.http_check.save()
+
+        # changing retries re-derives the status from the bitmap
+        self.http_check.retries = 1
+        with self.assertNumQueries(5):  # savepoint + lock and read the stored results + update parent/child + release
+            self.http_check.save()
+        self.assertEqual(self.http_check.calculated_status, Service.CALCULATED_PASSING_STATUS)
+
+    @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+    def test_save_keeps_results_run_since_loaded(self):
+        check = StatusCheck.objects.get(pk=self.http_check.pk)
+        self.http_check.run()
+
+        check.retries = 1
+        check.save()
+        stored = StatusCheck.objects.get(pk=check.pk)
+        self.assertEqual(stored.recent_results_bitmap, self.http_check.recent_results_bitmap)
+        self.assertEqual(stored.last_run, self.http_check.last_run)
+        self.assertEqual(stored.retries, 1)
+
+    def test_save_deleted_check(self):
+        self.http_check.last_run = timezone.now()
+        self.http_check.refresh_recent_results()
+        StatusCheck.objects.filter(pk=self.http_check.pk).delete()
+        self.http_check.save()
+        self.assertFalse(StatusCheck.objects.filter(pk=self.http_check.pk).exists())
+
+
+class TestCheckRunQueryBudget(LocalTestCase):
+    """
+    Pins the number of queries a single StatusCheck.run() costs, since every check runs every few minutes.
+    Counts include the SAVEPOINT/RELEASE pair for run()'s transaction (nested in the test's transaction).
+    """
+    # look up the acks' version (see AckIndex), insert result, update check
+    SUCCESS_QUERIES = 2 + 3
+    # look up the acks' version, insert result, savepoint + insert tags + link tags + release, update check
+    FAILURE_QUERIES = 2 + 7
+
+    def assertRunQueries(self, check, num):
+        check.run()  # the first run after a check is created also initializes its recent results
+        with self.assertNumQueries(num):
+            check.run()
+
+    @patch('cabot.cabotapp.models.requests.request', fake_http_200_response)
+    def test_http_success(self):
+        self.assertRunQueries(self.http_check, self.SUCCESS_QUERIES)
+
+    @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+    def test_http_failure(self):
+        self.assertRunQueries(self.http_check, self.FAILURE_QUERIES)
+
+    @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+    def test_http_failure_acked(self):
+        ack = Acknowledgement(status_check=self.http_check, match_if=Acknowledgement.MATCH_ALL_IN)
+        ack.save()
+        ack.tags.add(StatusCheckResultTag.objects.create(value=HttpStatusCheck.tag_status(404)))
+        # the ack and its tags are cached since the first run
+        self.assertRunQueries(self.http_check, self.FAILURE_QUERIES)
+        self.assertTrue(self.http_check.last_result().acked)
+
+    def test_http_success_closes_ack(self):
+        with patch('cabot.cabotapp.models.requests.request', fake_http_404_response):
+            self.http_check.run()
+            ack = Acknowledgement(status_check=self.http_check, match_if=Acknowledgement.MATCH_CHECK)
+            ack.save()
+            self.http_check.run()
+        # + close the ack, change the check's acks_version; no results are read
+        with patch('cabot.cabotapp.models.requests.request', fake_http_200_response):
+            with self.assertNumQueries(self.SUCCESS_QUERIES + 2):
+                self.http_check.run()
+        ack.refresh_from_db()
+        self.assertEqual(ack.closed_reason, 'check passed')
+
+    @patch('cabot.cabotapp.jenkins.requests.get', fake_jenkins_success)
+    def test_jenkins_failure(self):
+        self.assertRunQueries(self.jenkins_check2, self.FAILURE_QUERIES)
+
+    @patch('cabot.cabotapp.models.socket.create_connection', fake_tcp_success)
+    def test_tcp_success(self):
+        self.assertRunQueries(self.tcp_check, self.SUCCESS_QUERIES)
+
+    @patch('cabot.cabotapp.models.socket.create_connection', fake_tcp_failure)
+    def test_tcp_failure(self):
+        self.assertRunQueries(self.tcp_check, self.FAILURE_QUERIES)
+
+
+class TestSaveResults(LocalTestCase):
+
+    @patch('cabot.cabotapp.models.socket.create_connection', fake_tcp_success)
+    @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+    def test_save_batch(self):
+        for check in (self.http_check, self.tcp_check):
+            check.run()
+        runs = [(check,) + check.probe() for check in (self.http_check, self.tcp_check, self.http_check)]
+
+        # savepoint, look up the acks' versions, insert 3 results (1 query where the ids can be returned from a
+        # bulk insert, e.g. on Postgres), savepoint + insert tags + link tags + release, update checks, release
+        with self.assertNumQueries(9 if connection.features.can_return_ids_from_bulk_insert else 11):
+            StatusCheck.save_results(runs)
+
+        for check in (self.http_check, self.tcp_check):
+            check.refresh_from_db()
+            self.assertEqual(check.recent_results_bitmap, RecentResults.from_results(check.recent_results()))
+        self.assertEqual(self.http_check.recent_results_bitmap[:2], [(False, False)] * 2)
+        self.assertEqual(self.http_check.calculated_status, Service.CALCULATED_FAILING_STATUS)
+        self.assertEqual(self.http_check.last_run, runs[2][1].time_complete)
+        self.assertEqual(self.tcp_check.calculated_status, Service.CALCULATED_PASSING_STATUS)
+        self.assertEqual(runs[0][1].tags.count(), 1)
+
+    @skipUnless(connection.features.can_return_ids_from_bulk_insert, 'bulk inserts return ids on Postgres only')
+    @patch('cabot.cabotapp.models.socket.create_connection', fake_tcp_failure)
+    @patch('cabot.cabotapp.models.requests.request', fake_http_200_response)
+    def test_save_batch_bulk_insert(self):
+        self.tcp_check.raw_data_policy = defs.RAW_DATA_ALWAYS
+        runs = [(check,) + check.probe() for check in (self.tcp_check, self.http_check, self.tcp_check)]
+        runs[2][1].raw_data = 'x' * (defs.RAW_DATA_LIMIT + 1)
+        StatusCheck.save_results(runs)
+
+        # the ids from the bulk insert are the rows' ids, so the tags went to the right results
+        for check, result, tags in runs:
+            stored = StatusCheckResult.objects.get(pk=result.pk)
+            self.assertEqual((stored.status_check_id, stored.succeeded), (check.pk, result.succeeded))
+            self.assertEqual(sorted(stored.tags.values_list('value', flat=True)), sorted(tags))
+        self.assertEqual(len(StatusCheckResult.objects.get(pk=runs[2][1].pk).raw_data), defs.RAW_DATA_LIMIT)
+
+        # each check got its own values from the single UPDATE
+        self.http_check.refresh_from_db()
+        self.tcp_check.refresh_from_db()
+        for check in (self.http_check, self.tcp_check):
+            self.assertEqual(check.recent_results_bitmap, RecentResults.from_results(check.recent_results()))
+        self.assertEqual(self.http_check.recent_results_bitmap[0], (True, False))
+        self.assertEqual(self.tcp_check.recent_results_bitmap[:2], [(False, False)] * 2)
+        self.assertEqual(self.http_check.last_run, runs[1][1].time_complete)
+        self.assertEqual(self.tcp_check.last_run, runs[2][1].time_complete)
+        self.assertEqual(self.http_check.calculated_status, Service.CALCULATED_PASSING_STATUS)
+        self.assertEqual(self.tcp_check.calculated_status, Service.CALCULATED_FAILING_STATUS)
+
+    @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+    def test_save_batch_acked(self):
+        ack = Acknowledgement(status_check=self.http_check, match_if=Acknowledgement.MATCH_CHECK)
+        ack.save()
+        StatusCheck.save_results([(self.http_check,) + self.http_check.probe()])
+        self.assertTrue(self.http_check.last_result().acked)
+        self.assertEqual(StatusCheck.objects.get(pk=self.http_check.pk).calculated_status,
+                         Service.CALCULATED_ACKED_STATUS)
+
+    @patch('cabot.cabotapp.signals.update_services_for_checks.apply_async')
+    @patch('cabot.cabotapp.models.transaction.on_commit', lambda callback: callback())
+    def test_status_changes_update_services(self, update_services_for_checks):
+        def result(check, succeeded):
+            return StatusCheckResult(status_check=check, time=timezone.now(), time_complete=timezone.now(),
+                                     succeeded=succeeded)
+
+        StatusCheck.save_results([(self.http_check, result(self.http_check, True), []),
+                                  (self.tcp_check, result(self.tcp_check, True), [])])
+        self.assertFalse(update_services_for_checks.called)
+
+        StatusCheck.save_results([(self.http_check, result(self.http_check, False), []),
+                                  (self.tcp_check, result(self.tcp_check, False), [])])
+        update_services_for_checks.assert_called_once_with(args=[[self.http_check.pk, self.tcp_check.pk]])
+
+    @patch('cabot.cabotapp.signals.update_services_for_checks.apply_async')
+    @patch('cabot.cabotapp.models.transaction.on_commit', lambda callback: callback())
+    def test_edits_update_services_only_if_status_fields_change(self, update_services_for_checks):
+        self.http_check.name = 'Renamed'
+        self.http_check.save()
+        self.assertFalse(update_services_for_checks.called)
+
+        self.http_check.active = False
+        self.http_check.save()
+        update_services_for_checks.assert_called_once_with(args=[[self.http_check.pk]])
+
+    def _kept_raw_data(self, policy, outcomes):
+        self.http_check.raw_data_policy = policy
+        self.http_check.recent_results_bitmap = RecentResults().push(True)
+        runs = [(self.http_check, StatusCheckResult(status_check=self.http_check, time=timezone.now(),
+                                                    time_complete=timezone.now(), succeeded=succeeded,
+                                                    raw_data='body'), [])
+                for succeeded in outcomes]
+        StatusCheck.save_results(runs)
+        return [StatusCheckResult.objects.get(pk=result.pk).raw_data is not None for _, result, _ in runs]
+
+    def test_raw_data_policies(self):
+        outcomes = [True, False, False, True]
+        self.assertEqual(self._kept_raw_data('always', outcomes), [True, True, True, True])
+        self.assertEqual(self._kept_raw_data('failures', outcomes), [False, True, True, False])
+        self.assertEqual(self._kept_raw_data('transitions', outcomes), [False, True, False, True])
+        self.assertEqual(self._kept_raw_data('never', outcomes), [False, False, False, False])
+
+    @override_settings(RAW_DATA_POLICY='never')
+    def test_default_raw_data_policy(self):
+        self.assertEqual(self._kept_raw_data('', [True, False]), [False, False])
+        self.assertEqual(self._kept_raw_data('always', [True, False]), [True, True])
+
+
+@patch('cabot.cabotapp.result_buffer.ResultBuffer._start_thread')
+@patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
+class TestResultBuffer(LocalTestCase):
+
+    def test_flush_when_full(self, _start_thread):
+        buffer = ResultBuffer(flush_size=2, flush_seconds=60)
+        results = StatusCheckResult.objects.filter(status_check=self.http_check)
+        num_results = results.count()
+        buffer.add(self.http_check, *self.http_check.probe())
+        self.assertEqual(results.count(), num_results)
+
+        buffer.add(self.http_check, *self.http_check.probe())
+        self.assertEqual(results.count(), num_results + 2)
+        self.assertEqual(StatusCheck.objects.get(pk=self.http_check.pk).calculated_status,
+                         Service.CALCULATED_FAILING_STATUS)
+
+    def test_flush_deleted_check(self, _start_thread):
+        buffer = ResultBuffer(flush_size=10, flush_seconds=60)
+        results = StatusCheckResult.objects.filter(status_check=self.http_check)
+        num_results = results.count()
+        buffer.add(self.http_check, *self.http_check.probe())
+        buffer.add(self.tcp_check, *self.tcp_check.probe())
+        StatusCheck.objects.filter(pk=self.tcp_check.pk).delete()
+        buffer.flush()
+        self.assertEqual(results.count(), num_results + 1)
+
+    @override_settings(CHECK_RESULTS_WRITE_BEHIND=True)
+    def test_run_status_check(self, _start_thread):
+        results = StatusCheckResult.objects.filter(status_check=self.http_check)
+        num_results = results.count()
+        tasks.run_status_check(self.http_check.pk)
+        self.assertEqual(results.count(), num_results)
+        # counts as run for the scheduler before it's saved
+        self.http_check.refresh_from_db()
+        self.assertFalse(self.http_check.should_run())
+        result_buffer.flush()
+        self.assertEqual(results.count(), num_results + 1)
+
+
+class TestServiceSnapshots(LocalTestCase):
+
+    def setUp(self):
+        super(TestServiceSnapshots, self).setUp()
+        self.service.update_status()
+        self.first = self.service.snapshot
+
+    def fail_check(self):
+        StatusCheck.objects.filter(pk=self.http_check.pk).update(calculated_status=Service.CALCULATED_FAILING_STATUS)
+
+    def test_unchanged_status_keeps_snapshot(self):
+        self.service.update_status()
+        self.service.update_status()
+        self.assertEqual(list(self.service.snapshots.all()), [self.first])
+        self.assertIsNone(self.service.snapshot.time_end)
+
+    @patch('cabot.cabotapp.models.send_alerts_async')
+    def test_changed_status_ends_snapshot(self, fake_send_alert):
+        self.fail_check()
+        self.service.update_status()
+        self.first.refresh_from_db()
+        self.assertEqual(self.first.time_end, self.service.snapshot.time)
+        self.assertEqual(self.service.snapshot.overall_status, Service.CRITICAL_STATUS)
+        self.assertEqual(self.service.snapshot.num_checks_failing, 1)
+        self.assertIsNone(self.service.snapshot.time_end)
+        self.assertEqual(self.service.snapshots.count(), 2)
+
+    @patch('cabot.cabotapp.models.send_alerts_async')
+    def test_repeated_alert_starts_snapshot(self, fake_send_alert):
+        self.fail_check()
+        self.service.update_status()
+        failing = self.service.snapshot
+
+        self.service.last_alert_sent = timezone.now() - timedelta(days=1)
+        self.service.save()
+        self.service.update_status()
+        self.assertEqual(fake_send_alert.call_count, 2)
+        self.assertNotEqual(self.service.snapshot, failing)
+        self.assertTrue(self.service.snapshot.did_send_alert)
+        failing.refresh_from_db()
+        self.assertTrue(failing.did_send_alert)
+        self.assertEqual(failing.time_end, self.service.snapshot.time)
+
+    @patch('cabot.cabotapp.models.send_alerts_async')
+    def test_alert_for_deleted_service(self, fake_send_alert):
+        self.fail_check()
+        self.service.update_status()
+        self.service.last_alert_sent = None
+        ServiceStatusSnapshot.objects.filter(service=self.service).delete()
+        Service.objects.filter(pk=self.service.pk).delete()
+
+        self.service.alert()
+        self.assertEqual(fake_send_alert.call_count, 1)
+        self.assertFalse(Service.objects.filter(pk=self.service.pk).exists())
+        self.assertFalse(ServiceStatusSnapshot.objects.filter(service_id=self.service.pk).exists())
+
+    def test_recent_snapshots(self):
+        now = timezone.now()
+        self.first.time = now - timedelta(days=2)
+        self.first.time_end = now - timedelta(hours=2)
+        self.first.save()
+        ServiceStatusSnapshot.objects.create(service=self.service, time=now - timedelta(hours=2),
+                                             num_checks_failing=1, overall_status=Service.ERROR_STATUS,
+                                             did_send_alert=True)
+
+        with patch('cabot.cabotapp.models.timezone.now', return_value=now):
+            points = self.service.recent_snapshots
+        times = [now - timedelta(days=1), now - timedelta(hours=2), now - timedelta(hours=2), now]
+        self.assertEqual([p['time'] for p in points], [mktime(t.timetuple()) for t in times])
+        self.assertEqual([p['overall_status'] for p in points],
+                         [Service.PASSING_STATUS, Service.PASSING_STATUS, Service.ERROR_STATUS, Service.ERROR_STATUS])
+        self.assertEqual([p['did_send_alert'] for p in points], [False, False, True, False])
+        self.assertNotIn('time_end', points[0])
+
+    def test_snapshot_history(self):
+        now = timezone.now().replace(microsecond=0)
+        self.first.time = now - timedelta(hours=3)
+        self.first.time_end = now - timedelta(minutes=90)
+        self.first.save()
+        ServiceStatusSnapshot.objects.create(service=self.service, time=now - timedelta(minutes=90),
+                                             time_end=now - timedelta(minutes=80), num_checks_active=3,
+                                             num_checks_failing=2, did_send_alert=True)
+        ServiceStatusSnapshot.objects.create(service=self.service, time=now - timedelta(minutes=80),
+                                             num_checks_active=3, num_checks_failing=1)
+
+        points = self.service.snapshot_history(now - timedelta(hours=2), now, 4)
+        start = calendar.timegm((now - timedelta(hours=2)).utctimetuple())
+        self.assertEqual([p['time'] for p in points], [start + n * 30 * 60 for n in range(4)])
+        self.assertEqual([p['num_checks_failing_min'] for p in points], [0, 0, 1, 1])
+        self.assertEqual([p['num_checks_failing'] for p in points], [0, 2, 1, 1])
+        self.assertEqual([p['num_checks_active'] for p in points], [self.first.num_checks_active, 3, 3, 3])
+        self.assertEqual([p['did_send_alert'] for p in points], [False, True, False, False])
+
+    def test_snapshot_history_before_first_snapshot(self):
+        now = timezone.now()
+        points = self.service.snapshot_history(now - timedelta(hours=2), now + timedelta(minutes=1), 2)
+        self.assertEqual(len(points), 1)
+        self.assertEqual(points[0]['num_checks_failing'], 0)
+
+
+class TestCompressedRawData(LocalTestCase):
+
+    def setUp(self):
+        super(TestCompressedRawData, self).setUp()
+        self.result = StatusCheckResult(status_check=self.http_check, time=timezone.now(),
+                                        raw_data=u'\u2603 body' * 100)
+        self.result.save()
+
+    def test_stored_compressed(self):
+        stored = StatusCheckResult.objects.filter(pk=self.result.pk).values_list('raw_data', flat=True)[0]
+        self.assertIsInstance(stored, CompressedBytes)
+        self.assertLess(len(stored), 100)
+        self.assertEqual(stored.decompress(), u'\u2603 body' * 100)
+
+    def test_decompressed_on_access(self):
+        result = StatusCheckResult.objects.get(pk=self.result.pk)
+        self.assertIsInstance(result.__dict__['raw_data'], CompressedBytes)
+        self.assertEqual(result.raw_data, u'\u2603 body' * 100)
+        self.assertEqual(result.__dict__['raw_data'], u'\u2603 body' * 100)
+
+    def test_deferred(self):
+        result = self.http_check.recent_results()[0]
+        self.assertNotIn('raw_data', result.__dict__)
+        self.assertEqual(result.raw_data, u'\u2603 body' * 100)
+
+    def test_compress_uncompressed(self):
+        StatusCheckResult.objects.filter(pk=self.result.pk).update(raw_data=None, raw_data_uncompressed='old')
+        self.assertEqual(StatusCheckResult.objects.get(pk=self.result.pk).raw_data, 'old')
+
+        call_command('compress_raw_data', batch_size=1, stdout=StringIO())
+        result = StatusCheckResult.objects.get(pk=self.result.pk)
+        self.assertIsNone(result.raw_data_uncompressed)
+        self.assertIsInstance(result.__dict__['raw_data'], CompressedBytes)
+        self.assertEqual(result.raw_data, 'old')
+
+
+class TestResultQueryPlans(LocalTestCase):
+
+    def test_benchmark_uses_indexes(self):
+        out = StringIO()
+        call_command('benchmark_result_queries', rows=5000, checks=5, repeat=1, stdout=out)
+        self.assertNotIn('NOT USING', out.getvalue())
+        self.assertFalse(StatusCheck.objects.filter(name__startswith='benchmark').exists())
+
+
 class TestActivityCounter(TestCase):
 
     def setUp(self):
@@ -441,13 +911,14 @@ class TestRunWindow(LocalTestCase):
 
     @patch('cabot.cabotapp.models.requests.request', fake_http_404_response)
     @patch('cabot.cabotapp.models.timezone.now')
-    @patch('cabot.cabotapp.models.send_alert')
+    @patch('cabot.cabotapp.models.send_alerts_async')
     def test_alerts_outside_run_window(self, mock_send_alert, mock_now):
         start = time(12, 0, 0)
         end = time(13, 30, 0)
         recurrence = rrule.rrule(rrule.WEEKLY, interval=1, byweekday=self.FULL_WEEK)
         self.http_check.run_window = CheckRunWindow([CheckRunWindow.Window(start_time=start, end_time=end,
                                                                            recurrence=recurrence)])
+        self.http_check.save()
 
         inside_window = datetime(2019, 10, 25, 13, 0, 0, 0, tzinfo=timezone.utc)
         outside_window = datetime(2019, 10, 25, 14, 0, 0, 0, tzinfo=timezone.utc)
@@ -1,6 +1,10 @@
+from datetime import timedelta
+
 from django.utils import timezone
+from mock import patch
 
-from cabot.cabotapp import tasks
+from cabot.cabotapp import defs, tasks
+from cabot.cabotapp.db_utils import insert_ignore
 from cabot.cabotapp.models import StatusCheckResult, StatusCheckResultTag
 from .utils import LocalTestCase
 
@@ -38,13 +42,26 @@ class TestTags(LocalTestCase):
         self.assertEqual(len(tags), 50)  # 50 left
         self.assertEqual(list(tags.values_list('value', flat=True)), [u'tag{:03}'.format(i) for i in range(50)])
 
-        # now if we delete the status check results, all tags should all get cleaned up
+        # the tags still in use were marked used, so they're only looked at again once they've been unused for a while
         StatusCheckResult.objects.all().delete()
         tasks.clean_orphaned_tags()
+        self.assertEqual(StatusCheckResultTag.objects.count(), 50)
+
+        # now that the status check results are deleted, all tags should all get cleaned up
+        with patch('cabot.cabotapp.tasks.timezone.now', return_value=now + timedelta(days=defs.TAG_UNUSED_DAYS + 1)):
+            tasks.clean_orphaned_tags()
 
         tags = StatusCheckResultTag.objects.order_by('value')
         self.assertEqual(len(tags), 0)
 
+    def test_clean_orphaned_tags_recently_used(self):
+        StatusCheckResultTag.objects.all().delete()
+        StatusCheckResultTag.ensure_exist(['recent'])
+        StatusCheckResultTag.objects.create(value='old', last_used=timezone.now() - timedelta(days=30))
+
+        tasks.clean_orphaned_tags()
+        self.assertEqual(list(StatusCheckResultTag.objects.values_list('value', flat=True)), ['recent'])
+
     def test_print_tags(self):
         StatusCheckResult.objects.all().delete()
         StatusCheckResultTag.objects.all().delete()
@@ -62,3 +79,49 @@ class TestTags(LocalTestCase):
 
         self.assertEqual(result.print_tags(), 'tag000\ntag001\ntag002\ntag003\ntag004\ntag005\ntag006\ntag007\ntag008'
                                               '\ntag009')
+
+    @patch('cabot.cabotapp.models.HttpStatusCheck._run')
+    def test_run_adds_tags(self, fake_run):
+        tags = ['series_{}'.format(i) for i in range(30)]
+        fake_run.return_value = StatusCheckResult(status_check=self.http_check, succeeded=False), tags + tags[:3] + ['']
+        self.http_check.run()
+
+        result = self.http_check.last_result()
+        self.assertEqual(sorted(result.tags.values_list('value', flat=True)), sorted(tags))
+        self.assertEqual(StatusCheckResultTag.objects.filter(value__in=tags).count(), 30)
+
+    def test_add_tags_skips_too_long(self):
+        now = timezone.now()
+        result = StatusCheckResult(status_check=self.http_check, time=now, time_complete=now, succeeded=False)
+        result.save()
+
+        result.add_tags(['ok', 'x' * 256])
+        self.assertEqual(list(result.tags.values_list('value', flat=True)), ['ok'])
+
+    def test_insert_ignore_batches(self):
+        now = timezone.now()
+        StatusCheckResultTag.objects.create(value='tag_0')
+        rows = [('tag_{}'.format(i), now) for i in range(250)]
+        with self.assertNumQueries(3):
+            insert_ignore(StatusCheckResultTag, ['value', 'last_used'], rows)
+        self.assertEqual(StatusCheckResultTag.objects.filter(value__startswith='tag_').count(), 250)
+
+        # sqlite allows 999 parameters per query
+        rows = [('many_{}'.format(i), now) for i in range(1000)]
+        insert_ignore(StatusCheckResultTag, ['value', 'last_used'], rows, batch_size=1000)
+        self.assertEqual(StatusCheckResultTag.objects.filter(value__startswith='many_').count(), 1000)
+
+    @patch('cabot.cabotapp.models.transaction.on_commit', lambda fn: fn())
+    def test_tag_cache(self):
+        self.addCleanup(StatusCheckResultTag._known_values.clear)
+        now = timezone.now()
+        results = [StatusCheckResult(status_check=self.http_check, time=now, time_complete=now, succeeded=False)
+                   for _ in range(2)]
+        for result in results:
+            result.save()
+
+        with self.assertNumQueries(3):  # mark existing tags used, insert tags, insert result <-> tag rows
+            results[0].add_tags(['cached_a', 'cached_b'])
+        with self.assertNumQueries(1):  # tags are known to exist now
+            results[1].add_tags(['cached_a', 'cached_b'])
+        self.assertEqual(sorted(results[1].tags.values_list('value', flat=True)), ['cached_a', 'cached_b'])
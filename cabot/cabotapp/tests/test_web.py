@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from datetime import timedelta
 from datetime import date
+import json
 import threading
 
 from django.core.urlresolvers import reverse
@@ -10,6 +11,7 @@ from django.utils import timezone
 
 from rest_framework.test import APITransactionTestCase
 
+from cabot.cabotapp import tasks
 from cabot.cabotapp.models import Service, HttpStatusCheck, ServiceStatusSnapshot
 from cabot.cabotapp.views import StatusCheckReportForm, ServiceListView
 from cabot.cabotapp.tests.utils import LocalTestCase
@@ -62,6 +64,7 @@ class TestWebInterface(LocalTestCase):
         self.assertEqual(reloaded.hackpad_id, snippet_link)
 
     def test_checks_report(self):
+        tasks.compact_rollups()
         form = StatusCheckReportForm({
             'service': self.service.id,
             'checks': [self.http_check.id],
@@ -75,6 +78,21 @@ class TestWebInterface(LocalTestCase):
         self.assertEqual(len(check.problems), 1)
         self.assertEqual(check.success_rate, 50)
 
+    def test_service_history(self):
+        self.service.update_status()
+        url = reverse('service-history', kwargs={'pk': self.service.id})
+        self.client.login(username=self.username, password=self.password)
+
+        resp = self.client.get(url, {'hours': 2, 'points': 4})
+        self.assertEqual(resp.status_code, 200)
+        points = json.loads(resp.content)
+        self.assertEqual(len(points), 1)
+        self.assertEqual(points[0]['num_checks_failing'], 0)
+
+        self.assertEqual(self.client.get(url, {'points': 'many'}).status_code, 400)
+        self.assertEqual(self.client.get(url, {'hours': 0}).status_code, 400)
+        self.assertEqual(self.client.get(reverse('service-history', kwargs={'pk': 0})).status_code, 404)
+
     def test_services_list(self):
         """test the services list queryset, since it uses some custom SQL for the active/inactive check counts"""
         # add a disabled check
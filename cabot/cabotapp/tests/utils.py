@@ -188,6 +188,7 @@ def fake_calendar(*args, **kwargs):
     resp = Mock()
     resp.content = get_content(args)
     resp.status_code = 200
+    resp.headers = {}
     return resp
 
 
@@ -9,6 +9,7 @@ from django.conf import settings
 from timezone_field import TimeZoneFormField
 
 from cabot.cabotapp.alert import AlertPlugin
+from cabot.cabotapp import rollups
 from cabot.cabotapp.fields import TimeFromNowField
 from models import (StatusCheck,
                     JenkinsStatusCheck,
@@ -23,9 +24,9 @@ from models import (StatusCheck,
                     get_all_duty_officers,
                     get_single_duty_officer,
                     get_all_fallback_officers,
-                    update_shifts, ScheduleProblems, Acknowledgement)
+                    ScheduleProblems, Acknowledgement)
 
-from tasks import run_status_check as _run_status_check, update_check_and_services
+from tasks import run_status_check as _run_status_check, update_check_and_services, refresh_shifts
 from .decorators import cabot_login_required
 from django.utils.decorators import method_decorator
 from django.views.generic import (DetailView,
@@ -45,13 +46,13 @@ from django.db import transaction
 
 from cabot.cabotapp.utils import format_datetime
 from defs import EXPIRE_AFTER_HOURS_OPTIONS, NUM_VISIBLE_CLOSED_ACKS, ACK_SERVICE_NOT_YET_UPDATED_MSG, \
-    ACK_UPDATE_SERVICE_TIMEOUT_SECONDS
+    ACK_UPDATE_SERVICE_TIMEOUT_SECONDS, SERVICE_HISTORY_HOURS, SERVICE_HISTORY_MAX_HOURS, SERVICE_HISTORY_POINTS, \
+    SERVICE_HISTORY_MAX_POINTS
 from models import AlertPluginUserData
 from django.contrib import messages
 from social_core.exceptions import AuthFailed
 from social_django.views import complete
 
-from itertools import groupby, dropwhile, izip_longest
 import requests
 import json
 import re
@@ -197,7 +198,7 @@ class HttpStatusCheckForm(StatusCheckForm):
             ('Response Validation', ('status_code', 'text_match', 'header_match', 'timeout')),
             ('Authentication', ('username', 'password')),
             ('Advanced', ('allow_http_redirects', 'verify_ssl_certificate', 'use_activity_counter', 'run_delay',
-                          'run_window', 'runbook')),
+                          'run_window', 'runbook', 'raw_data_policy')),
         )
         widgets = dict(**base_widgets)
         widgets.update({
@@ -228,7 +229,7 @@ class JenkinsStatusCheckForm(StatusCheckForm):
         grouped_fields = (
             ('Basic', ('name', 'active', 'importance', 'service_set')),
             ('Jenkins', ('max_queued_build_time', 'max_build_failures', 'retries', 'frequency')),
-            ('Advanced', ('use_activity_counter', 'run_delay', 'run_window', 'runbook')),
+            ('Advanced', ('use_activity_counter', 'run_delay', 'run_window', 'runbook', 'raw_data_policy')),
         )
         widgets = dict(**base_widgets)
 
@@ -239,7 +240,7 @@ class TCPStatusCheckForm(StatusCheckForm):
         grouped_fields = (
             ('Basic', ('name', 'active', 'importance', 'service_set')),
             ('TCP', ('address', 'port', 'timeout', 'frequency', 'retries')),
-            ('Advanced', ('use_activity_counter', 'run_delay', 'run_window', 'runbook')),
+            ('Advanced', ('use_activity_counter', 'run_delay', 'run_window', 'runbook', 'raw_data_policy')),
         )
         widgets = dict(**base_widgets)
         widgets.update({
@@ -366,20 +367,15 @@ class StatusCheckReportForm(forms.Form):
     def get_report(self):
         checks = self.cleaned_data['checks']
         now = timezone.now()
+        start = timezone.make_aware(datetime.combine(self.cleaned_data['date_from'], datetime.min.time()))
+        end = timezone.make_aware(datetime.combine(self.cleaned_data['date_to'] + timedelta(days=1),
+                                                   datetime.min.time()))
+        # read the rollups rather than every result in the range
+        summaries = rollups.summarize([check.id for check in checks], start, end)
         for check in checks:
-            # Group results of the check by status (failed alternating with succeeded),
-            # take time of the first one in each group (starting from a failed group),
-            # split them into pairs and form the list of problems.
-            results = check.statuscheckresult_set.filter(
-                time__gte=self.cleaned_data['date_from'],
-                time__lt=self.cleaned_data['date_to'] + timedelta(days=1)
-            ).order_by('time')
-            groups = dropwhile(lambda item: item[0], groupby(results, key=lambda r: r.succeeded))
-            times = [next(group).time for succeeded, group in groups]
-            pairs = izip_longest(*([iter(times)] * 2))
-            check.problems = [(start, end, (end or now) - start) for start, end in pairs]
-            if results:
-                check.success_rate = results.filter(succeeded=True).count() / float(len(results)) * 100
+            summary = summaries.get(check.id, rollups.RollupSummary())
+            check.problems = summary.outages(now)
+            check.success_rate = summary.success_rate
         return checks
 
 
@@ -653,6 +649,31 @@ class ServiceDetailView(LoginRequiredMixin, DetailView):
         return context
 
 
+class ServiceHistoryView(LoginRequiredMixin, View):
+
+    def get(self, request, pk):
+        '''
+        The service's status over the last `hours`, downsampled to at most `points` points
+        (see Service.snapshot_history()).
+        '''
+        try:
+            hours = int(request.GET.get('hours', SERVICE_HISTORY_HOURS))
+            points = int(request.GET.get('points', SERVICE_HISTORY_POINTS))
+        except ValueError:
+            return json_error_response('hours and points must be integers', 400)
+        if not 0 < hours <= SERVICE_HISTORY_MAX_HOURS or not 0 < points <= SERVICE_HISTORY_MAX_POINTS:
+            return json_error_response('hours must be 1-{} and points 1-{}'.format(SERVICE_HISTORY_MAX_HOURS,
+                                                                                   SERVICE_HISTORY_MAX_POINTS), 400)
+
+        try:
+            service = Service.objects.get(pk=pk)
+        except Service.DoesNotExist:
+            return json_error_response('Service not found', 404)
+
+        now = timezone.now()
+        return json_response(service.snapshot_history(now - timedelta(hours=hours), now, points), 200)
+
+
 class ServiceCreateView(LoginRequiredMixin, CreateView):
     model = Service
     form_class = ServiceForm
@@ -737,18 +758,22 @@ class ShiftListView(LoginRequiredMixin, ListView):
     context_object_name = 'shifts'
 
     def get_queryset(self):
-        schedule = Schedule.objects.get(id=self.kwargs['pk'])
-        update_shifts(schedule)
+        self.schedule = Schedule.objects.select_related('fallback_officer').get(id=self.kwargs['pk'])
+        # show the stored shifts rather than syncing them from the iCal feed in the request
+        self.refreshing = self.schedule.shifts_stale()
+        if self.refreshing and self.schedule.claim_shifts_refresh():
+            refresh_shifts.apply_async((self.schedule.pk,))
         return Shift.objects.filter(
             end__gt=datetime.utcnow().replace(tzinfo=utc),
             deleted=False,
-            schedule=schedule).order_by('start')
+            schedule=self.schedule).select_related('user').order_by('start')
 
     def get_context_data(self, **kwargs):
         context = super(ShiftListView, self).get_context_data(**kwargs)
 
-        context['schedule'] = Schedule.objects.get(id=self.kwargs['pk'])
+        context['schedule'] = self.schedule
         context['schedule_id'] = self.kwargs['pk']
+        context['refreshing'] = self.refreshing
         return context
 
 
@@ -29,6 +29,14 @@ CELERYBEAT_SCHEDULE = {
         'task': 'cabot.cabotapp.tasks.clean_db',
         'schedule': timedelta(seconds=defs.CLEAN_DB_FREQUENCY),
     },
+    'create-partitions': {
+        'task': 'cabot.cabotapp.tasks.create_partitions',
+        'schedule': timedelta(seconds=defs.CREATE_PARTITIONS_FREQUENCY),
+    },
+    'compact-rollups': {
+        'task': 'cabot.cabotapp.tasks.compact_rollups',
+        'schedule': timedelta(seconds=defs.COMPACT_ROLLUPS_FREQUENCY),
+    },
     'clean-orphaned-tags': {
         'task': 'cabot.cabotapp.tasks.clean_orphaned_tags',
         'schedule': timedelta(seconds=defs.CLEAN_ORPHANED_TAGS_FREQUENCY),
@@ -46,12 +54,17 @@ CELERYBEAT_SCHEDULE = {
         'task': 'cabot.cabotapp.tasks.update_all_services',
         'schedule': timedelta(seconds=defs.UPDATE_SERVICE_FREQUENCY)
     },
+    'update-failing-services': {
+        'task': 'cabot.cabotapp.tasks.update_failing_services',
+        'schedule': timedelta(seconds=defs.UPDATE_FAILING_SERVICES_FREQUENCY)
+    },
 }
 
 CELERY_QUEUES = (
     Queue('normal_checks', Exchange('normal_checks', type='direct'), routing_key='normal_checks'),
     Queue('critical_checks', Exchange('critical_checks', type='direct'), routing_key='critical_checks'),
     Queue('service', Exchange('service', type='direct'), routing_key='service'),
+    Queue('alert', Exchange('alert', type='direct'), routing_key='alert'),
     Queue('batch', Exchange('batch', type='direct'), routing_key='batch'),
     Queue('maintenance', Exchange('maintenance', type='direct'), routing_key='maintenance'),
 )
@@ -73,6 +86,18 @@ CELERY_ROUTES = {
         'queue': 'service',
         'routing_key': 'service'
     },
+    'cabot.cabotapp.tasks.update_failing_services': {
+        'queue': 'service',
+        'routing_key': 'service'
+    },
+    'cabot.cabotapp.tasks.update_services_for_checks': {
+        'queue': 'service',
+        'routing_key': 'service'
+    },
+    'cabot.cabotapp.alert.send_pending_alerts': {
+        'queue': 'alert',
+        'routing_key': 'alert',
+    },
     'cabot.cabotapp.tasks.update_shifts_and_problems': {
         'queue': 'batch',
         'routing_key': 'batch',
@@ -81,6 +106,10 @@ CELERY_ROUTES = {
         'queue': 'batch',
         'routing_key': 'batch',
     },
+    'cabot.cabotapp.tasks.refresh_shifts': {
+        'queue': 'batch',
+        'routing_key': 'batch',
+    },
     'cabot.cabotapp.tasks.reset_shifts_and_problems': {
         'queue': 'batch',
         'routing_key': 'batch',
@@ -89,6 +118,14 @@ CELERY_ROUTES = {
         'queue': 'maintenance',
         'routing_key': 'maintenance',
     },
+    'cabot.cabotapp.tasks.create_partitions': {
+        'queue': 'maintenance',
+        'routing_key': 'maintenance',
+    },
+    'cabot.cabotapp.tasks.compact_rollups': {
+        'queue': 'maintenance',
+        'routing_key': 'maintenance',
+    },
     'cabot.cabotapp.tasks.clean_orphaned_tags': {
         'queue': 'maintenance',
         'routing_key': 'maintenance',
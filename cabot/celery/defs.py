@@ -8,6 +8,11 @@ RUN_ALL_CHECKS_FREQUENCY = MINUTE_IN_SECONDS  # 1 minute
 UPDATE_SHIFTS_FREQUENCY = 30 * MINUTE_IN_SECONDS  # 30 minutes
 CLEAN_DB_FREQUENCY = 24 * 60 * MINUTE_IN_SECONDS  # full day
 CLEAN_ORPHANED_TAGS_FREQUENCY = CLEAN_DB_FREQUENCY
+# partitions are created a week ahead, so a few missed runs don't matter
+CREATE_PARTITIONS_FREQUENCY = 60 * MINUTE_IN_SECONDS  # 1 hour
+COMPACT_ROLLUPS_FREQUENCY = 5 * MINUTE_IN_SECONDS  # 5 minutes
 SYNC_ALL_GRAFANA_CHECKS_FREQUENCY = GRAFANA_SYNC_TIMEDELTA_MINUTES * MINUTE_IN_SECONDS
-UPDATE_SERVICE_FREQUENCY = 30
+# services are updated when their checks change, these are safety sweeps (failing services for repeat alerts)
+UPDATE_SERVICE_FREQUENCY = 10 * MINUTE_IN_SECONDS  # 10 minutes
+UPDATE_FAILING_SERVICES_FREQUENCY = MINUTE_IN_SECONDS  # 1 minute
 CLOSE_EXPIRED_ACKNOWLEDGEMENTS_FREQUENCY = MINUTE_IN_SECONDS
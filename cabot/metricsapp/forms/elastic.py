@@ -45,6 +45,7 @@ class ElasticsearchStatusCheckForm(StatusCheckForm):
             'use_activity_counter',
             'run_delay',
             'runbook',
+            'raw_data_policy',
         )
 
     def __init__(self, *args, **kwargs):
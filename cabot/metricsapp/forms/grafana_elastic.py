@@ -34,6 +34,7 @@ _GROUPS = (
         'run_delay',
         'run_window',
         'runbook',
+        'raw_data_policy',
     )),
 )
 
@@ -473,6 +473,24 @@ class TestElasticsearchStatusCheck(TestCase):
         self.assertEqual(str(data['series']), 'avg')
         self.assertEqual(data['datapoints'], [[1536214200, 1.0]])
 
+    @patch('cabot.metricsapp.models.elastic.MultiSearch.execute', fake_es_multiple_metrics_terms)
+    @patch('time.time', mock_time)
+    def test_run_query_budget(self):
+        """A failing run costs a fixed number of queries, no matter how many series fail"""
+        self.es_check.check_type = '<'
+        self.es_check.warning_value = 15
+        self.es_check.high_alert_value = 18
+        self.es_check.save()
+
+        self.es_check.run()
+        # see TestCheckRunQueryBudget (+ look up the source in _run())
+        with self.assertNumQueries(9 + 1):
+            self.es_check.run()
+
+        self.assertEqual(self.es_check.last_result().tags.count(), 3)
+        self.assertEqual(ElasticsearchStatusCheck.objects.get(pk=self.es_check.pk).importance,
+                         Service.CRITICAL_STATUS)
+
 
 class TestQueryValidation(TestCase):
     def test_valid_query(self):
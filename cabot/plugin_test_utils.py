@@ -235,6 +235,7 @@ class PluginTestCase(APITestCase):
             result.save()
 
             check.last_run = now
+            check.refresh_recent_results()
             check.save()
 
         if from_service_status:
@@ -324,3 +324,19 @@ TEST_RUNNER = 'xmlrunner.extra.djangotestrunner.XMLTestRunner'
 TEST_OUTPUT_DIR = os.environ.get('TEST_OUTPUT_DIR', '.')
 
 DISABLE_LOGIN = os.environ.get('DISABLE_LOGIN', 'False').lower() in ['true', 'yes', '1']
+
+# Default for which check results keep their raw data (e.g. response bodies), for checks that don't set their own:
+# always, failures, transitions (results that differ from the previous one) or never
+RAW_DATA_POLICY = os.environ.get('RAW_DATA_POLICY', 'failures')
+
+# Seconds each alert plugin gets to send an alert (on the 'alert' celery queue), twice that with the fallback officers
+ALERT_PLUGIN_TIMEOUT = int(os.environ.get('ALERT_PLUGIN_TIMEOUT', 30))
+# Alerts through the same plugin to the same people within this many seconds are sent together
+ALERT_COALESCE_SECONDS = int(os.environ.get('ALERT_COALESCE_SECONDS', 10))
+
+# Buffer check results in each celery worker process and save them in batches (see cabot.cabotapp.result_buffer)
+CHECK_RESULTS_WRITE_BEHIND = os.environ.get('CHECK_RESULTS_WRITE_BEHIND', 'False').lower() in ['true', 'yes', '1']
+# save buffered results at least this often...
+CHECK_RESULTS_FLUSH_SECONDS = float(os.environ.get('CHECK_RESULTS_FLUSH_SECONDS', 0.5))
+# ...or as soon as this many are buffered
+CHECK_RESULTS_FLUSH_SIZE = int(os.environ.get('CHECK_RESULTS_FLUSH_SIZE', 200))
@@ -37,6 +37,7 @@ from cabot.cabotapp.views import (
 from cabot.cabotapp.views import (
     ServiceListView,
     ServiceDetailView,
+    ServiceHistoryView,
     ServiceUpdateView,
     ServiceCreateView,
     ServiceDeleteView,
@@ -112,6 +113,9 @@ urlpatterns = [
     url(r'^service/delete/(?P<pk>\d+)/',
         view=ServiceDeleteView.as_view(),
         name='delete-service'),
+    url(r'^service/(?P<pk>\d+)/history/$',
+        view=ServiceHistoryView.as_view(),
+        name='service-history'),
     url(r'^service/(?P<pk>\d+)/',
         view=ServiceDetailView.as_view(),
         name='service'),